@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Benchmark the MO cube engines of the Avogadro service.
+
+Run from the flask/avogadro directory:
+
+    python benchmarks/benchmark_mo.py path/to/calculation.cjson --mo 4
+
+Both engines are run on the same grid, the timings and the largest absolute
+difference between the resulting cubes are reported.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import avogadro_api  # noqa: E402
+
+
+def _time(engine, cjson, mo, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = json.loads(avogadro_api.calculate_mo(cjson, mo, engine))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result['cube']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('cjson', help='A calculation cjson with basisSet '
+                                      'and orbitals')
+    parser.add_argument('--mo', type=int, default=0,
+                        help='The molecular orbital index')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs, the best time is reported')
+    config = parser.parse_args()
+
+    with open(config.cjson) as f:
+        cjson = json.load(f)
+
+    cubes = {}
+    for engine in avogadro_api.engines:
+        elapsed, cube = _time(engine, cjson, config.mo, config.repeat)
+        cubes[engine] = cube
+        print('%-10s %10.3f s  dimensions %s' % (engine, elapsed,
+                                                 cube['dimensions']))
+
+    reference = cubes['avogadro']['scalars']
+    numpy_scalars = cubes['numpy']['scalars']
+    if len(reference) == len(numpy_scalars):
+        diff = max(abs(a - b) for a, b in zip(reference, numpy_scalars))
+        print('max abs difference: %g' % diff)
+    else:
+        print('cube sizes differ: %d vs %d' % (len(reference),
+                                               len(numpy_scalars)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,23 @@ from avogadro.core import Molecule, GaussianSetTools
 from avogadro.io import FileFormatManager
 import json
 
+import gaussian_set
+import isosurface
 
-def calculate_mo(cjson, mo):
-    mol = Molecule()
-    conv = FileFormatManager()
-    conv.read_string(mol, json.dumps(cjson), 'cjson')
+engines = ['avogadro', 'numpy']
+
+# Scaling applied to the default spacing for each cube quality.
+qualities = {
+    'low': 2.0,
+    'medium': 1.0,
+    'high': 0.6
+}
+
+DEFAULT_PADDING = 4
+
+
+def cube_spacing(atom_count, quality='medium'):
     # Do some scaling of our spacing based on the size of the molecule.
-    atom_count = mol.atom_count()
     spacing = 0.30
     if atom_count > 50:
         spacing = 0.5
@@ -16,15 +26,97 @@ def calculate_mo(cjson, mo):
         spacing = 0.4
     elif atom_count > 10:
         spacing = 0.33
+
+    return spacing * qualities[quality]
+
+
+def _cube_limits(cjson, quality, spacing, padding):
+    if spacing is None:
+        atom_count = len(cjson['atoms']['elements']['number'])
+        spacing = cube_spacing(atom_count, quality)
+    if padding is None:
+        padding = DEFAULT_PADDING
+
+    return spacing, padding
+
+
+def valid_mos(cjson, mos):
+    # Negative indices would silently select orbitals from the end
+    count = gaussian_set.mo_count(cjson)
+
+    return all(isinstance(mo, int) and not isinstance(mo, bool) and
+               0 <= mo < count for mo in mos)
+
+
+def supported_basis(cjson):
+    # The numpy engine handles the S to F shells, Avogadro handles them all
+    return gaussian_set.supported(cjson)
+
+
+def calculate_mo(cjson, mo, engine='avogadro', quality='medium',
+                 spacing=None, padding=None):
+    spacing, padding = _cube_limits(cjson, quality, spacing, padding)
+
+    # Avogadro computes the shells the numpy engine doesn't support
+    if engine == 'numpy' and gaussian_set.supported(cjson):
+        cjson = dict(cjson)
+        cjson['cube'] = gaussian_set.calculate_mo(cjson, mo, spacing, padding)
+
+        return json.dumps(cjson)
+
+    mol = Molecule()
+    conv = FileFormatManager()
+    conv.read_string(mol, json.dumps(cjson), 'cjson')
     cube = mol.add_cube()
-    # Hard wiring spacing/padding for now, this could be exposed in future too.
-    cube.set_limits(mol, spacing, 4)
+    cube.set_limits(mol, spacing, padding)
     gaussian = GaussianSetTools(mol)
     gaussian.calculate_molecular_orbital(cube, mo)
 
     return conv.write_string(mol, "cjson")
 
 
+def calculate_mos(cjson, mos, quality='medium', spacing=None, padding=None):
+    # The basis set is evaluated once for all the orbitals with the numpy
+    # engine, the orbitals of the basis sets it doesn't support are computed
+    # one by one by Avogadro.
+    if gaussian_set.supported(cjson):
+        engine = 'numpy'
+        spacing, padding = _cube_limits(cjson, quality, spacing, padding)
+        cubes = gaussian_set.calculate_mos(cjson, mos, spacing, padding)
+    else:
+        engine = 'avogadro'
+        cubes = [json.loads(calculate_mo(cjson, mo, engine, quality, spacing,
+                                         padding))['cube']
+                 for mo in mos]
+
+    return {
+        'engine': engine,
+        'cubes': [{'mo': mo, 'cube': cube} for mo, cube in zip(mos, cubes)]
+    }
+
+
+def calculate_density(cjson, quality='medium', spacing=None, padding=None):
+    spacing, padding = _cube_limits(cjson, quality, spacing, padding)
+    cjson = dict(cjson)
+    cjson['cube'] = gaussian_set.calculate_density(cjson, spacing, padding)
+
+    return json.dumps(cjson)
+
+
+def calculate_esp(cjson, quality='medium', spacing=None, padding=None):
+    spacing, padding = _cube_limits(cjson, quality, spacing, padding)
+    cjson = dict(cjson)
+    cjson['cube'] = gaussian_set.calculate_esp(cjson, spacing, padding)
+
+    return json.dumps(cjson)
+
+
+def calculate_isosurface(cube, isovalue, signed=True):
+    return {
+        'isosurfaces': isosurface.extract_all(cube, isovalue, signed)
+    }
+
+
 def convert_str(str_data, in_format, out_format):
     mol = Molecule()
     conv = FileFormatManager()
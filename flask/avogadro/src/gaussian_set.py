@@ -0,0 +1,504 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ANGSTROM_TO_BOHR = 1.889725989
+
+# Shell types as they are stored in the cjson basisSet, these follow the
+# conventions used by Avogadro's cjson reader.
+S = 0
+P = 1
+D = 2
+F = 3
+D5 = -2
+F7 = -3
+
+# The number of grid points evaluated together. Blocks are contiguous in the
+# cube index so they stay compact in space, which makes the shell cutoffs
+# effective.
+BLOCK_SIZE = 4096
+
+# Basis function values smaller than this are treated as zero.
+DEFAULT_THRESHOLD = 1e-10
+
+
+def _s(x, y, z):
+    return [np.ones_like(x)]
+
+
+def _p(x, y, z):
+    return [x, y, z]
+
+
+def _d(x, y, z):
+    # Cartesian, in the order xx, yy, zz, xy, xz, yz
+    n = 1.0 / math.sqrt(3.0)
+    return [n * x * x, n * y * y, n * z * z, x * y, x * z, y * z]
+
+
+def _d5(x, y, z):
+    # Spherical, in the order d0, d+1, d-1, d+2, d-2
+    xx = x * x
+    yy = y * y
+    zz = z * z
+    return [(2.0 * zz - xx - yy) / (2.0 * math.sqrt(3.0)),
+            x * z, y * z, 0.5 * (xx - yy), x * y]
+
+
+def _f(x, y, z):
+    # Cartesian, in the order xxx, yyy, zzz, xyy, xxy, xxz, xzz, yzz, yyz, xyz
+    n3 = 1.0 / math.sqrt(15.0)
+    n2 = 1.0 / math.sqrt(3.0)
+    xx = x * x
+    yy = y * y
+    zz = z * z
+    return [n3 * xx * x, n3 * yy * y, n3 * zz * z,
+            n2 * x * yy, n2 * xx * y, n2 * xx * z,
+            n2 * x * zz, n2 * y * zz, n2 * yy * z, x * y * z]
+
+
+def _f7(x, y, z):
+    # Spherical, in the order f0, f+1, f-1, f+2, f-2, f+3, f-3
+    xx = x * x
+    yy = y * y
+    zz = z * z
+    return [z * (2.0 * zz - 3.0 * xx - 3.0 * yy) / math.sqrt(60.0),
+            x * (4.0 * zz - xx - yy) / math.sqrt(40.0),
+            y * (4.0 * zz - xx - yy) / math.sqrt(40.0),
+            0.5 * z * (xx - yy),
+            x * y * z,
+            x * (xx - 3.0 * yy) / math.sqrt(24.0),
+            y * (3.0 * xx - yy) / math.sqrt(24.0)]
+
+
+# shell type: (angular momentum, number of functions, angular part)
+_shell_info = {
+    S: (0, 1, _s),
+    P: (1, 3, _p),
+    D: (2, 6, _d),
+    D5: (2, 5, _d5),
+    F: (3, 10, _f),
+    F7: (3, 7, _f7)
+}
+
+
+class Shell(object):
+    def __init__(self, shell_type, center, exponents, coefficients,
+                 offset, threshold, detect_normalized=False):
+        if shell_type not in _shell_info:
+            raise ValueError('Unsupported shell type: %s' % shell_type)
+
+        l, count, angular = _shell_info[shell_type]
+
+        self.l = l
+        self.count = count
+        self.angular = angular
+        self.center = center
+        self.offset = offset
+        self.exponents = exponents
+        if detect_normalized and self._is_normalized(coefficients):
+            self.coefficients = coefficients
+        else:
+            # Primitive normalization, as applied by Avogadro's GaussianSet
+            self.coefficients = (coefficients *
+                                 (2.0 * exponents / math.pi) ** 0.75 *
+                                 (4.0 * exponents) ** (l / 2.0))
+        self.cutoff2 = self._cutoff2(threshold)
+
+    def _is_normalized(self, coefficients):
+        # Some codes store coefficients that already include the primitive
+        # normalization, normalizing those again would distort the shell. In
+        # that case the contracted function has unit norm as is.
+        a = self.exponents[:, np.newaxis] + self.exponents[np.newaxis, :]
+        overlap = (math.pi / a) ** 1.5 / (2.0 * a) ** self.l
+        norm = coefficients.dot(overlap).dot(coefficients)
+
+        return abs(norm - 1.0) < 1e-4
+
+    def _cutoff2(self, threshold):
+        # Find the squared distance beyond which every primitive of the shell
+        # drops below the threshold, including the r^l polynomial growth.
+        cutoff2 = 0.0
+        for a, c in zip(self.exponents, np.abs(self.coefficients)):
+            if c <= threshold:
+                continue
+            r2 = math.log(c / threshold) / a
+            for _ in range(3):
+                r2 = (math.log(c / threshold) +
+                      0.5 * self.l * math.log(max(r2, 1.0))) / a
+            cutoff2 = max(cutoff2, r2)
+
+        return cutoff2
+
+    @property
+    def columns(self):
+        return slice(self.offset, self.offset + self.count)
+
+    def evaluate(self, delta, r2):
+        # delta is (n, 3) relative to the shell center, r2 its squared norm
+        radial = np.exp(-np.outer(r2, self.exponents)).dot(self.coefficients)
+        components = self.angular(delta[:, 0], delta[:, 1], delta[:, 2])
+
+        return np.stack(components, axis=1) * radial[:, np.newaxis]
+
+
+class GaussianSet(object):
+    """Vectorized evaluation of the Gaussian basis set stored in a cjson.
+
+    The primitives are normalized as Avogadro's GaussianSet does, so the
+    orbitals match the ones of the Avogadro engine. With detect_normalized
+    the shells whose coefficients already include the primitive
+    normalization are left as is, which the density and ESP rely on.
+    """
+
+    def __init__(self, cjson, threshold=DEFAULT_THRESHOLD,
+                 detect_normalized=False):
+        basis = cjson['basisSet']
+        coords = np.asarray(cjson['atoms']['coords']['3d'], dtype=np.float64)
+        self.atom_positions = coords.reshape(-1, 3)
+
+        centers = self.atom_positions * ANGSTROM_TO_BOHR
+        exponents = np.asarray(basis['exponents'], dtype=np.float64)
+        coefficients = np.asarray(basis['coefficients'], dtype=np.float64)
+
+        self.shells = []
+        offset = 0
+        start = 0
+        for shell_type, atom, primitives in zip(basis['shellTypes'],
+                                                basis['shellToAtomMap'],
+                                                basis['primitivesPerShell']):
+            end = start + primitives
+            shell = Shell(shell_type, centers[atom], exponents[start:end],
+                          coefficients[start:end], offset, threshold,
+                          detect_normalized)
+            self.shells.append(shell)
+            offset += shell.count
+            start = end
+
+        self.function_count = offset
+
+        # Group the shells by center so distances are only computed once
+        self._centers = []
+        by_atom = {}
+        for shell, atom in zip(self.shells, basis['shellToAtomMap']):
+            by_atom.setdefault(atom, []).append(shell)
+        for atom, shells in by_atom.items():
+            cutoff2 = max(shell.cutoff2 for shell in shells)
+            self._centers.append((centers[atom], cutoff2, shells))
+
+    def values(self, points):
+        """Evaluate every basis function at points (n, 3), in Bohr."""
+        values = np.zeros((len(points), self.function_count))
+        lower = points.min(axis=0)
+        upper = points.max(axis=0)
+
+        for center, cutoff2, shells in self._centers:
+            # Skip the center entirely if the block is out of range
+            gap = np.maximum(0.0, np.maximum(lower - center, center - upper))
+            box_distance2 = gap.dot(gap)
+            if box_distance2 > cutoff2:
+                continue
+
+            delta = points - center
+            r2 = np.einsum('ij,ij->i', delta, delta)
+            for shell in shells:
+                if box_distance2 > shell.cutoff2:
+                    continue
+
+                inside = r2 < shell.cutoff2
+                if inside.all():
+                    values[:, shell.columns] = shell.evaluate(delta, r2)
+                else:
+                    index = np.nonzero(inside)[0]
+                    if len(index) > 0:
+                        values[index, shell.columns] = shell.evaluate(
+                            delta[index], r2[index])
+
+        return values
+
+
+def shell_function_count(shell_type):
+    """The number of basis functions of a cartesian or spherical shell."""
+    l = abs(shell_type)
+    if shell_type < 0:
+        return 2 * l + 1
+
+    return (l + 1) * (l + 2) // 2
+
+
+def function_count(cjson):
+    """The number of basis functions of the basis set stored in a cjson."""
+    return sum(shell_function_count(shell_type)
+               for shell_type in cjson['basisSet']['shellTypes'])
+
+
+def supported(cjson):
+    """Whether every shell of the basis set can be evaluated here."""
+    return all(shell_type in _shell_info
+               for shell_type in cjson['basisSet']['shellTypes'])
+
+
+def _mo_matrix(coefficients, count):
+    # The coefficients of each orbital are contiguous. There may be fewer
+    # orbitals than basis functions, with spherical shells or when linear
+    # dependencies were removed.
+    coefficients = np.asarray(coefficients, dtype=np.float64)
+
+    return coefficients.reshape(-1, count).T
+
+
+def mo_count(cjson):
+    """The number of molecular orbitals stored in a cjson.
+
+    0 if the coefficients don't match the basis set.
+    """
+    orbitals = cjson['orbitals']
+    coefficients = orbitals.get('moCoefficients',
+                                orbitals.get('alphaCoefficients'))
+    count = function_count(cjson)
+    if count == 0 or len(coefficients) % count != 0:
+        return 0
+
+    return len(coefficients) // count
+
+
+def mo_coefficients(cjson):
+    """Return the MO coefficients as a (basis functions, orbitals) matrix."""
+    orbitals = cjson['orbitals']
+    # Open shell calculations fall back on the alpha orbitals, as Avogadro does
+    coefficients = orbitals.get('moCoefficients',
+                                orbitals.get('alphaCoefficients'))
+
+    return _mo_matrix(coefficients, function_count(cjson))
+
+
+def occupied_orbitals(cjson):
+    """The occupied orbitals as a list of (coefficients, occupations).
+
+    Restricted calculations give a single pair, unrestricted ones a pair for
+    each spin.
+    """
+    orbitals = cjson['orbitals']
+    electron_count = orbitals.get('electronCount')
+    count = function_count(cjson)
+
+    def _occupied(coefficients, occupations):
+        occupations = np.asarray(occupations, dtype=np.float64)
+        occupied = np.nonzero(occupations)[0]
+
+        return coefficients[:, occupied], occupations[occupied]
+
+    if 'moCoefficients' in orbitals:
+        coefficients = _mo_matrix(orbitals['moCoefficients'], count)
+        occupations = orbitals.get('occupations')
+        if occupations is None:
+            # Fill the orbitals in order, two electrons each
+            occupations = np.zeros(coefficients.shape[1])
+            occupations[:electron_count // 2] = 2.0
+            if electron_count % 2:
+                occupations[electron_count // 2] = 1.0
+
+        return [_occupied(coefficients, occupations)]
+
+    result = []
+    for spin in ['alpha', 'beta']:
+        coefficients = _mo_matrix(orbitals['%sCoefficients' % spin],
+                                   count)
+        occupations = orbitals.get('%sOccupations' % spin)
+        if occupations is None:
+            count = (electron_count + 1) // 2
+            if spin == 'beta':
+                count = electron_count // 2
+            occupations = np.zeros(coefficients.shape[1])
+            occupations[:count] = 1.0
+
+        result.append(_occupied(coefficients, occupations))
+
+    return result
+
+
+class Grid(object):
+    """A regular grid laid out like an Avogadro Cube (x slowest, z fastest)."""
+
+    def __init__(self, origin, dimensions, spacing):
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.dimensions = [int(x) for x in dimensions]
+        self.spacing = float(spacing)
+
+    @classmethod
+    def from_positions(cls, positions, spacing, padding):
+        # Same limits as Cube::setLimits(molecule, spacing, padding)
+        lower = positions.min(axis=0) - padding
+        upper = positions.max(axis=0) + padding
+        dimensions = ((upper - lower) / spacing).astype(int)
+
+        return cls(lower, dimensions, spacing)
+
+    @property
+    def size(self):
+        nx, ny, nz = self.dimensions
+        return nx * ny * nz
+
+    def points(self, start, stop):
+        """The positions (in Angstrom) of the flattened indices [start, stop)."""
+        _, ny, nz = self.dimensions
+        index = np.arange(start, stop)
+        ijk = np.stack([index // (ny * nz), (index // nz) % ny, index % nz],
+                       axis=1)
+
+        return self.origin + ijk * self.spacing
+
+    def blocks(self, block_size=BLOCK_SIZE):
+        return [(start, min(start + block_size, self.size))
+                for start in range(0, self.size, block_size)]
+
+    def to_cjson(self, scalars):
+        return {
+            'dimensions': self.dimensions,
+            'origin': self.origin.tolist(),
+            'spacing': [self.spacing] * 3,
+            'scalars': scalars.tolist()
+        }
+
+
+def _map_blocks(basis, grid, function, columns, workers=None):
+    # Evaluate the basis on each block of the grid and store
+    # function(values) in the rows of the result. The blocks are spread
+    # across a thread pool, numpy releases the GIL for the heavy lifting.
+    result = np.empty((grid.size, columns))
+
+    def _evaluate(block):
+        start, stop = block
+        points = grid.points(start, stop) * ANGSTROM_TO_BOHR
+        result[start:stop] = function(basis.values(points))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    blocks = grid.blocks()
+    if workers > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_evaluate, blocks))
+    else:
+        for block in blocks:
+            _evaluate(block)
+
+    return result
+
+
+def evaluate_on_grid(basis, grid, coefficients, workers=None):
+    """Contract the basis functions on the grid with coefficient vectors.
+
+    coefficients is (basis functions, k), the result is (grid points, k).
+    """
+    return _map_blocks(basis, grid, lambda values: values.dot(coefficients),
+                       coefficients.shape[1], workers)
+
+
+def density_on_grid(basis, grid, orbitals, workers=None):
+    """The electron density (e/Bohr^3) on the grid.
+
+    orbitals is a list of (coefficients, occupations) pairs, one per spin.
+    """
+    def _density(values):
+        density = np.zeros(len(values))
+        for coefficients, occupations in orbitals:
+            amplitudes = values.dot(coefficients)
+            density += (amplitudes * amplitudes).dot(occupations)
+
+        return density[:, np.newaxis]
+
+    return _map_blocks(basis, grid, _density, 1, workers)[:, 0]
+
+
+def calculate_mos(cjson, mos, spacing, padding, workers=None):
+    """Compute the cubes for several molecular orbitals.
+
+    The basis functions are only evaluated once on the grid, and then
+    contracted with the coefficients of every requested orbital.
+    """
+    basis = GaussianSet(cjson)
+    grid = Grid.from_positions(basis.atom_positions, spacing, padding)
+    coefficients = mo_coefficients(cjson)[:, mos]
+    scalars = evaluate_on_grid(basis, grid, coefficients, workers)
+
+    return [grid.to_cjson(scalars[:, i]) for i in range(len(mos))]
+
+
+def calculate_mo(cjson, mo, spacing, padding, workers=None):
+    """Compute the cube for a single molecular orbital."""
+    return calculate_mos(cjson, [mo], spacing, padding, workers)[0]
+
+
+def calculate_density(cjson, spacing, padding, workers=None):
+    """Compute the total electron density cube (e/Bohr^3)."""
+    basis = GaussianSet(cjson, detect_normalized=True)
+    grid = Grid.from_positions(basis.atom_positions, spacing, padding)
+    density = density_on_grid(basis, grid, occupied_orbitals(cjson), workers)
+
+    return grid.to_cjson(density)
+
+
+# The average of 1/r over a unit cube centered on the origin, used for the
+# self term of the Coulomb kernel.
+_UNIT_CUBE_INVERSE_DISTANCE = 2.3800772
+
+
+def _electronic_potential(density, dimensions, spacing):
+    # Solve for the potential of the density with a free space (zero padded)
+    # FFT convolution against the 1/r kernel.
+    shape = [2 * n for n in dimensions]
+    axes = [np.minimum(np.arange(n), n - np.arange(n)) * spacing
+            for n in shape]
+    x, y, z = np.meshgrid(*axes, indexing='ij', sparse=True)
+    distance = np.sqrt(x * x + y * y + z * z)
+    distance[0, 0, 0] = 1.0
+    kernel = 1.0 / distance
+    kernel[0, 0, 0] = _UNIT_CUBE_INVERSE_DISTANCE / spacing
+
+    padded = np.zeros(shape)
+    nx, ny, nz = dimensions
+    padded[:nx, :ny, :nz] = density.reshape(dimensions)
+
+    potential = np.fft.irfftn(np.fft.rfftn(padded) * np.fft.rfftn(kernel),
+                              shape)
+
+    return potential[:nx, :ny, :nz].ravel() * spacing ** 3
+
+
+def calculate_esp(cjson, spacing, padding, workers=None):
+    """Compute the electrostatic potential cube (Hartree/e).
+
+    The nuclear contribution is evaluated exactly, the electronic one by
+    solving the Poisson equation for the density sampled on the grid. The
+    density is rescaled to integrate to the electron count, so the far field
+    is right even when the grid is too coarse to resolve the core density.
+    """
+    basis = GaussianSet(cjson, detect_normalized=True)
+    grid = Grid.from_positions(basis.atom_positions, spacing, padding)
+    orbitals = occupied_orbitals(cjson)
+    density = density_on_grid(basis, grid, orbitals, workers)
+
+    spacing_bohr = grid.spacing * ANGSTROM_TO_BOHR
+    electron_count = sum(occupations.sum() for _, occupations in orbitals)
+    integrated = density.sum() * spacing_bohr ** 3
+    if integrated > 0:
+        density *= electron_count / integrated
+
+    potential = -_electronic_potential(density, grid.dimensions, spacing_bohr)
+
+    charges = np.asarray(cjson['atoms']['elements']['number'],
+                         dtype=np.float64)
+    centers = basis.atom_positions * ANGSTROM_TO_BOHR
+    for start, stop in grid.blocks():
+        points = grid.points(start, stop) * ANGSTROM_TO_BOHR
+        for charge, center in zip(charges, centers):
+            delta = points - center
+            distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+            # Avoid the singularity when a grid point sits on a nucleus
+            distance = np.maximum(distance, 0.5 * spacing_bohr)
+            potential[start:stop] += charge / distance
+
+    return grid.to_cjson(potential)
@@ -0,0 +1,169 @@
+"""Isosurface extraction from cjson cubes.
+
+Surfaces are extracted with marching tetrahedra: every grid cell is split
+into six tetrahedra sharing the cell diagonal, which needs no ambiguity
+tables and produces a closed mesh. Only the cells straddling the isovalue
+are visited, so the cost follows the surface rather than the grid.
+
+Meshes are returned as base64 encoded little endian buffers: float32 vertex
+positions and normals (Angstrom, three per vertex) and uint32 triangle
+indices (three per triangle).
+"""
+import base64
+
+import numpy as np
+
+# The corners of a grid cell, as (i, j, k) offsets.
+_CORNERS = np.array([
+    [0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]
+])
+
+# Six tetrahedra sharing the 0-6 diagonal, indices into _CORNERS.
+_TETRAHEDRA = np.array([
+    [0, 1, 2, 6], [0, 2, 3, 6], [0, 3, 7, 6],
+    [0, 7, 4, 6], [0, 4, 5, 6], [0, 5, 1, 6]
+])
+
+
+def _triangle_table():
+    # For each of the 16 inside/outside cases of a tetrahedron, the
+    # triangles as triples of (vertex, vertex) edges. Winding is fixed up
+    # later from the field gradient.
+    table = []
+    for case in range(16):
+        inside = [v for v in range(4) if case & (1 << v)]
+        outside = [v for v in range(4) if not case & (1 << v)]
+        if len(inside) in (0, 4):
+            table.append([])
+        elif len(inside) in (1, 3):
+            alone = inside[0] if len(inside) == 1 else outside[0]
+            others = [v for v in range(4) if v != alone]
+            table.append([[(alone, v) for v in others]])
+        else:
+            a, b = inside
+            c, d = outside
+            quad = [(a, c), (a, d), (b, d), (b, c)]
+            table.append([[quad[0], quad[1], quad[2]],
+                          [quad[0], quad[2], quad[3]]])
+
+    return table
+
+
+_TRIANGLES = _triangle_table()
+
+
+def _encode(array, dtype):
+    return base64.b64encode(
+        np.ascontiguousarray(array, dtype=dtype).tobytes()).decode('ascii')
+
+
+def _empty_mesh(isovalue):
+    return {
+        'isovalue': isovalue,
+        'vertexCount': 0,
+        'triangleCount': 0,
+        'vertices': '',
+        'normals': '',
+        'indices': ''
+    }
+
+
+def extract(cube, isovalue):
+    """Extract the surface where the cube scalars equal isovalue.
+
+    :param cube: A cjson cube, with dimensions, origin, spacing and scalars.
+    :param isovalue: The value of the surface.
+    :returns: The mesh, see the module documentation for the layout.
+    """
+    dims = tuple(int(d) for d in cube['dimensions'])
+    if min(dims) < 2:
+        return _empty_mesh(isovalue)
+
+    values = np.asarray(cube['scalars'], dtype=float).reshape(dims)
+    origin = np.asarray(cube['origin'], dtype=float)
+    spacing = np.asarray(cube['spacing'], dtype=float)
+
+    # Find the cells straddling the isovalue.
+    inside = values > isovalue
+    cells = tuple(d - 1 for d in dims)
+    any_inside = np.zeros(cells, dtype=bool)
+    all_inside = np.ones(cells, dtype=bool)
+    for di, dj, dk in _CORNERS:
+        corner = inside[di:di + cells[0], dj:dj + cells[1], dk:dk + cells[2]]
+        any_inside |= corner
+        all_inside &= corner
+    active = np.argwhere(any_inside & ~all_inside)
+    if len(active) == 0:
+        return _empty_mesh(isovalue)
+
+    # Flat grid indices of the corners of the tetrahedra, (cells, 6, 4).
+    strides = np.array([dims[1] * dims[2], dims[2], 1])
+    corners = (active[:, None, :] + _CORNERS[None, :, :]) @ strides
+    tets = corners[:, _TETRAHEDRA].reshape(-1, 4)
+
+    flat_inside = inside.ravel()
+    cases = (flat_inside[tets] * np.array([1, 2, 4, 8])).sum(axis=1)
+
+    # Each triangle corner is a grid edge, identified by its two ends.
+    edge_a = []
+    edge_b = []
+    for case in range(1, 15):
+        selected = tets[cases == case]
+        if len(selected) == 0:
+            continue
+        for triangle in _TRIANGLES[case]:
+            ends = np.array(triangle)
+            edge_a.append(selected[:, ends[:, 0]])
+            edge_b.append(selected[:, ends[:, 1]])
+    edge_a = np.concatenate(edge_a)
+    edge_b = np.concatenate(edge_b)
+
+    # Triangles sharing an edge share its vertex.
+    low = np.minimum(edge_a, edge_b)
+    high = np.maximum(edge_a, edge_b)
+    keys, indices = np.unique(low * values.size + high, return_inverse=True)
+    indices = indices.reshape(-1, 3)
+    low = keys // values.size
+    high = keys % values.size
+
+    flat_values = values.ravel()
+    v_low = flat_values[low]
+    v_high = flat_values[high]
+    t = ((isovalue - v_low) / (v_high - v_low))[:, None]
+
+    grid_low = np.column_stack(np.unravel_index(low, dims))
+    grid_high = np.column_stack(np.unravel_index(high, dims))
+    vertices = origin + spacing * (grid_low + t * (grid_high - grid_low))
+
+    # The normals point away from the lobe, down the gradient of |value|.
+    gradient = np.stack(np.gradient(values, *spacing), axis=-1).reshape(-1, 3)
+    normals = gradient[low] + t * (gradient[high] - gradient[low])
+    if isovalue > 0:
+        normals = -normals
+    lengths = np.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1
+    normals /= lengths[:, None]
+
+    # Wind the triangles counter clockwise when seen from the normal side.
+    triangles = vertices[indices]
+    face_normals = np.cross(triangles[:, 1] - triangles[:, 0],
+                            triangles[:, 2] - triangles[:, 0])
+    flip = (face_normals * normals[indices].sum(axis=1)).sum(axis=1) < 0
+    indices[flip] = indices[flip][:, ::-1]
+
+    return {
+        'isovalue': isovalue,
+        'vertexCount': len(vertices),
+        'triangleCount': len(indices),
+        'vertices': _encode(vertices, '<f4'),
+        'normals': _encode(normals, '<f4'),
+        'indices': _encode(indices, '<u4')
+    }
+
+
+def extract_all(cube, isovalue, signed=True):
+    """Extract the surfaces at isovalue, and at -isovalue if signed."""
+    isovalues = [abs(isovalue), -abs(isovalue)] if signed else [isovalue]
+
+    return [extract(cube, value) for value in isovalues]
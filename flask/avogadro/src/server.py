@@ -1,6 +1,6 @@
 import json
 
-from flask import Flask, Response, request
+from flask import Flask, Response, jsonify, request
 
 import avogadro_api as avogadro
 
@@ -17,7 +17,7 @@ def calculate():
     else:
         cjson = json_data['cjson']
         mo = json_data['mo']
-        if not cjson or not mo:
+        if not cjson or mo is None:
             return Response(cjson, status=400, mimetype='application/json')
 
     # Prevent potential segfault by checking for electronic structure
@@ -26,7 +26,102 @@ def calculate():
         return Response(
             json_data['cjson'], status=400, mimetype='application/json')
 
-    return avogadro.calculate_mo(cjson, mo)
+    if not avogadro.valid_mos(cjson, [mo]):
+        return Response(json_data, status=400, mimetype='application/json')
+
+    engine = json_data.get('engine', 'avogadro')
+    if engine not in avogadro.engines:
+        return Response(json_data, status=400, mimetype='application/json')
+
+    quality = json_data.get('quality', 'medium')
+    if quality not in avogadro.qualities:
+        return Response(json_data, status=400, mimetype='application/json')
+
+    return avogadro.calculate_mo(cjson, mo, engine, quality,
+                                 json_data.get('spacing'),
+                                 json_data.get('padding'))
+
+
+@app.route('/calculate-mos', methods=['POST'])
+def calculate_many():
+    json_data = request.get_json()
+
+    # Make sure cjson and mos exist and are not empty
+    if 'cjson' not in json_data or 'mos' not in json_data:
+        return Response(json_data, status=400, mimetype='application/json')
+    else:
+        cjson = json_data['cjson']
+        mos = json_data['mos']
+        if not cjson or not mos or not isinstance(mos, list):
+            return Response(cjson, status=400, mimetype='application/json')
+
+    if ('basisSet' not in json_data['cjson']
+            or 'orbitals' not in json_data['cjson']):
+        return Response(
+            json_data['cjson'], status=400, mimetype='application/json')
+
+    if not avogadro.valid_mos(cjson, mos):
+        return Response(json_data, status=400, mimetype='application/json')
+
+    quality = json_data.get('quality', 'medium')
+    if quality not in avogadro.qualities:
+        return Response(json_data, status=400, mimetype='application/json')
+
+    return jsonify(avogadro.calculate_mos(cjson, mos, quality,
+                                          json_data.get('spacing'),
+                                          json_data.get('padding')))
+
+
+@app.route('/calculate-isosurface', methods=['POST'])
+def calculate_isosurface():
+    json_data = request.get_json()
+
+    # Make sure cube and isovalue exist and are not empty
+    if 'cube' not in json_data or 'isovalue' not in json_data:
+        return Response(json_data, status=400, mimetype='application/json')
+
+    cube = json_data['cube']
+    if not cube or 'scalars' not in cube or 'dimensions' not in cube:
+        return Response(cube, status=400, mimetype='application/json')
+
+    try:
+        isovalue = float(json_data['isovalue'])
+    except (TypeError, ValueError):
+        return Response(json_data, status=400, mimetype='application/json')
+
+    return jsonify(avogadro.calculate_isosurface(
+        cube, isovalue, bool(json_data.get('signed', True))))
+
+
+@app.route('/calculate-<grid_type>', methods=['POST'])
+def calculate_grid(grid_type):
+    calculators = {
+        'density': avogadro.calculate_density,
+        'esp': avogadro.calculate_esp
+    }
+    if grid_type not in calculators:
+        return Response(status=404)
+
+    json_data = request.get_json()
+
+    # Make sure cjson exists and is not empty
+    if 'cjson' not in json_data or not json_data['cjson']:
+        return Response(json_data, status=400, mimetype='application/json')
+
+    cjson = json_data['cjson']
+    if 'basisSet' not in cjson or 'orbitals' not in cjson:
+        return Response(cjson, status=400, mimetype='application/json')
+
+    # Only the numpy engine computes these grids
+    if not avogadro.supported_basis(cjson):
+        return Response(json_data, status=400, mimetype='application/json')
+
+    quality = json_data.get('quality', 'medium')
+    if quality not in avogadro.qualities:
+        return Response(json_data, status=400, mimetype='application/json')
+
+    return calculators[grid_type](cjson, quality, json_data.get('spacing'),
+                                  json_data.get('padding'))
 
 
 @app.route('/convert-str/<output>', methods=['POST'])
@@ -1,4 +1,5 @@
-from .configuration import Configuration
+from .configuration import Configuration, invalidate_configuration
+from girder import events
 from girder.utility import setting_utilities
 from .constants import Features, Branding, Deployment
 
@@ -25,6 +26,10 @@ class AppPlugin(GirderPlugin):
     def load(self, info):
         info['apiRoot'].configuration = Configuration()
 
+        # Recompute the cached configuration when an app setting changes
+        events.bind('model.setting.save.after', 'app', invalidate_configuration)
+        events.bind('model.setting.remove', 'app', invalidate_configuration)
+
         # Twitter and orcid stuff
         info['apiRoot'].user.route('GET', (':id', 'orcid'), get_orcid)
         info['apiRoot'].user.route('POST', (':id', 'orcid'), set_orcid)
@@ -1,6 +1,12 @@
+import cherrypy
+import hashlib
+import json
+import threading
+
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource, RestException
+from girder.api.rest import Resource, RestException, setResponseHeader, \
+    setRawResponse
 from girder.constants import AccessType, TokenScope
 from girder.models.setting import Setting
 from .constants import Features, Deployment, Branding
@@ -16,31 +22,90 @@ class Configuration(Resource):
     @access.public
     @autoDescribeRoute(
         Description('Get the deployment configuration.')
+        .notes('The configuration is cached until an app setting changes, a request '
+               'with its ETag in If-None-Match gets a 304 response.')
     )
     def get(self):
+        configuration, etag = _cached_configuration()
+
+        setResponseHeader('ETag', etag)
+        setResponseHeader('Cache-Control', 'no-cache')
+        if etag in [tag.strip() for tag in
+                    cherrypy.request.headers.get('If-None-Match', '').split(',')]:
+            cherrypy.response.status = 304
+            setRawResponse()
+            return ''
+
+        return configuration
+
+
+def _configuration():
+    notebooks = Setting().get(Features.NOTEBOOKS)
+    if notebooks is None:
+        notebooks = True
+
+    site = Setting().get(Deployment.SITE)
+    if site is None:
+        site = ''
+
+    return {
+        'features': {
+            'notebooks': notebooks
+        },
+        'deployment': {
+            'site': site
+        },
+        'branding': {
+            'license': Setting().get(Branding.LICENSE),
+            'privacy': Setting().get(Branding.PRIVACY),
+            'headerLogoFileId': Setting().get(Branding.HEADER_LOGO_ID),
+            'footerLogoFileId': Setting().get(Branding.FOOTER_LOGO_ID),
+            'footerLogoUrl': Setting().get(Branding.FOOTER_LOGO_URL),
+            'faviconFileId': Setting().get(Branding.FAVICON_ID)
 
-        notebooks = Setting().get(Features.NOTEBOOKS)
-        if notebooks is None:
-            notebooks = True
-
-        site = Setting().get(Deployment.SITE)
-        if site is None:
-            site = ''
-
-        return {
-            'features': {
-                'notebooks': notebooks
-            },
-            'deployment': {
-                'site': site
-            },
-            'branding': {
-                'license': Setting().get(Branding.LICENSE),
-                'privacy': Setting().get(Branding.PRIVACY),
-                'headerLogoFileId': Setting().get(Branding.HEADER_LOGO_ID),
-                'footerLogoFileId': Setting().get(Branding.FOOTER_LOGO_ID),
-                'footerLogoUrl': Setting().get(Branding.FOOTER_LOGO_URL),
-                'faviconFileId': Setting().get(Branding.FAVICON_ID)
-
-            }
         }
+    }
+
+
+# The configuration and its ETag, computed once until an app setting changes
+_cache = None
+# The app settings being removed, the remove event is triggered before they
+# are deleted
+_removed = set()
+_cache_lock = threading.Lock()
+
+
+def _compute():
+    configuration = _configuration()
+    digest = hashlib.sha1(json.dumps(
+        configuration, sort_keys=True, default=str).encode()).hexdigest()
+
+    return configuration, '"%s"' % digest
+
+
+def _cached_configuration():
+    global _cache
+    with _cache_lock:
+        if _removed:
+            if Setting().collection.count_documents(
+                    {'key': {'$in': list(_removed)}}) > 0:
+                # Not deleted yet, don't cache the values being removed
+                return _compute()
+            _removed.clear()
+
+        if _cache is None:
+            _cache = _compute()
+
+        return _cache
+
+
+def invalidate_configuration(event):
+    global _cache
+    key = event.info.get('key')
+    if isinstance(key, str) and key.startswith('app.'):
+        with _cache_lock:
+            if event.name == 'model.setting.remove':
+                _removed.add(key)
+            else:
+                _removed.discard(key)
+            _cache = None
@@ -4,18 +4,27 @@ from .molecule import Molecule
 from .calculation import Calculation
 from .experiment import Experiment
 from girder import events
+from girder.constants import TerminalColor
 from girder.models.model_base import ValidationException
 from girder.utility.model_importer import ModelImporter
 from .constants import PluginSettings
+from . import settings
+from .utilities import async_requests
 from girder.utility import setting_utilities
 
 from .models.calculation import Calculation as CalculationModel
 from .models.cubecache import Cubecache as CubecacheModel
 from .models.experimental import Experimental as ExperimentalModel
 from .models.geometry import Geometry as GeometryModel
+from .models.isosurfacecache import Isosurfacecache as IsosurfacecacheModel
 from .models.molecule import Molecule as MoleculeModel
+from .models.namecache import Namecache as NamecacheModel
+from .models.nistcache import Nistcache as NistcacheModel
+from .models.spectrumcache import Spectrumcache as SpectrumcacheModel
+from .models.task import Task as TaskModel
+from .models.vibrationalmode import VibrationalMode as VibrationalModeModel
 
-from girder.plugin import GirderPlugin
+from girder.plugin import getPlugin, GirderPlugin
 
 
 @setting_utilities.validator({
@@ -40,6 +49,8 @@ class MoleculesPlugin(GirderPlugin):
 
 
     def load(self, info):
+        getPlugin('jobs').load(info)
+
         # Register models for ModelImporter
         ModelImporter.registerModel('calculation', CalculationModel,
                                     'molecules')
@@ -47,10 +58,38 @@ class MoleculesPlugin(GirderPlugin):
         ModelImporter.registerModel('experimental', ExperimentalModel,
                                     'molecules')
         ModelImporter.registerModel('geometry', GeometryModel, 'molecules')
+        ModelImporter.registerModel('isosurfacecache', IsosurfacecacheModel,
+                                    'molecules')
         ModelImporter.registerModel('molecule', MoleculeModel, 'molecules')
+        ModelImporter.registerModel('namecache', NamecacheModel, 'molecules')
+        ModelImporter.registerModel('nistcache', NistcacheModel, 'molecules')
+        ModelImporter.registerModel('spectrumcache', SpectrumcacheModel,
+                                    'molecules')
+        ModelImporter.registerModel('task', TaskModel, 'molecules')
+        ModelImporter.registerModel('vibrationalmode', VibrationalModeModel,
+                                    'molecules')
+
+        # The experiments stored before their spectra were packed have no
+        # range to be selected on
+        migrated = ExperimentalModel().migrate_unpacked()
+        if migrated:
+            print(TerminalColor.info('Packed the spectra of %d experiments.' %
+                                     migrated))
 
         info['apiRoot'].molecules = Molecule()
         info['apiRoot'].calculations = Calculation()
         info['apiRoot'].experiments = Experiment()
         events.bind('model.setting.validate', 'molecules',
                     validateSettings)
+
+        # Keep the in-memory copy of the plugin settings up to date
+        settings.refresh()
+        events.bind('model.setting.save.after', 'molecules',
+                    settings.on_setting_saved)
+        events.bind('model.setting.remove', 'molecules',
+                    settings.on_setting_removed)
+
+        # Run the tasks left by a previous run once the server has started
+        events.bind(async_requests.RECOVER_TASKS_EVENT, 'molecules',
+                    async_requests.recover_tasks)
+        events.daemon.trigger(async_requests.RECOVER_TASKS_EVENT)
@@ -4,19 +4,13 @@ import requests
 from avogadro.core import Molecule
 from avogadro.io import FileFormatManager
 
-from girder.models.setting import Setting
-
 from jsonpath_rw import parse
 
-from molecules.constants import PluginSettings
+from molecules.settings import settings_snapshot
 
 
 def avogadro_base_url():
-    base_url = Setting().get(PluginSettings.AVOGADRO_BASE_URL)
-    if base_url is None:
-        base_url = 'http://localhost:5001'
-
-    return base_url
+    return settings_snapshot().avogadro_base_url
 
 
 def convert_str(str_data, in_format, out_format):
@@ -139,7 +133,7 @@ def calculation_properties(json_data):
     return properties
 
 
-def calculate_mo(cjson, mo):
+def calculate_mo(cjson, mo, quality=None, engine=None):
     base_url = avogadro_base_url()
     path = 'calculate-mo'
     url = '/'.join([base_url, path])
@@ -149,7 +143,76 @@ def calculate_mo(cjson, mo):
         'mo': mo,
     }
 
+    if quality is not None:
+        data['quality'] = quality
+
+    if engine is not None:
+        data['engine'] = engine
+
+    r = requests.post(url, json=data)
+    r.raise_for_status()
+
+    return r.json()
+
+
+def calculate_mos(cjson, mos, quality=None):
+    base_url = avogadro_base_url()
+    path = 'calculate-mos'
+    url = '/'.join([base_url, path])
+
+    data = {
+        'cjson': cjson,
+        'mos': mos,
+    }
+
+    if quality is not None:
+        data['quality'] = quality
+
     r = requests.post(url, json=data)
     r.raise_for_status()
 
+    # The cubes and the engine that computed them
     return r.json()
+
+
+def calculate_isosurface(cube, isovalue, signed=True):
+    base_url = avogadro_base_url()
+    path = 'calculate-isosurface'
+    url = '/'.join([base_url, path])
+
+    data = {
+        'cube': cube,
+        'isovalue': isovalue,
+        'signed': signed
+    }
+
+    r = requests.post(url, json=data)
+    r.raise_for_status()
+
+    return r.json()['isosurfaces']
+
+
+def calculate_grid(cjson, grid_type, quality=None):
+    base_url = avogadro_base_url()
+    path = 'calculate-%s' % grid_type
+    url = '/'.join([base_url, path])
+
+    data = {
+        'cjson': cjson,
+    }
+
+    if quality is not None:
+        data['quality'] = quality
+
+    r = requests.post(url, json=data)
+    r.raise_for_status()
+
+    return r.json()
+
+
+def calculate_density(cjson, quality=None):
+    return calculate_grid(cjson, 'density', quality)
+
+
+def calculate_esp(cjson, quality=None):
+    return calculate_grid(cjson, 'esp', quality)
@@ -1,4 +1,5 @@
 import cherrypy
+import re
 import tempfile
 from jsonpath_rw import parse
 from bson.objectid import ObjectId
@@ -13,12 +14,16 @@ from girder.api.rest import Resource
 from girder.api.rest import RestException, getBodyJson, getCurrentUser, \
     loadmodel
 from girder.models.model_base import ValidationException
+from girder.utility import toBool
 from girder.utility.model_importer import ModelImporter
 from girder.models.file import File
 from girder.constants import AccessType, SortDir, TokenScope
+from molecules.constants import CubeEngine, CubeQuality
 from molecules.models.calculation import Calculation as CalculationModel
 from molecules.utilities.molecules import create_molecule
 from molecules.utilities import async_requests
+from molecules.utilities.cube import cube_cjson
+from molecules.utilities import spectrum as spectrum_utils
 
 from . import avogadro
 from . import openbabel
@@ -42,14 +47,24 @@ class Calculation(Resource):
             self.get_calc_vibrational_modes)
         self.route('GET', (':id', 'vibrationalmodes', ':mode'),
             self.get_calc_vibrational_mode)
+        self.route('GET', (':id', 'spectrum'),
+            self.get_calc_spectrum)
         self.route('GET', (':id', 'sdf'),
             self.get_calc_sdf)
         self.route('GET', (':id', 'cjson'),
             self.get_calc_cjson)
         self.route('GET', (':id', 'xyz'),
             self.get_calc_xyz)
+        self.route('GET', (':id', 'cube', 'density'),
+            self.get_calc_density)
+        self.route('GET', (':id', 'cube', 'esp'),
+            self.get_calc_esp)
+        self.route('GET', (':id', 'cube', ':mo', 'isosurface'),
+            self.get_calc_isosurface)
         self.route('GET', (':id', 'cube', ':mo'),
             self.get_calc_cube)
+        self.route('GET', (':id', 'cubes'),
+            self.get_calc_cubes)
         self.route('GET', (':id',),
             self.find_id)
         self.route('PUT', (':id', 'properties'),
@@ -58,26 +73,43 @@ class Calculation(Resource):
 
         self._model = ModelImporter.model('calculation', 'molecules')
         self._cube_model = ModelImporter.model('cubecache', 'molecules')
+        self._isosurface_model = ModelImporter.model('isosurfacecache',
+                                                     'molecules')
+        self._mode_model = ModelImporter.model('vibrationalmode', 'molecules')
+        self._spectrum_model = ModelImporter.model('spectrumcache', 'molecules')
+
+    def _split_modes(self, calc):
+        # Calculations created before modes were stored on their own are
+        # split on first access.
+        if self._mode_model.has_modes(calc['_id']):
+            return False
+
+        calc = self._model.findOne({'_id': calc['_id']},
+                                   fields=['cjson.vibrations'])
+
+        return self._mode_model.set_modes(calc) > 0
 
     @access.public
     def get_calc_vibrational_modes(self, id, params):
 
-        # TODO: remove 'cjson' once girder issue #2883 is resolved
-        fields = ['cjson', 'cjson.vibrations.modes', 'cjson.vibrations.intensities',
-                 'cjson.vibrations.frequencies', 'access']
+        # Only the access fields are needed to check permissions
+        calc = self._model.load(id, fields=['access', 'public'],
+                                user=getCurrentUser(), level=AccessType.READ)
 
-        calc = self._model.load(id, fields=fields, user=getCurrentUser(),
-                                 level=AccessType.READ)
+        self._split_modes(calc)
 
-        del calc['access']
+        vibrations = {'modes': [], 'intensities': [], 'frequencies': []}
+        for vibrational_mode in self._mode_model.list_modes(calc['_id']):
+            vibrations['modes'].append(vibrational_mode['mode'])
+            vibrations['frequencies'].append(vibrational_mode['frequency'])
+            vibrations['intensities'].append(vibrational_mode['intensity'])
 
-        if 'cjson' in calc and 'vibrations' in calc['cjson']:
-            return calc['cjson']['vibrations']
-        else:
-            return {'modes': [], 'intensities': [], 'frequencies': []}
+        return vibrations
 
     get_calc_vibrational_modes.description = (
         Description('Get the vibrational modes associated with a calculation')
+        .notes('The eigenvectors are not included, fetch a single mode to get '
+               'its eigenvector.')
         .param(
             'id',
             'The id of the calculation to get the modes from.',
@@ -91,44 +123,24 @@ class Calculation(Resource):
         except ValueError:
             raise ValidationException('mode number be an integer', 'mode')
 
-        # TODO: remove 'cjson' once girder issue #2883 is resolved
-        fields = ['cjson', 'cjson.vibrations.modes', 'access']
-        calc = self._model.load(id, fields=fields, user=getCurrentUser(),
-                                 level=AccessType.READ)
+        # Only the access fields are needed to check permissions
+        calc = self._model.load(id, fields=['access', 'public'],
+                                user=getCurrentUser(), level=AccessType.READ)
 
-        vibrational_modes = calc['cjson']['vibrations']
-        #frames = vibrational_modes.get('modeFrames')
-        modes = vibrational_modes.get('modes', [])
+        vibrational_mode = self._mode_model.find_mode(calc['_id'], mode)
+        if vibrational_mode is None and self._split_modes(calc):
+            vibrational_mode = self._mode_model.find_mode(calc['_id'], mode)
 
-        index = modes.index(mode)
-        if index < 0:
+        if vibrational_mode is None:
             raise RestException('No such vibrational mode', 400)
 
-        # Now select the modeFrames directly this seems to be more efficient
-        # than iterating in Python
-        query = {
-            '_id': calc['_id']
-        }
-
-        projection = {
-            'cjson.vibrations.frequencies': {
-                '$slice': [index, 1]
-            },
-            'cjson.vibrations.intensities': {
-                '$slice': [index, 1]
-            },
-            'cjson.vibrations.eigenVectors': {
-                '$slice': [index, 1]
-            },
-            'cjson.vibrations.modes': {
-                '$slice': [index, 1]
-            }
+        return {
+            'modes': [vibrational_mode['mode']],
+            'frequencies': [vibrational_mode['frequency']],
+            'intensities': [vibrational_mode['intensity']],
+            'eigenVectors': [vibrational_mode['eigenVector']]
         }
 
-        mode = self._model.findOne(query, fields=projection)
-
-        return mode['cjson']['vibrations']
-
     get_calc_vibrational_mode.description = (
         Description('Get a vibrational mode associated with a calculation')
         .param(
@@ -140,6 +152,120 @@ class Calculation(Resource):
             'The index of the vibrational model to get.',
             dataType='string', required=True, paramType='path'))
 
+    def _matching_experiments(self, calc, user):
+        if 'moleculeId' not in calc:
+            return []
+
+        molecule = ModelImporter.model('molecule', 'molecules').load(
+            calc['moleculeId'], fields=['properties.formula'], force=True)
+        formula = molecule.get('properties', {}).get('formula') \
+            if molecule else None
+        if not formula:
+            return []
+
+        # Experimental formulas spell out counts of one, e.g. C2H6O1
+        explicit = re.sub(r'([A-Z][a-z]?)(?![a-z\d])', r'\g<1>1', formula)
+        query = {
+            'molecularFormula': {
+                '$in': [formula, explicit]
+            }
+        }
+        fields = ['_id', 'name', 'spectrumType', 'measuredSpectrum', 'access',
+                  'public']
+
+        return list(ModelImporter.model('experimental', 'molecules')
+                    .findWithPermissions(query, fields=fields, user=user,
+                                         level=AccessType.READ))
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Get the broadened vibrational spectrum of a calculation.')
+        .notes('The broadened curve is cached for each set of parameters.')
+        .param('id', 'The id of the calculation.', paramType='path')
+        .param('spectrumType', 'The intensities to use.', required=False,
+               enum=['ir', 'raman'], default='ir')
+        .param('lineShape', 'The shape of the broadened lines.',
+               required=False, enum=spectrum_utils.LINE_SHAPES,
+               default=spectrum_utils.GAUSSIAN)
+        .param('width', 'The full width at half maximum of the lines (cm-1).',
+               required=False, dataType='number', default=10.0)
+        .param('minFrequency', 'The start of the spectrum (cm-1).',
+               required=False, dataType='number', default=0.0)
+        .param('maxFrequency', 'The end of the spectrum (cm-1).',
+               required=False, dataType='number', default=4000.0)
+        .param('points', 'The number of points of the spectrum.',
+               required=False, dataType='integer', default=1000)
+        .param('experimental', 'Also return the experimental spectra of the '
+               'molecule, interpolated on the same frequencies.',
+               required=False, dataType='boolean', default=False)
+    )
+    def get_calc_spectrum(self, id, spectrumType, lineShape, width,
+                          minFrequency, maxFrequency, points, experimental):
+        if width <= 0:
+            raise RestException('width must be positive.', 400)
+        if maxFrequency <= minFrequency:
+            raise RestException('maxFrequency must be greater than '
+                                'minFrequency.', 400)
+        if points < 2 or points > 100000:
+            raise RestException('points must be between 2 and 100000.', 400)
+
+        user = getCurrentUser()
+        calc = self._model.load(id, fields=['moleculeId', 'access', 'public'],
+                                user=user, level=AccessType.READ)
+
+        parameters = {
+            'spectrumType': spectrumType,
+            'lineShape': lineShape,
+            'width': width,
+            'minFrequency': minFrequency,
+            'maxFrequency': maxFrequency,
+            'points': points
+        }
+
+        cached = self._spectrum_model.find_spectrum(calc['_id'], parameters)
+        if cached:
+            spectrum = cached['spectrum']
+        else:
+            intensities_key = 'intensities' if spectrumType == 'ir' \
+                else 'ramanIntensities'
+            fields = ['cjson.vibrations.frequencies',
+                      'cjson.vibrations.%s' % intensities_key]
+            doc = self._model.findOne({'_id': calc['_id']}, fields=fields)
+            vibrations = doc.get('cjson', {}).get('vibrations', {})
+            frequencies = vibrations.get('frequencies', [])
+            intensities = vibrations.get(intensities_key)
+            if intensities is None:
+                raise RestException('The calculation has no %s intensities.' %
+                                    spectrumType, 400)
+
+            grid, values = spectrum_utils.broaden(
+                frequencies, intensities, lineShape, width, minFrequency,
+                maxFrequency, points)
+            spectrum = {
+                'frequencies': grid.tolist(),
+                'intensities': values.tolist()
+            }
+            self._spectrum_model.create(calc['_id'], parameters, spectrum)
+
+        result = dict(parameters, **spectrum)
+
+        if experimental:
+            result['experimental'] = []
+            experimental_model = ModelImporter.model('experimental',
+                                                     'molecules')
+            for experiment in self._matching_experiments(calc, user):
+                values = spectrum_utils.resample(
+                    spectrum['frequencies'],
+                    *experimental_model.spectrum_values(experiment))
+                result['experimental'].append({
+                    '_id': experiment['_id'],
+                    'name': experiment.get('name'),
+                    'spectrumType': experiment.get('spectrumType'),
+                    'intensities': values.tolist()
+                })
+
+        return result
+
     @access.public
     @loadmodel(model='calculation', plugin='molecules', level=AccessType.READ)
     def get_calc_sdf(self, calculation, params):
@@ -188,9 +314,7 @@ class Calculation(Resource):
             'The id of the calculation to return the structure for.',
             dataType='string', required=True, paramType='path'))
 
-    @access.public
-    def get_calc_cube(self, id, mo, params):
-        orig_mo = mo
+    def _resolve_mo(self, id, mo):
         try:
             mo = int(mo)
         except ValueError:
@@ -221,7 +345,42 @@ class Calculation(Resource):
             else:
                 raise ValidationException('mo number be an integer or \'homo\'/\'lumo\'', 'mode')
 
-        cached = self._cube_model.find_mo(id, mo)
+        return mo
+
+    def _load_readable(self, id, fields=None):
+        # Only the access fields are needed to check permissions
+        fields = ['access', 'public'] + (fields or [])
+
+        return self._model.load(id, fields=fields, user=getCurrentUser(),
+                                level=AccessType.READ)
+
+    def _cube_quality(self, params):
+        quality = params.get('quality', CubeQuality.MEDIUM)
+        if quality not in CubeQuality.QUALITIES:
+            raise RestException('Invalid quality, it must be one of: %s' %
+                                ', '.join(CubeQuality.QUALITIES), 400)
+
+        return quality
+
+    def _calculate_cube(self, id, mo, quality, calc):
+        cjson = avogadro.calculate_mo(calc['cjson'], mo, quality=quality,
+                                      engine=CubeEngine.DEFAULT)
+
+        # Remove the vibrational mode data from the cube - big, not needed here.
+        if 'vibrations' in cjson:
+            del cjson['vibrations']
+
+        # Cache this cube for the next time, they can take a while to generate.
+        return self._cube_model.create(id, mo, cjson, quality)
+
+    @access.public
+    def get_calc_cube(self, id, mo, params):
+        orig_mo = mo
+        mo = self._resolve_mo(id, mo)
+        quality = self._cube_quality(params)
+        progressive = toBool(params.get('progressive', False))
+
+        cached = self._cube_model.find_mo(id, mo, quality)
 
         # If we have a cached cube file use that.
         if cached:
@@ -233,25 +392,37 @@ class Calculation(Resource):
         calc = self._model.load(id, fields=fields, force=True)
 
         # This is where the cube gets calculated, should be cached in future.
-        if ('async' in params) and (params['async']):
+        if progressive and quality != CubeQuality.LOW:
+            # Return a coarse cube straight away, and refine it in the
+            # background. A "cube.status" notification is sent once the
+            # requested quality is cached.
+            cached = self._cube_model.find_mo(id, mo, CubeQuality.LOW)
+            if cached:
+                cjson = cached['cjson']
+            else:
+                cjson = avogadro.calculate_mo(calc['cjson'], mo,
+                                              quality=CubeQuality.LOW,
+                                              engine=CubeEngine.DEFAULT)
+                cjson = cube_cjson(cjson, cjson['cube'])
+                self._cube_model.create(id, mo, cjson, CubeQuality.LOW)
+
             async_requests.schedule_orbital_gen(
-                calc['cjson'], mo, id, orig_mo, self.getCurrentUser())
+                calc['cjson'], mo, id, orig_mo, self.getCurrentUser(),
+                quality=quality)
+
+            cjson['generating_orbital'] = True
+            return cjson
+        elif ('async' in params) and (params['async']):
+            async_requests.schedule_orbital_gen(
+                calc['cjson'], mo, id, orig_mo, self.getCurrentUser(),
+                quality=quality)
             calc['cjson']['cube'] = {
                 'dimensions': [0, 0, 0],
                 'scalars': []
             }
             return calc['cjson']
         else:
-            cjson = avogadro.calculate_mo(calc['cjson'], mo)
-
-            # Remove the vibrational mode data from the cube - big, not needed here.
-            if 'vibrations' in cjson:
-                del cjson['vibrations']
-
-            # Cache this cube for the next time, they can take a while to generate.
-            self._cube_model.create(id, mo, cjson)
-
-            return cjson
+            return self._calculate_cube(id, mo, quality, calc)['cjson']
 
     get_calc_cube.description = (
         Description('Get the cube for the supplied MO of the calculation in CJSON format')
@@ -262,7 +433,229 @@ class Calculation(Resource):
         .param(
             'mo',
             'The molecular orbital to get the cube for.',
-            dataType='string', required=True, paramType='path'))
+            dataType='string', required=True, paramType='path')
+        .param(
+            'quality',
+            'The resolution of the cube grid.',
+            dataType='string', required=False, paramType='query',
+            enum=CubeQuality.QUALITIES, default=CubeQuality.MEDIUM)
+        .param(
+            'progressive',
+            'Return a low quality cube immediately and compute the requested '
+            'quality in the background, a "cube.status" notification is sent '
+            'once it is cached.',
+            dataType='boolean', required=False, paramType='query'))
+
+    @access.public
+    def get_calc_isosurface(self, id, mo, params):
+        self.requireParams(['isovalue'], params)
+        try:
+            isovalue = float(params['isovalue'])
+        except ValueError:
+            raise RestException('isovalue must be a number.', 400)
+        signed = toBool(params.get('signed', True))
+
+        # The cached meshes are only served to the users who can read the
+        # calculation
+        self._load_readable(id)
+
+        mo = self._resolve_mo(id, mo)
+        quality = self._cube_quality(params)
+
+        # The cube data is only loaded if the meshes need extracting
+        cached = self._cube_model.find_mo(id, mo, quality, fields=['_id'])
+        isosurfaces = None
+        if cached:
+            isosurfaces = self._isosurface_model.find_isosurfaces(
+                cached['_id'], isovalue, signed)
+
+        if isosurfaces is None:
+            if cached:
+                cached = self._cube_model.find_mo(id, mo, quality,
+                                                  fields=['cjson.cube'])
+            else:
+                calc = self._load_readable(id, ['cjson', 'fileId'])
+                cached = self._calculate_cube(id, mo, quality, calc)
+
+            isosurfaces = avogadro.calculate_isosurface(
+                cached['cjson']['cube'], isovalue, signed)
+            self._isosurface_model.add_isosurfaces(cached['_id'], isovalue,
+                                                   signed, isosurfaces)
+
+        return {
+            'calculationId': id,
+            'mo': mo,
+            'quality': quality,
+            'isosurfaces': isosurfaces
+        }
+
+    get_calc_isosurface.description = (
+        Description('Get the isosurfaces of the cube for the supplied MO of '
+                    'the calculation')
+        .notes('Each isosurface holds base64 encoded little endian buffers: '
+               'float32 "vertices" and "normals" (x, y, z per vertex) and '
+               'uint32 "indices" (three per triangle). The cube is computed '
+               'and cached if needed, the meshes are cached separately for '
+               'each isovalue.')
+        .param(
+            'id',
+            'The id of the calculation to return the isosurfaces for.',
+            dataType='string', required=True, paramType='path')
+        .param(
+            'mo',
+            'The molecular orbital to get the isosurfaces for.',
+            dataType='string', required=True, paramType='path')
+        .param(
+            'isovalue',
+            'The value of the isosurface.',
+            dataType='number', required=True, paramType='query')
+        .param(
+            'signed',
+            'Also extract the surface at -isovalue.',
+            dataType='boolean', required=False, paramType='query',
+            default=True)
+        .param(
+            'quality',
+            'The resolution of the cube grid.',
+            dataType='string', required=False, paramType='query',
+            enum=CubeQuality.QUALITIES, default=CubeQuality.MEDIUM))
+
+    @access.public
+    def get_calc_cubes(self, id, params):
+        self.requireParams(['mos'], params)
+        orig_mos = [x.strip() for x in params['mos'].split(',') if x.strip()]
+        if not orig_mos:
+            raise RestException('At least one mo is required.', 400)
+
+        # The cached cubes are only served to the users who can read the
+        # calculation
+        self._load_readable(id)
+
+        mos = [self._resolve_mo(id, mo) for mo in orig_mos]
+        quality = self._cube_quality(params)
+
+        cubes = {}
+        missing = []
+        for mo in mos:
+            if mo in cubes or mo in missing:
+                continue
+
+            # The batches take the cubes cached by either engine
+            cached = self._cube_model.find_mo(id, mo, quality, engine=None)
+            if cached:
+                cubes[mo] = cached['cjson']
+            else:
+                missing.append(mo)
+
+        if missing:
+            calc = self._load_readable(id, ['cjson', 'fileId'])
+
+            if ('async' in params) and (params['async']):
+                orig = dict(zip(mos, orig_mos))
+                async_requests.schedule_orbitals_gen(
+                    calc['cjson'], missing, id, [orig[mo] for mo in missing],
+                    self.getCurrentUser(), quality)
+
+                pending = cube_cjson(calc['cjson'], {
+                    'dimensions': [0, 0, 0],
+                    'scalars': []
+                })
+                for mo in missing:
+                    cubes[mo] = pending
+            else:
+                # All the missing cubes are computed together, the basis set
+                # only needs to be evaluated on the grid once.
+                results = avogadro.calculate_mos(calc['cjson'], missing,
+                                                 quality)
+                for result in results['cubes']:
+                    cjson = cube_cjson(calc['cjson'], result['cube'])
+                    self._cube_model.create(id, result['mo'], cjson, quality,
+                                            engine=results['engine'])
+                    cubes[result['mo']] = cjson
+
+        return [cubes[mo] for mo in mos]
+
+    get_calc_cubes.description = (
+        Description('Get the cubes for several MOs of the calculation in CJSON format')
+        .notes('The cubes that are not cached yet are computed together, so '
+               'requesting a window of orbitals costs little more than a '
+               'single one.')
+        .param(
+            'id',
+            'The id of the calculation to return the cubes for.',
+            dataType='string', required=True, paramType='path')
+        .param(
+            'mos',
+            'Comma separated list of molecular orbitals, e.g. "homo,lumo,3".',
+            dataType='string', required=True, paramType='query')
+        .param(
+            'quality',
+            'The resolution of the cube grids.',
+            dataType='string', required=False, paramType='query',
+            enum=CubeQuality.QUALITIES, default=CubeQuality.MEDIUM)
+        .param(
+            'async',
+            'Compute the cubes in the background, a "cube.status" '
+            'notification is sent for each cube once it is cached.',
+            dataType='boolean', required=False, paramType='query'))
+
+    def _grid_cube(self, id, grid_type, calculate, params):
+        self._load_readable(id)
+        quality = self._cube_quality(params)
+
+        # Grids other than orbitals are cached under their type name
+        cached = self._cube_model.find_mo(id, grid_type, quality,
+                                          engine=CubeEngine.NUMPY)
+        if cached:
+            return cached['cjson']
+
+        calc = self._load_readable(id, ['cjson', 'fileId'])
+        cjson = calc['cjson']
+        if 'basisSet' not in cjson or 'orbitals' not in cjson:
+            raise RestException('The calculation has no basis set or orbitals.',
+                                400)
+
+        result = calculate(cjson, quality)
+        cjson = cube_cjson(cjson, result['cube'])
+        self._cube_model.create(id, grid_type, cjson, quality,
+                                engine=CubeEngine.NUMPY)
+
+        return cjson
+
+    @access.public
+    def get_calc_density(self, id, params):
+        return self._grid_cube(id, 'density', avogadro.calculate_density,
+                               params)
+
+    get_calc_density.description = (
+        Description('Get the total electron density cube of the calculation '
+                    'in CJSON format')
+        .param(
+            'id',
+            'The id of the calculation to return the density for.',
+            dataType='string', required=True, paramType='path')
+        .param(
+            'quality',
+            'The resolution of the cube grid.',
+            dataType='string', required=False, paramType='query',
+            enum=CubeQuality.QUALITIES, default=CubeQuality.MEDIUM))
+
+    @access.public
+    def get_calc_esp(self, id, params):
+        return self._grid_cube(id, 'esp', avogadro.calculate_esp, params)
+
+    get_calc_esp.description = (
+        Description('Get the electrostatic potential cube of the calculation '
+                    'in CJSON format')
+        .param(
+            'id',
+            'The id of the calculation to return the potential for.',
+            dataType='string', required=True, paramType='path')
+        .param(
+            'quality',
+            'The resolution of the cube grid.',
+            dataType='string', required=False, paramType='query',
+            enum=CubeQuality.QUALITIES, default=CubeQuality.MEDIUM))
 
     @access.user(scope=TokenScope.DATA_WRITE)
     def create_calc(self, params):
@@ -404,7 +797,13 @@ class Calculation(Resource):
                                               provenanceId)
             calculation['optimizedGeometryId'] = geometry.get('_id')
 
-        return CalculationModel().save(calculation)
+        calculation = CalculationModel().save(calculation)
+
+        # The cjson has been replaced, so have its vibrational modes
+        self._mode_model.set_modes(calculation)
+        self._spectrum_model.remove_calculation(calculation['_id'])
+
+        return calculation
 
     @access.public
     @autoDescribeRoute(
@@ -1,25 +1,194 @@
+import json
 import os
+
 from chemspipy import ChemSpider
-from girder.constants import TerminalColor
+from girder import logger
+from girder.utility.model_importer import ModelImporter
+
+from .utilities import tasks
 
 try:
     chemspikey = os.environ['chemspikey']
 except KeyError:
     chemspikey = None
-    print(TerminalColor.warning('WARNING: chemspikey not set, common names will not be resolved.'))
+    logger.warning('chemspikey not set, common names will not be resolved.')
+
+# The task resolving the names of the flagged molecules, only one is queued
+# at a time
+NAMES_TASK = 'names'
+
+# The most molecules whose names are resolved together
+BATCH_SIZE = 100
+
+
+class ChemSpiderProvider(object):
+    """Resolves common names with ChemSpider, the client is created once."""
+
+    def __init__(self, key):
+        self._client = ChemSpider(key) if key else None
+
+    def find_names(self, inchikeys):
+        names = {}
+        for inchikey in inchikeys:
+            name = None
+            if self._client is not None and len(inchikey) > 0:
+                result = self._client.search(inchikey)
+                if len(result) == 1:
+                    name = result[0].common_name
+            names[inchikey] = name
+
+        return names
+
+
+class LocalFileProvider(object):
+    """Resolves common names from a JSON file mapping InChIKeys to names."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self._names = json.load(f)
+
+    def find_names(self, inchikeys):
+        return {inchikey: self._names.get(inchikey) for inchikey in inchikeys}
+
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = ChemSpiderProvider(chemspikey)
+
+    return _provider
+
+
+def set_provider(provider):
+    """Replace the name provider, returns the previous one."""
+    global _provider
+    previous = _provider
+    _provider = provider
+
+    return previous
+
+
+def cached_common_name(inchikey):
+    """
+    :returns: A tuple (resolved, name), resolved is False if the InChIKey is
+        not in the cache.
+    """
+    cache = ModelImporter.model('namecache', 'molecules')
+    cached = cache.lookup([inchikey]).get(inchikey)
+    if cached is None:
+        return False, None
+
+    return True, cached['name']
+
+
+def find_common_names(inchikeys):
+    # Resolve the names of several compounds, going to the provider only for
+    # the ones that are not cached. Compounds without a name map to None.
+    cache = ModelImporter.model('namecache', 'molecules')
+    inchikeys = list(set(inchikeys))
+
+    names = {k: v['name'] for k, v in cache.lookup(inchikeys).items()}
+    missing = [k for k in inchikeys if k not in names]
+    if missing:
+        for inchikey, name in get_provider().find_names(missing).items():
+            cache.store(inchikey, name)
+            names[inchikey] = name
+
+    return names
 
 
 def find_common_name(inchikey):
     # Try to find the common name for the compound, if not, return None.
+    return find_common_names([inchikey]).get(inchikey)
+
+
+def _update_molecule(query, updates):
+    # Molecule overrides update() to save a document
+    molecule_model = ModelImporter.model('molecule', 'molecules')
+    return super(type(molecule_model), molecule_model).update(query, updates)
+
+
+def schedule_common_name(molecule_id, inchikey):
+    """
+    Resolve the name of a molecule in the background, it is set on the
+    molecule unless it has been named in the meantime. The molecule is
+    flagged with resolving_name until then, so a failed batch or a restart
+    doesn't lose it.
+    """
+    _update_molecule({'_id': molecule_id}, {
+        '$set': {
+            'resolving_name': True
+        }
+    })
+
+    tasks.enqueue(NAMES_TASK, {}, key=NAMES_TASK)
+
+
+def resolve_pending_names(args=None, user=None):
+    """
+    Resolve the names of the flagged molecules, batch by batch. If a batch
+    fails its molecules stay flagged and the task is retried.
+    """
+    molecule_model = ModelImporter.model('molecule', 'molecules')
+    while True:
+        mols = list(molecule_model.find({'resolving_name': True},
+                                        limit=BATCH_SIZE,
+                                        fields=['_id', 'inchikey']))
+        if not mols:
+            return
+
+        names = find_common_names(mol.get('inchikey', '') for mol in mols)
+        for mol in mols:
+            name = names.get(mol.get('inchikey', ''))
+            if name is None:
+                continue
+
+            _update_molecule({
+                '_id': mol['_id'],
+                'name': {
+                    '$exists': False
+                }
+            }, {
+                '$set': {
+                    'name': name
+                }
+            })
+
+        _update_molecule({
+            '_id': {
+                '$in': [mol['_id'] for mol in mols]
+            }
+        }, {
+            '$unset': {
+                'resolving_name': ''
+            }
+        })
+
+
+def _resolve_pending_names_done(args, user):
+    # A molecule flagged after the last batch was read found this task still
+    # running and wasn't queued, its key is free now
+    recover_pending_names()
+
+
+def _resolve_pending_names_failed(args, user, error):
+    # The molecules stay flagged, they are queued again by the next
+    # molecule created or when the server restarts
+    logger.error('Unable to resolve the pending names: %s', error)
 
-    name = None
 
-    if chemspikey:
-        cs = ChemSpider(chemspikey)
+def recover_pending_names():
+    """
+    Queue the resolution of the flagged names, left by a previous run or
+    flagged while the last resolution was running.
+    """
+    molecule_model = ModelImporter.model('molecule', 'molecules')
+    if molecule_model.findOne({'resolving_name': True}, fields=['_id']):
+        tasks.enqueue(NAMES_TASK, {}, key=NAMES_TASK)
 
-        if (len(inchikey) > 0):
-          result = cs.search(inchikey)
-          if (len(result) == 1):
-            name = result[0].common_name
 
-    return name
+tasks.register(NAMES_TASK, resolve_pending_names,
+               _resolve_pending_names_failed, _resolve_pending_names_done)
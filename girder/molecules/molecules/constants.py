@@ -11,6 +11,19 @@ class PluginSettings:
     OPENBABEL_BASE_URL = 'molecules.openbabel.url'
     AVOGADRO_BASE_URL = 'molecules.avogadro.url'
 
+class CubeQuality:
+    LOW = 'low'
+    MEDIUM = 'medium'
+    HIGH = 'high'
+    QUALITIES = [LOW, MEDIUM, HIGH]
+
+class CubeEngine:
+    AVOGADRO = 'avogadro'
+    NUMPY = 'numpy'
+    # The single orbitals are computed by Avogadro, the numpy engine is only
+    # used for the batches of orbitals and the density and ESP grids.
+    DEFAULT = AVOGADRO
+
 theory_priority = {
     'mm': 10, # (molecular mechanics)
     'mp7': 20, # (semi-empirical)
@@ -20,3 +33,10 @@ theory_priority = {
     'mp2': 100,
     'ccsd': 200 # (coupled cluster)
 }
+
+class TaskStatus:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    ERROR = 'error'
+    STATUSES = [QUEUED, RUNNING, SUCCESS, ERROR]
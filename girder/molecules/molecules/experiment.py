@@ -1,6 +1,8 @@
 import functools
 import json
 from jsonpath_rw import parse
+import numpy as np
+import requests
 
 from girder.api.describe import Description, autoDescribeRoute
 from girder.api.docs import addModel
@@ -10,10 +12,12 @@ from girder.api.rest import RestException, getBodyJson, getCurrentUser, \
     loadmodel
 from girder.models.model_base import ValidationException
 from girder.models.file import File
+from girder.utility import toBool
 from girder.utility.model_importer import ModelImporter
 from girder.constants import AccessType, TokenScope
 
 from molecules.models.experimental import Experimental
+from molecules.utilities import similarity
 
 
 class Experiment(Resource):
@@ -23,6 +27,8 @@ class Experiment(Resource):
         self.resourceName = 'experiments'
         self.route('POST', (), self.create)
         self.route('GET', (), self.find_experiment)
+        self.route('GET', ('similar',), self.find_similar_to_calculation)
+        self.route('POST', ('similar',), self.find_similar_to_spectrum)
 
         self._model = ModelImporter.model('experimental', 'molecules')
 
@@ -34,31 +40,41 @@ class Experiment(Resource):
 
         experiments_list = []
         for experiment in experiments:
-            spectrum_type = experiment['spectrumType']
-            experimental_technique = experiment['experimentalTechnique']
-            id = experiment['id']
-            molecular_formula = experiment['molecularFormula']
             instenisty_units = parse('measuredSpectrum.unitsY').find(experiment)[0].value
             frequency_units = parse('measuredSpectrum.unitsX').find(experiment)[0].value
             data_points = parse('measuredSpectrum.dataPoints').find(experiment)[0].value
-            frequencies = data_points[::2]
-            intensities = data_points[1::2]
+            data_points = np.asarray(data_points, dtype=float)
+            if data_points.size % 2 != 0:
+                raise RestException('dataPoints must hold frequency and '
+                                    'intensity pairs.', 400)
+            data_points = data_points.reshape(-1, 2)
             measured_spectrum = {
                 'frequencies': {
                     'units': frequency_units,
-                    'values': frequencies
+                    'values': data_points[:, 0].tolist()
                 },
                 'intensities': {
                     'units': instenisty_units,
-                    'values': intensities
+                    'values': data_points[:, 1].tolist()
                 }
             }
 
-            experiments_list.append(experiment_model.create(
-                facility_used, spectrum_type, experimental_technique, id,
-                molecular_formula, measured_spectrum))
+            experiments_list.append({
+                'facility_used': facility_used,
+                'spectrum_type': experiment['spectrumType'],
+                'experimental_technique': experiment['experimentalTechnique'],
+                'id': experiment['id'],
+                'molecular_formula': experiment['molecularFormula'],
+                'measured_spectrum': measured_spectrum
+            })
 
-        return experiments_list
+        experiments_list = experiment_model.create_many(experiments_list)
+
+        # Add the new spectra to the similarity index
+        similarity.experiment_index().refresh(experiment_model)
+
+        user = getCurrentUser()
+        return [experiment_model.filter(x, user) for x in experiments_list]
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
@@ -83,26 +99,54 @@ class Experiment(Resource):
         user = getCurrentUser()
 
         if 'source' in params:
-            from .nist import search_nist_inchi, get_jdx
-            from jcamp import jcamp_read
+            from .nist import find_spectrum
 
+            self.requireParams(['inchi'], params)
             inchi = params['inchi']
-            stype = params['spectrum_type']
-            nist_identifier =  search_nist_inchi(inchi)
-            jdx = get_jdx(nist_identifier, stype=stype)
+            stype = params.get('spectrum_type', 'IR')
+            try:
+                spectrum = find_spectrum(inchi, stype=stype)
+            except requests.RequestException:
+                raise RestException('Unable to reach NIST.', 502)
 
-            ir = jcamp_read(jdx)
-            return ir
+            if spectrum is None:
+                raise RestException('No NIST spectrum found.', 404)
+
+            return spectrum
 
         else:
             query = { }
             if 'molecularFormula' in params:
                 query['molecularFormula'] = params['molecularFormula']
 
+            # Select the experiments overlapping the range, using the stored
+            # summaries rather than the values.
+            try:
+                if 'minFrequency' in params:
+                    query['measuredSpectrum.frequencies.max'] = {
+                        '$gte': float(params['minFrequency'])
+                    }
+                if 'maxFrequency' in params:
+                    query['measuredSpectrum.frequencies.min'] = {
+                        '$lte': float(params['maxFrequency'])
+                    }
+            except ValueError:
+                raise RestException('Frequencies must be numbers.', 400)
+
+            include_spectrum = toBool(params.get('includeSpectrum', True))
+            fields = None
+            if not include_spectrum:
+                fields = {
+                    'fingerprint': False,
+                    'measuredSpectrum.frequencies.values': False,
+                    'measuredSpectrum.intensities.values': False
+                }
+
             limit = int(params.get('limit', 50))
-            experiments = self._model.find(query, limit=limit)
+            experiments = self._model.find(query, limit=limit, fields=fields)
 
-            return  [self._model.filter(x, user) for x in experiments]
+            return  [self._model.filter(x, user, include_spectrum)
+                     for x in experiments]
 
     find_experiment.description = (
         Description('Get the calculation types available for the molecule')
@@ -110,8 +154,130 @@ class Experiment(Resource):
             'molecularFormula',
             'The molecular formula to search for experiments.',
             dataType='string', required=False, paramType='query')
+        .param(
+            'source',
+            'Look the spectrum up on NIST rather than in the database.',
+            dataType='string', required=False, paramType='query')
+        .param(
+            'inchi',
+            'The InChI or InChIKey to look up on NIST.',
+            dataType='string', required=False, paramType='query')
+        .param(
+            'spectrum_type',
+            'The NIST spectrum type.',
+            dataType='string', required=False, paramType='query',
+            default='IR')
+        .param(
+            'minFrequency',
+            'Only return experiments measured above this frequency.',
+            dataType='number', required=False, paramType='query')
+        .param(
+            'maxFrequency',
+            'Only return experiments measured below this frequency.',
+            dataType='number', required=False, paramType='query')
+        .param(
+            'includeSpectrum',
+            'Whether to return the measured values, they are only decoded '
+            'when requested.',
+            dataType='boolean', required=False, paramType='query',
+            default=True)
         .param(
             'limit',
             'The max number of experiments to return',
              dataType='integer', paramType='query', default=50, required=False))
 
+    def _find_similar(self, fingerprint, metric, limit):
+        if limit < 1:
+            raise RestException('limit must be positive.', 400)
+
+        index = similarity.experiment_index()
+        index.refresh(self._model)
+        user = getCurrentUser()
+
+        # The experiments the user can't read are dropped after the search,
+        # more candidates are fetched until there are enough left
+        count = limit
+        while True:
+            matches = index.search(fingerprint, metric, count)
+            if not matches:
+                return []
+
+            query = {
+                '_id': {
+                    '$in': [id for id, _ in matches]
+                }
+            }
+            experiments = {
+                x['_id']: x for x in self._model.findWithPermissions(
+                    query, user=user, level=AccessType.READ)
+            }
+            if len(experiments) >= limit or len(matches) < count:
+                break
+            count *= 4
+
+        results = []
+        for id, score in matches:
+            if id in experiments:
+                experiment = self._model.filter(experiments[id], user)
+                experiment['similarity'] = score
+                results.append(experiment)
+
+        return results[:limit]
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Find the experimental spectra most similar to the '
+                    'vibrational spectrum of a calculation.')
+        .notes('The calculated lines are broadened, and all the spectra are '
+               'resampled on a common grid before being compared.')
+        .param('calculationId', 'The id of the calculation.')
+        .param('metric', 'The similarity measure.', required=False,
+               enum=similarity.METRICS, default=similarity.COSINE)
+        .param('width', 'The full width at half maximum of the calculated '
+               'lines (cm-1).', required=False, dataType='number',
+               default=similarity.DEFAULT_WIDTH)
+        .param('limit', 'The max number of experiments to return.',
+               required=False, dataType='integer', default=10)
+    )
+    def find_similar_to_calculation(self, calculationId, metric, width, limit):
+        if width <= 0:
+            raise RestException('width must be positive.', 400)
+
+        calc_model = ModelImporter.model('calculation', 'molecules')
+        calc = calc_model.load(calculationId, fields=['access', 'public'],
+                               user=getCurrentUser(), level=AccessType.READ)
+
+        fields = ['cjson.vibrations.frequencies',
+                  'cjson.vibrations.intensities']
+        doc = calc_model.findOne({'_id': calc['_id']}, fields=fields)
+        vibrations = doc.get('cjson', {}).get('vibrations', {})
+        if 'intensities' not in vibrations:
+            raise RestException('The calculation has no IR intensities.', 400)
+
+        fingerprint = similarity.calculated_fingerprint(
+            vibrations.get('frequencies', []), vibrations['intensities'],
+            width)
+
+        return self._find_similar(fingerprint, metric, limit)
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Find the experimental spectra most similar to a '
+                    'spectrum.')
+        .jsonParam('body', 'The spectrum, as "frequencies" and '
+                   '"intensities" lists.', required=True, paramType='body')
+        .param('metric', 'The similarity measure.', required=False,
+               enum=similarity.METRICS, default=similarity.COSINE)
+        .param('limit', 'The max number of experiments to return.',
+               required=False, dataType='integer', default=10)
+    )
+    def find_similar_to_spectrum(self, body, metric, limit):
+        self.requireParams(['frequencies', 'intensities'], body)
+        frequencies = body['frequencies']
+        intensities = body['intensities']
+        if len(frequencies) != len(intensities):
+            raise RestException('Array length must match.', 400)
+
+        fingerprint = similarity.fingerprint(frequencies, intensities)
+
+        return self._find_similar(fingerprint, metric, limit)
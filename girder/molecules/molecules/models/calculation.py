@@ -15,6 +15,7 @@ from molecules.utilities.pagination import default_pagination_params
 from molecules.utilities.pagination import search_results_dict
 
 from molecules.models.molecule import Molecule as MoleculeModel
+from molecules.models.vibrationalmode import VibrationalMode
 
 import openchemistry as oc
 
@@ -195,7 +196,10 @@ class Calculation(AccessControlledModel):
         if public:
             self.setPublic(calc, True)
 
-        return self.save(calc)
+        calc = self.save(calc)
+        VibrationalMode().set_modes(calc)
+
+        return calc
 
     def add_notebooks(self, calc, notebooks):
         query = {
@@ -213,6 +217,9 @@ class Calculation(AccessControlledModel):
 
     def remove(self, calc, user=None, force=False):
         super(Calculation, self).remove(calc)
+        VibrationalMode().remove_modes(calc['_id'])
+        ModelImporter.model('spectrumcache', 'molecules').remove_calculation(
+            calc['_id'])
         # remove ingested file
         file_id = calc.get('fileId')
         if file_id is not None:
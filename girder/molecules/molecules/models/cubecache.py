@@ -5,6 +5,8 @@ from girder.models.model_base import AccessControlledModel, ValidationException
 from girder.utility.model_importer import ModelImporter
 from girder.constants import AccessType
 
+from molecules.constants import CubeEngine, CubeQuality
+
 class Cubecache(AccessControlledModel):
 
     def __init__(self):
@@ -15,7 +17,7 @@ class Cubecache(AccessControlledModel):
         self.ensureIndices(['calculationId', 'mo'])
 
         self.exposeFields(level=AccessType.READ, fields=(
-            '_id', 'calculationId', 'mo', 'cjson'))
+            '_id', 'calculationId', 'mo', 'quality', 'engine', 'cjson'))
 
     def filter(self, calc, user):
         calc = super(Calculation, self).filter(doc=calc, user=user)
@@ -34,10 +36,13 @@ class Cubecache(AccessControlledModel):
 
         return doc
 
-    def create(self, calcId, mo, cjson):
+    def create(self, calcId, mo, cjson, quality=CubeQuality.MEDIUM,
+               engine=CubeEngine.DEFAULT):
         cache = {
             'calculationId': calcId,
             'mo': mo,
+            'quality': quality,
+            'engine': engine,
             'cjson': cjson
         }
 
@@ -46,12 +51,30 @@ class Cubecache(AccessControlledModel):
 
         return self.save(cache)
 
-    def find_mo(self, calcId, mo):
+    def find_mo(self, calcId, mo, quality=CubeQuality.MEDIUM,
+                engine=CubeEngine.DEFAULT, fields=None):
         query = {
             'calculationId': ObjectId(calcId),
-            'mo': mo
+            'mo': mo,
+            'quality': quality
         }
 
-        cache = self.findOne(query)
+        # Any engine will do if none is given
+        if engine is not None:
+            query['engine'] = engine
+
+        # Cubes cached before engines were recorded are Avogadro ones
+        if engine == CubeEngine.AVOGADRO:
+            query['engine'] = {
+                '$in': [engine, None]
+            }
+
+        # Cubes cached before qualities were introduced are medium ones
+        if quality == CubeQuality.MEDIUM:
+            query['quality'] = {
+                '$in': [quality, None]
+            }
+
+        cache = self.findOne(query, fields=fields)
 
         return cache
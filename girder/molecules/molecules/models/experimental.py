@@ -1,10 +1,20 @@
+import datetime
+
+from bson.binary import Binary
 from jsonschema import validate, ValidationError
+import numpy as np
 
 from girder.models.model_base import AccessControlledModel, ValidationException
 from girder.constants import AccessType
 
+from molecules.utilities import similarity
+
 class Experimental(AccessControlledModel):
     '''
+    The measured values are stored as packed little endian float64, with
+    their count, min and max so experiments can be selected by range
+    without decoding them. The schema describes the unpacked experiment.
+
     {
         "spectrumType": "Infrared",
         "experimentalTechnique": "InfraRed Multiphoton Dissociation - IRMPD",
@@ -87,49 +97,182 @@ class Experimental(AccessControlledModel):
 
     def initialize(self):
         self.name = 'experimental'
-        self.ensureIndices(['molecularFormula'])
+        self.ensureIndices(['molecularFormula', 'created'])
 
         self.exposeFields(level=AccessType.READ, fields=(
             'spectrumType', 'experimentalTechnique', 'id', '_id',
                      'molecularFormula', 'measuredSpectrum', 'name'))
 
-    def filter(self, calc, user):
+    def filter(self, calc, user, include_spectrum=True):
         calc = super(Experimental, self).filter(doc=calc, user=user)
 
         del calc['_accessLevel']
         del calc['_modelType']
 
+        measured_spectrum = calc.get('measuredSpectrum', {})
+        for key in ['frequencies', 'intensities']:
+            if key not in measured_spectrum:
+                continue
+            if include_spectrum:
+                measured_spectrum[key]['values'] = \
+                    _unpack(measured_spectrum[key]['values']).tolist()
+            else:
+                measured_spectrum[key].pop('values', None)
+
         return calc
 
-    def validate(self, doc):
+    def validate_experiment(self, experiment):
         try:
-            validate(doc, Experimental.schema)
+            validate(experiment, Experimental.schema)
 
         except ValidationError as ex:
             raise ValidationException(ex.message)
 
         # Make sure arrays are same length
-        frequencies = doc['measuredSpectrum']['frequencies']
-        intensities = doc['measuredSpectrum']['intensities']
+        frequencies = experiment['measuredSpectrum']['frequencies']['values']
+        intensities = experiment['measuredSpectrum']['intensities']['values']
 
         if len(frequencies) != len(intensities):
             raise ValidationException('Array length must match')
 
+    def validate(self, doc):
+        measured_spectrum = doc['measuredSpectrum']
+        frequencies = measured_spectrum['frequencies']
+        intensities = measured_spectrum['intensities']
+
+        # Unpacked experiments are checked against the schema
+        if not isinstance(frequencies.get('values'), Binary):
+            self.validate_experiment(doc)
+        elif frequencies['count'] != intensities['count']:
+            raise ValidationException('Array length must match')
+
         return doc
 
-    def create(self, facility_used, spectrum_type, experimental_technique, id,
-               molecular_formula, measured_spectrum):
-        experiment = {
+    def _experiment(self, facility_used, spectrum_type, experimental_technique,
+                    id, molecular_formula, measured_spectrum):
+        return {
              'facilityUsed': facility_used,
              'spectrumType': spectrum_type,
              'experimentalTechnique': experimental_technique,
              'id': id,
              'molecularFormula' : molecular_formula,
              'measuredSpectrum' : measured_spectrum,
-             'name': '%s (%s)' % (experimental_technique, spectrum_type)
+             'name': '%s (%s)' % (experimental_technique, spectrum_type),
+             'created': datetime.datetime.utcnow()
         }
 
+    def _pack_experiment(self, experiment):
+        measured_spectrum = experiment['measuredSpectrum']
+        experiment['fingerprint'] = similarity.encode_fingerprint(
+            similarity.fingerprint(measured_spectrum['frequencies']['values'],
+                                   measured_spectrum['intensities']['values']))
+
+        for key in ['frequencies', 'intensities']:
+            measured_spectrum[key] = dict(
+                measured_spectrum[key],
+                **_pack(measured_spectrum[key]['values']))
+
         # For now set as public
         self.setPublic(experiment, True)
 
-        return self.save(experiment)
+        return experiment
+
+    def create(self, facility_used, spectrum_type, experimental_technique, id,
+               molecular_formula, measured_spectrum):
+        experiment = self._experiment(facility_used, spectrum_type,
+                                      experimental_technique, id,
+                                      molecular_formula, measured_spectrum)
+        self.validate_experiment(experiment)
+
+        return self.save(self._pack_experiment(experiment))
+
+    def create_many(self, experiments):
+        """
+        Create experiments in a single insert, each one is validated once
+        before its spectrum is packed.
+
+        :param experiments: A list of dicts with the arguments of create.
+        """
+        docs = []
+        for experiment in experiments:
+            doc = self._experiment(**experiment)
+            self.validate_experiment(doc)
+            docs.append(self._pack_experiment(doc))
+
+        if docs:
+            self.collection.insert_many(docs)
+
+        return docs
+
+    def migrate_unpacked(self):
+        """
+        Pack the spectra of the experiments stored before they were packed,
+        so they get the count, min and max the range queries select on.
+
+        :returns: The number of experiments migrated.
+        """
+        query = {
+            'measuredSpectrum.frequencies.count': {
+                '$exists': False
+            }
+        }
+        migrated = 0
+        for experiment in self.collection.find(
+                query, projection=['measuredSpectrum']):
+            measured_spectrum = experiment['measuredSpectrum']
+            updates = {}
+            for key in ['frequencies', 'intensities']:
+                if key not in measured_spectrum:
+                    continue
+                values = _unpack(measured_spectrum[key].get('values', []))
+                for field, value in _pack(values).items():
+                    updates['measuredSpectrum.%s.%s' % (key, field)] = value
+
+            if updates:
+                self.collection.update_one({'_id': experiment['_id']},
+                                           {'$set': updates})
+                migrated += 1
+
+        return migrated
+
+    def spectrum_values(self, experiment):
+        """
+        The measured frequencies and intensities of an experiment as arrays.
+        """
+        measured_spectrum = experiment['measuredSpectrum']
+
+        return (_unpack(measured_spectrum['frequencies']['values']),
+                _unpack(measured_spectrum['intensities']['values']))
+
+    def fingerprint(self, experiment):
+        """
+        The similarity fingerprint of the experiment, computed and stored if
+        the experiment predates them.
+        """
+        values = similarity.fingerprint(*self.spectrum_values(experiment))
+        self.update({'_id': experiment['_id']}, {
+            '$set': {
+                'fingerprint': similarity.encode_fingerprint(values)
+            }
+        }, multi=False)
+
+        return values
+
+
+def _pack(values):
+    values = np.asarray(values, dtype='<f8')
+
+    return {
+        'values': Binary(values.tobytes()),
+        'count': len(values),
+        'min': float(values.min()) if len(values) else None,
+        'max': float(values.max()) if len(values) else None
+    }
+
+
+def _unpack(values):
+    # Experiments stored before the values were packed hold plain lists
+    if isinstance(values, (bytes, Binary)):
+        return np.frombuffer(bytes(values), dtype='<f8')
+
+    return np.asarray(values, dtype=float)
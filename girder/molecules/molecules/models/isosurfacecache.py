@@ -0,0 +1,57 @@
+import pymongo
+
+from girder.models.model_base import Model
+
+
+class Isosurfacecache(Model):
+    '''
+    The isosurface meshes extracted from the cached cubes, one document per
+    cube, isovalue and sign, so the cube document doesn't grow with every
+    isovalue requested. Access control is that of the cube.
+
+    {
+        'cubeId': ObjectId,
+        'isovalue': <isovalue>,
+        'signed': True,
+        'surfaces': [...]
+    }
+    '''
+
+    def __init__(self):
+        super(Isosurfacecache, self).__init__()
+
+    def initialize(self):
+        self.name = 'isosurfacecache'
+        self.ensureIndices([
+            ([('cubeId', pymongo.ASCENDING),
+              ('isovalue', pymongo.ASCENDING),
+              ('signed', pymongo.ASCENDING)], {'unique': True})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def find_isosurfaces(self, cube_id, isovalue, signed=True):
+        cache = self.findOne({
+            'cubeId': cube_id,
+            'isovalue': isovalue,
+            'signed': signed
+        }, fields=['surfaces'])
+
+        return cache['surfaces'] if cache is not None else None
+
+    def add_isosurfaces(self, cube_id, isovalue, signed, surfaces):
+        query = {
+            'cubeId': cube_id,
+            'isovalue': isovalue,
+            'signed': signed
+        }
+
+        # Meshes extracted concurrently for the same cube are identical
+        self.collection.replace_one(query, dict(query, surfaces=surfaces),
+                                    upsert=True)
+
+        return surfaces
+
+    def remove_cube(self, cube_id):
+        self.removeWithQuery({'cubeId': cube_id})
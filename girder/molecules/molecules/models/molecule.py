@@ -21,6 +21,7 @@ class Molecule(AccessControlledModel):
         super(Molecule, self).__init__()
         self.ensureIndex('properties.formula')
         self.ensureIndex('inchikey')
+        self.ensureIndex(('resolving_name', {'sparse': True}))
 
     def initialize(self):
         self.name = 'molecules'
@@ -0,0 +1,69 @@
+import datetime
+
+import pymongo
+
+from girder.models.model_base import Model
+
+
+class Namecache(Model):
+    '''
+    Common names resolved for InChIKeys. Keys without a name are cached
+    too, with a shorter lifetime. Mongo removes the documents once they
+    expire.
+
+    {
+        'inchikey': '...',
+        'found': True,
+        'name': '...',
+        'expires': datetime
+    }
+    '''
+
+    # How long hits and misses are kept, in seconds.
+    TTL = 90 * 24 * 60 * 60
+    MISS_TTL = 7 * 24 * 60 * 60
+
+    def __init__(self):
+        super(Namecache, self).__init__()
+
+    def initialize(self):
+        self.name = 'namecache'
+        self.ensureIndices([
+            ('inchikey', {'unique': True}),
+            ('expires', {'expireAfterSeconds': 0})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def lookup(self, inchikeys):
+        '''
+        :returns: The cached documents of the InChIKeys, by InChIKey. Keys
+            that have not been resolved or have expired are missing.
+        '''
+        cursor = self.find({
+            'inchikey': {
+                '$in': list(inchikeys)
+            },
+            # The TTL monitor only runs every minute
+            'expires': {
+                '$gt': datetime.datetime.utcnow()
+            }
+        })
+
+        return {doc['inchikey']: doc for doc in cursor}
+
+    def store(self, inchikey, name):
+        found = name is not None
+        ttl = self.TTL if found else self.MISS_TTL
+        doc = {
+            'inchikey': inchikey,
+            'found': found,
+            'name': name,
+            'expires': datetime.datetime.utcnow() +
+            datetime.timedelta(seconds=ttl)
+        }
+
+        self.collection.replace_one({'inchikey': inchikey}, doc, upsert=True)
+
+        return doc
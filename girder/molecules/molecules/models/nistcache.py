@@ -0,0 +1,73 @@
+import datetime
+
+import pymongo
+
+from girder.models.model_base import Model
+
+
+class Nistcache(Model):
+    '''
+    Results of NIST WebBook lookups, both the NIST id resolved for an InChI
+    and the parsed JCAMP spectrum of a NIST id. Misses are cached too, with
+    a shorter lifetime. Mongo removes the documents once they expire.
+
+    {
+        'kind': 'id' | 'spectrum',
+        'key': '...',
+        'found': True,
+        'value': ...,
+        'expires': datetime
+    }
+    '''
+
+    # How long hits and misses are kept, in seconds.
+    TTL = 30 * 24 * 60 * 60
+    MISS_TTL = 24 * 60 * 60
+
+    ID = 'id'
+    SPECTRUM = 'spectrum'
+
+    def __init__(self):
+        super(Nistcache, self).__init__()
+
+    def initialize(self):
+        self.name = 'nistcache'
+        self.ensureIndices([
+            ([('kind', pymongo.ASCENDING), ('key', pymongo.ASCENDING)],
+             {'unique': True}),
+            ('expires', {'expireAfterSeconds': 0})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def lookup(self, kind, key):
+        '''
+        :returns: The cached document, None if the key has not been looked up
+            or has expired.
+        '''
+        return self.findOne({
+            'kind': kind,
+            'key': key,
+            # The TTL monitor only runs every minute
+            'expires': {
+                '$gt': datetime.datetime.utcnow()
+            }
+        })
+
+    def store(self, kind, key, value):
+        found = value is not None
+        ttl = self.TTL if found else self.MISS_TTL
+        doc = {
+            'kind': kind,
+            'key': key,
+            'found': found,
+            'value': value,
+            'expires': datetime.datetime.utcnow() +
+            datetime.timedelta(seconds=ttl)
+        }
+
+        self.collection.replace_one({'kind': kind, 'key': key}, doc,
+                                    upsert=True)
+
+        return doc
@@ -0,0 +1,69 @@
+from bson.objectid import ObjectId
+
+from girder.models.model_base import AccessControlledModel
+from girder.utility.model_importer import ModelImporter
+from girder.constants import AccessType
+
+import openchemistry as oc
+
+
+class Spectrumcache(AccessControlledModel):
+    '''
+    Broadened spectra of calculations, keyed by the hash of the parameters
+    they were computed with.
+
+    {
+        'calculationId': ObjectId,
+        'parametersHash': '...',
+        'parameters': {},
+        'spectrum': {
+            'frequencies': [],
+            'intensities': []
+        }
+    }
+    '''
+
+    def __init__(self):
+        super(Spectrumcache, self).__init__()
+
+    def initialize(self):
+        self.name = 'spectrumcache'
+        self.ensureIndices([(
+            [('calculationId', 1), ('parametersHash', 1)], {}
+        )])
+
+        self.exposeFields(level=AccessType.READ, fields=(
+            '_id', 'calculationId', 'parameters', 'spectrum'))
+
+    def validate(self, doc):
+        # If we have a calculationId check it is valid.
+        if 'calculationId' in doc:
+            calc = ModelImporter.model('calculation', 'molecules').load(
+                doc['calculationId'], force=True)
+            doc['calculationId'] = calc['_id']
+
+        return doc
+
+    def create(self, calcId, parameters, spectrum):
+        cache = {
+            'calculationId': calcId,
+            'parametersHash': oc.hash_object(parameters),
+            'parameters': parameters,
+            'spectrum': spectrum
+        }
+
+        # For now set as public
+        self.setPublic(cache, True)
+
+        return self.save(cache)
+
+    def find_spectrum(self, calcId, parameters):
+        query = {
+            'calculationId': ObjectId(calcId),
+            'parametersHash': oc.hash_object(parameters)
+        }
+
+        return self.findOne(query)
+
+    def remove_calculation(self, calcId):
+        self.removeWithQuery({'calculationId': ObjectId(calcId)})
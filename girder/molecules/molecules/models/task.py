@@ -0,0 +1,232 @@
+import datetime
+
+import pymongo
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from girder.constants import AccessType
+from girder.models.model_base import Model
+
+from molecules.constants import TaskStatus
+
+
+class Task(Model):
+    '''
+    Background work, persisted so it survives a restart of the server.
+
+    A worker claims a queued task by taking a lease on it. If the worker dies
+    the lease expires and the task is claimed again, unless that was its last
+    attempt, then it fails. Failed tasks are retried with a backoff until
+    they have been attempted maxAttempts times.
+
+    While a task is queued or running its key, if it has one, is stored as
+    activeKey. The index on activeKey is unique, so the same work is only
+    queued once.
+
+    {
+        'type': 'svg',
+        'key': 'svg:<molecule id>',
+        'activeKey': 'svg:<molecule id>',
+        'args': {...},
+        'userId': ObjectId,
+        'status': 'queued',
+        'attempts': 0,
+        'maxAttempts': 3,
+        'runAfter': datetime,
+        'leaseExpires': datetime,
+        'worker': '...',
+        'error': '...',
+        'created': datetime,
+        'updated': datetime
+    }
+    '''
+
+    # How long a worker holds a task, in seconds.
+    VISIBILITY_TIMEOUT = 10 * 60
+    MAX_ATTEMPTS = 3
+    INITIAL_BACKOFF = 10
+    MAX_BACKOFF = 10 * 60
+
+    def __init__(self):
+        super(Task, self).__init__()
+
+    def initialize(self):
+        self.name = 'moleculetasks'
+        self.ensureIndices([
+            ('activeKey', {'unique': True, 'sparse': True}),
+            ([('status', pymongo.ASCENDING), ('runAfter', pymongo.ASCENDING)],
+             {}),
+            ([('status', pymongo.ASCENDING),
+              ('leaseExpires', pymongo.ASCENDING)], {}),
+            'userId'
+        ])
+
+        self.exposeFields(level=AccessType.READ, fields=(
+            '_id', 'type', 'key', 'userId', 'status', 'attempts',
+            'maxAttempts', 'runAfter', 'error', 'created', 'updated'))
+
+    def validate(self, doc):
+        return doc
+
+    def enqueue(self, type, args, user=None, key=None,
+                max_attempts=MAX_ATTEMPTS):
+        '''
+        Queue a task, if a task with the same key is already queued or running
+        it is returned instead.
+        '''
+        now = datetime.datetime.utcnow()
+        task = {
+            'type': type,
+            'args': args,
+            'userId': user['_id'] if user else None,
+            'status': TaskStatus.QUEUED,
+            'attempts': 0,
+            'maxAttempts': max_attempts,
+            'runAfter': now,
+            'created': now,
+            'updated': now
+        }
+        if key is not None:
+            task['key'] = key
+            task['activeKey'] = key
+
+        while True:
+            try:
+                return self.save(dict(task))
+            except DuplicateKeyError:
+                existing = self.findOne({'activeKey': key})
+                # Otherwise the other task has just finished
+                if existing is not None:
+                    return existing
+
+    def claim(self, worker):
+        '''
+        Take a lease on the next task to run, either a queued task that is
+        due or a running task whose lease has expired and that has attempts
+        left.
+
+        :returns: The claimed task, or None.
+        '''
+        now = datetime.datetime.utcnow()
+        query = {
+            '$or': [{
+                'status': TaskStatus.QUEUED,
+                'runAfter': {
+                    '$lte': now
+                }
+            }, {
+                'status': TaskStatus.RUNNING,
+                'leaseExpires': {
+                    '$lt': now
+                },
+                '$expr': {
+                    '$lt': ['$attempts', '$maxAttempts']
+                }
+            }]
+        }
+        update = {
+            '$set': {
+                'status': TaskStatus.RUNNING,
+                'worker': worker,
+                'leaseExpires': now + datetime.timedelta(
+                    seconds=self.VISIBILITY_TIMEOUT),
+                'updated': now
+            },
+            '$inc': {
+                'attempts': 1
+            }
+        }
+
+        return self.collection.find_one_and_update(
+            query, update, sort=[('runAfter', pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER)
+
+    def expire(self):
+        '''
+        Fail a running task whose lease has expired on its last attempt, its
+        worker died every time it ran it.
+
+        :returns: The failed task, or None.
+        '''
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update({
+            'status': TaskStatus.RUNNING,
+            'leaseExpires': {
+                '$lt': now
+            },
+            '$expr': {
+                '$gte': ['$attempts', '$maxAttempts']
+            }
+        }, {
+            '$set': {
+                'status': TaskStatus.ERROR,
+                'error': 'The lease of the last attempt expired.',
+                'updated': now
+            },
+            '$unset': {
+                'activeKey': '',
+                'leaseExpires': ''
+            }
+        }, return_document=ReturnDocument.AFTER)
+
+    def _finish(self, task, updates):
+        # Only the worker holding the lease may finish the task
+        updates.setdefault('$set', {})['updated'] = \
+            datetime.datetime.utcnow()
+        result = self.collection.update_one({
+            '_id': task['_id'],
+            'status': TaskStatus.RUNNING,
+            'worker': task['worker']
+        }, updates)
+
+        return result.modified_count == 1
+
+    def complete(self, task):
+        return self._finish(task, {
+            '$set': {
+                'status': TaskStatus.SUCCESS
+            },
+            '$unset': {
+                'activeKey': '',
+                'leaseExpires': '',
+                'error': ''
+            }
+        })
+
+    def fail(self, task, error):
+        '''
+        Record a failed attempt, the task is queued again unless it has run
+        out of attempts.
+
+        :returns: True if the task will be retried.
+        '''
+        if task['attempts'] < task['maxAttempts']:
+            backoff = min(self.INITIAL_BACKOFF * 2 ** (task['attempts'] - 1),
+                          self.MAX_BACKOFF)
+            self._finish(task, {
+                '$set': {
+                    'status': TaskStatus.QUEUED,
+                    'runAfter': datetime.datetime.utcnow() +
+                    datetime.timedelta(seconds=backoff),
+                    'error': error
+                },
+                '$unset': {
+                    'leaseExpires': ''
+                }
+            })
+            return True
+
+        self._finish(task, {
+            '$set': {
+                'status': TaskStatus.ERROR,
+                'error': error
+            },
+            '$unset': {
+                'activeKey': '',
+                'leaseExpires': ''
+            }
+        })
+        return False
+
+    def is_active(self, key):
+        return self.findOne({'activeKey': key}, fields=['_id']) is not None
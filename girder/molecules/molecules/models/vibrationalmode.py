@@ -0,0 +1,91 @@
+from bson.objectid import ObjectId
+import pymongo
+from pymongo.errors import BulkWriteError
+
+from girder.models.model_base import Model
+
+
+class VibrationalMode(Model):
+    '''
+    One document per vibrational mode of a calculation, so a single mode can
+    be fetched with an indexed point read rather than loading the calculation
+    cjson. Access control is that of the calculation.
+
+    {
+        'calculationId': ObjectId,
+        'mode': <mode>,
+        'index': <position in cjson.vibrations>,
+        'frequency': <frequency>,
+        'intensity': <intensity>,
+        'eigenVector': [3n]
+    }
+    '''
+
+    def __init__(self):
+        super(VibrationalMode, self).__init__()
+
+    def initialize(self):
+        self.name = 'vibrationalmodes'
+        self.ensureIndices([
+            ([('calculationId', pymongo.ASCENDING),
+              ('mode', pymongo.ASCENDING)], {'unique': True})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def set_modes(self, calc):
+        '''
+        Replace the modes stored for the calculation with the ones from its
+        cjson.
+        '''
+        self.remove_modes(calc['_id'])
+
+        vibrations = calc.get('cjson', {}).get('vibrations', {})
+        modes = vibrations.get('modes', [])
+        frequencies = vibrations.get('frequencies', [])
+        intensities = vibrations.get('intensities', [])
+        eigen_vectors = vibrations.get('eigenVectors', [])
+
+        def _at(values, index):
+            return values[index] if index < len(values) else None
+
+        docs = [{
+            'calculationId': calc['_id'],
+            'mode': mode,
+            'index': index,
+            'frequency': _at(frequencies, index),
+            'intensity': _at(intensities, index),
+            'eigenVector': _at(eigen_vectors, index)
+        } for index, mode in enumerate(modes)]
+
+        if docs:
+            try:
+                self.collection.insert_many(docs, ordered=False)
+            except BulkWriteError:
+                # The modes were stored concurrently by another request
+                pass
+
+        return len(docs)
+
+    def has_modes(self, calc_id):
+        return self.findOne({'calculationId': ObjectId(calc_id)},
+                            fields=['_id']) is not None
+
+    def list_modes(self, calc_id):
+        '''
+        The modes of the calculation in cjson order, without their
+        eigenvectors.
+        '''
+        return self.find({'calculationId': ObjectId(calc_id)},
+                         sort=[('index', pymongo.ASCENDING)],
+                         fields=['mode', 'frequency', 'intensity'])
+
+    def find_mode(self, calc_id, mode):
+        return self.findOne({
+            'calculationId': ObjectId(calc_id),
+            'mode': mode
+        })
+
+    def remove_modes(self, calc_id):
+        self.removeWithQuery({'calculationId': ObjectId(calc_id)})
@@ -29,6 +29,7 @@ from molecules.utilities.pagination import search_results_dict
 
 from molecules.models.geometry import Geometry as GeometryModel
 from molecules.models.molecule import Molecule as MoleculeModel
+from molecules.models.task import Task as TaskModel
 
 class Molecule(Resource):
     output_formats_2d = ['smiles', 'inchi', 'inchikey']
@@ -62,6 +63,10 @@ class Molecule(Resource):
         self.route('PATCH', (':id', 'notebooks'), self.add_notebooks)
         self.route('POST', ('conversions', ':output_format'), self.conversions)
         self.route('POST', (':id', '3d'), self.generate_3d_coords)
+        self.route('POST', ('semantic', 'backfill'), self.backfill_semantic)
+        self.route('POST', ('semantic', 'export'), self.export_semantic)
+        self.route('GET', ('tasks',), self.find_tasks)
+        self.route('GET', ('tasks', ':id'), self.get_task)
 
         # Methods for geometries
         self.route('GET', (':moleculeId', 'geometries'), self.find_geometries)
@@ -501,6 +506,111 @@ class Molecule(Resource):
                           defaultSortDir=SortDir.DESCENDING,
                           defaultLimit=25))
 
+    @access.admin
+    @autoDescribeRoute(
+            Description('Publish the semantic graphs of the molecules that '
+                        'have not been published yet.')
+            .notes('The molecules are published in batches in the '
+                   'background, the number of queued molecules is returned.')
+    )
+    def backfill_semantic(self):
+        return {
+            'queued': semantic.publisher().backfill()
+        }
+
+    @access.admin
+    @autoDescribeRoute(
+            Description('Export the semantic graphs of every molecule.')
+            .notes('The graphs are serialized as N-Triples by a local job, '
+                   'either to a gzipped file on the server or uploaded to '
+                   'the triple store in batches. The checkpoint of the job '
+                   'is the id of the last exported molecule, an interrupted '
+                   'export is continued by passing its job as resume.')
+            .param('target', 'Where to export the graphs.', required=False,
+                   enum=['file', 'jena', 'virtuoso'], default='file')
+            .param('path', 'The path of the file on the server, required '
+                   'for the file target.', required=False)
+            .param('resume', 'The id of an export job to continue.',
+                   required=False)
+            .param('processes', 'The number of worker processes.',
+                   dataType='integer', required=False)
+    )
+    def export_semantic(self, target, path, resume, processes):
+        from girder_jobs.models.job import Job
+
+        after_id = None
+        if resume is not None:
+            previous = Job().load(resume, force=True)
+            if previous is None or \
+                    previous.get('type') != semantic.export.JOB_TYPE:
+                raise RestException('Invalid export job: %s' % resume)
+            after_id = semantic.export.resume_after(previous)
+            if path is None:
+                path = previous['kwargs'].get('path')
+            target = previous['kwargs']['target']
+
+        if target == 'file' and path is None:
+            raise RestException('A path is required to export to a file.')
+        if processes is not None and processes < 1:
+            raise RestException('processes must be at least 1.')
+
+        job = Job().createLocalJob(
+            module='molecules.semantic.export',
+            title='Semantic export',
+            type=semantic.export.JOB_TYPE,
+            user=getCurrentUser(),
+            kwargs={
+                'target': target,
+                'path': path,
+                'afterId': after_id,
+                'processes': processes
+            },
+            asynchronous=True)
+        Job().scheduleJob(job)
+
+        return Job().filter(job, getCurrentUser())
+
+    @access.admin
+    @autoDescribeRoute(
+            Description('List the background tasks.')
+            .param('status', 'Only list the tasks with this status.',
+                   required=False, enum=constants.TaskStatus.STATUSES)
+            .param('type', 'Only list the tasks of this type.',
+                   required=False)
+            .pagingParams(defaultSort='_id',
+                          defaultSortDir=SortDir.DESCENDING,
+                          defaultLimit=25)
+    )
+    def find_tasks(self, status, type, limit, offset, sort):
+        query = {}
+        if status is not None:
+            query['status'] = status
+        if type is not None:
+            query['type'] = type
+
+        model = TaskModel()
+        cursor = model.find(query, limit=limit, offset=offset, sort=sort)
+        num_matches = cursor.collection.count_documents(query)
+        tasks = [model.filter(task, getCurrentUser()) for task in cursor]
+
+        return search_results_dict(tasks, num_matches, limit, offset, sort)
+
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+            Description('Get the status of a background task.')
+            .notes('Only the user that queued the task and administrators '
+                   'can get it.')
+            .modelParam('id', 'The id of the task.', model=TaskModel,
+                        destName='task', force=True)
+            .errorResponse('Task not found.', 404)
+    )
+    def get_task(self, task):
+        user = self.getCurrentUser()
+        if not user['admin'] and task.get('userId') != user['_id']:
+            raise RestException('Task not found.', code=404)
+
+        return TaskModel().filter(task, user)
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
             Description('Generate 3D coordinates for a molecule.')
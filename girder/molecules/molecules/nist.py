@@ -1,12 +1,19 @@
+import json
+import os
 import re
 import requests
 from bs4 import BeautifulSoup
 
+from girder.utility.model_importer import ModelImporter
+
 
 # Variables controlled by admins
 JDX_PATH = 'nist/jdx/'
 NIST_URL = 'http://webbook.nist.gov/cgi/cbook.cgi'
 
+# Seconds to wait for the WebBook before giving up
+TIMEOUT = 10
+
 
 def search_nist_inchi(inchi, stype='IR'):
     """Search NIST using the specified InChI or InChIKey
@@ -22,7 +29,9 @@ def search_nist_inchi(inchi, stype='IR'):
     """
     EXACT_RE = re.compile('/cgi/cbook.cgi\?GetInChI=(.*?)$')
 
-    response = requests.get(NIST_URL, params={'InChI': inchi, 'Units': 'SI'})
+    response = requests.get(NIST_URL, params={'InChI': inchi, 'Units': 'SI'},
+                            timeout=TIMEOUT)
+    response.raise_for_status()
     soup = BeautifulSoup(response.text)
     idlink = soup.find('a', href=EXACT_RE)
     if idlink:
@@ -33,10 +42,126 @@ def search_nist_inchi(inchi, stype='IR'):
 def get_jdx(nistid, stype='IR'):
     """Get jdx file content for the specified NIST ID."""
     response = requests.get(NIST_URL, params={'JCAMP': nistid, 'Type': stype,
-                                              'Index': 0})
+                                              'Index': 0}, timeout=TIMEOUT)
+    response.raise_for_status()
     if response.text == '##TITLE=Spectrum not found.\n##END=\n':
         return
     else:
         content = response.content.splitlines()
         content = [line.decode("utf-8") for line in content]
         return content
+
+
+class WebBookFetcher(object):
+    """Looks spectra up on the NIST WebBook."""
+
+    def search_inchi(self, inchi, stype='IR'):
+        return search_nist_inchi(inchi, stype)
+
+    def get_jdx(self, nistid, stype='IR'):
+        return get_jdx(nistid, stype)
+
+
+class LocalFetcher(object):
+    """Looks spectra up in a local directory, e.g. for tests or offline use.
+
+    The directory holds an index.json mapping InChIs to NIST ids, and the
+    JCAMP files named <NIST id>_<type>.jdx.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def search_inchi(self, inchi, stype='IR'):
+        with open(os.path.join(self.path, 'index.json')) as f:
+            return json.load(f).get(inchi)
+
+    def get_jdx(self, nistid, stype='IR'):
+        path = os.path.join(self.path, '%s_%s.jdx' % (nistid, stype))
+        if not os.path.exists(path):
+            return
+
+        with open(path) as f:
+            return f.read().splitlines()
+
+
+_fetcher = WebBookFetcher()
+
+
+def set_fetcher(fetcher):
+    """Replace the fetcher used by find_spectrum, returns the previous one."""
+    global _fetcher
+    previous = _fetcher
+    _fetcher = fetcher
+
+    return previous
+
+
+# Mongo doesn't allow keys starting with $ or containing a dot, JCAMP
+# headers such as "$NIST SOURCE" are stored with the full width characters.
+_ESCAPES = [('$', '\uff04'), ('.', '\uff0e')]
+
+
+def _escape_key(key):
+    for char, escaped in _ESCAPES:
+        key = key.replace(char, escaped)
+
+    return key
+
+
+def _unescape(value):
+    if isinstance(value, dict):
+        return {_unescape_key(k): _unescape(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unescape(v) for v in value]
+
+    return value
+
+
+def _unescape_key(key):
+    for char, escaped in _ESCAPES:
+        key = key.replace(escaped, char)
+
+    return key
+
+
+def _jsonable(value):
+    # jcamp_read returns numpy arrays and scalars, the keys are escaped so
+    # the result can be stored
+    if isinstance(value, dict):
+        return {_escape_key(str(k)): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+
+    return value
+
+
+def find_spectrum(inchi, stype='IR'):
+    """Get the parsed JCAMP spectrum for an InChI or InChIKey.
+
+    Both the NIST id lookup and the spectrum are cached, including misses.
+
+    :returns: The spectrum as returned by jcamp_read, None if NIST has none.
+    """
+    from jcamp import jcamp_read
+
+    cache = ModelImporter.model('nistcache', 'molecules')
+
+    cached = cache.lookup(cache.ID, inchi)
+    if cached is None:
+        cached = cache.store(cache.ID, inchi, _fetcher.search_inchi(inchi,
+                                                                    stype))
+    nistid = cached['value']
+    if nistid is None:
+        return None
+
+    key = '%s_%s' % (nistid, stype)
+    cached = cache.lookup(cache.SPECTRUM, key)
+    if cached is None:
+        jdx = _fetcher.get_jdx(nistid, stype)
+        spectrum = _jsonable(jcamp_read(jdx)) if jdx is not None else None
+        cached = cache.store(cache.SPECTRUM, key, spectrum)
+
+    return _unescape(cached['value'])
@@ -1,18 +1,12 @@
 import json
 import requests
 
-from girder.models.setting import Setting
-
 from molecules.avogadro import convert_str as avo_convert_str
-from molecules.constants import PluginSettings
+from molecules.settings import settings_snapshot
 from molecules.utilities.has_3d_coords import cjson_has_3d_coords
 
 def openbabel_base_url():
-    base_url = Setting().get(PluginSettings.OPENBABEL_BASE_URL)
-    if base_url is None:
-        base_url = 'http://localhost:5000'
-
-    return base_url
+    return settings_snapshot().openbabel_base_url
 
 
 def convert_str(data_str, input_format, output_format, extra_options=None):
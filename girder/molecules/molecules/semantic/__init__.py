@@ -1,17 +1,13 @@
 from . import gainesville
 from . import cheminf
+from . import export
 from . import jena
+from .publisher import publisher
 
-from girder.utility.model_importer import ModelImporter
-from molecules.constants import PluginSettings
+from molecules.settings import settings_snapshot
 
 def upload_molecule(mol):
-    settings = ModelImporter.model('setting')
-    uri_base = settings.get(PluginSettings.SEMANTIC_URI_BASE)
-    if uri_base is None:
-        uri_base = 'http://localhost:8888'
-
-    uri_base = uri_base.rstrip('/')
+    uri_base = settings_snapshot().semantic_uri_base
 
     gainesville_graph = gainesville.create_molecule_graph(uri_base, mol)
     gainesville_id = '%s_gainesville' % mol['_id']
@@ -20,3 +16,16 @@ def upload_molecule(mol):
     cheminf_graph = cheminf.create_molecule_graph(uri_base, mol)
     cheminf_id = '%s_cheminf' % mol['_id']
     jena.upload_rdf(cheminf_id, cheminf_graph)
+
+
+def publish_molecule(mol):
+    """Queue the molecule to be published in the background."""
+    publisher().publish(mol)
+
+
+def recover_pending():
+    """
+    Queue the molecules left pending by a previous run, returns their
+    number.
+    """
+    return publisher().backfill(pending=True)
@@ -6,7 +6,7 @@ from rdflib.namespace import RDF, OWL, NamespaceManager
 cheminf = Namespace('http://semanticscience.org/resource/')
 
 
-def create_molecule_graph(uri_base, mol):
+def create_molecule_graph(uri_base, mol, format='xml'):
     mongochem = Namespace('%s/api/v1/molecules/' % uri_base)
     g = Graph()
     inchi = mol['inchi']
@@ -29,4 +29,4 @@ def create_molecule_graph(uri_base, mol):
     g.add((inchi_node, cheminf.SIO_000300, Literal(inchi)))
     g.add((molecule, cheminf.CHEMINF_000200, inchi_node))
 
-    return g.serialize()
+    return g.serialize(format=format)
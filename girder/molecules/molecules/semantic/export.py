@@ -0,0 +1,234 @@
+"""Bulk export of the semantic graphs of every molecule.
+
+The molecules are read in _id order and their graphs serialized as
+N-Triples by a pool of worker processes, batch by batch. Every batch is
+written to a sink, a gzipped N-Triples file or the triple store, and the
+_id of its last molecule is recorded so an interrupted export can resume
+where it stopped.
+"""
+import gzip
+import multiprocessing
+import os
+
+from bson.objectid import ObjectId
+
+from girder.constants import TerminalColor
+
+from . import cheminf
+from . import gainesville
+from . import jena
+from . import virtuoso
+
+JOB_TYPE = 'molecules.semantic_export'
+
+BATCH_SIZE = 200
+
+NTRIPLES = 'application/n-triples'
+
+
+class FileSink(object):
+    """Appends the triples to a gzipped N-Triples file.
+
+    Every batch is a separate gzip member, so a resumed export can append
+    to the file of the interrupted one. Sinks are given the triples of a
+    batch and the _id of its last molecule.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        if not append:
+            open(path, 'wb').close()
+
+    def write(self, triples, last_id):
+        with gzip.open(self.path, 'ab') as f:
+            f.write(triples)
+
+
+class JenaSink(object):
+    """Uploads each batch to the Jena dataset."""
+
+    def write(self, triples, last_id):
+        jena.upload_rdf(None, triples, content_type=NTRIPLES)
+
+
+class VirtuosoSink(object):
+    """
+    Uploads each batch to the Virtuoso RDF sink, as its own file named after
+    the checkpoint of the batch, so a resumed export doesn't overwrite the
+    batches uploaded before it was interrupted.
+    """
+
+    def write(self, triples, last_id):
+        virtuoso.upload_rdf('export_%s' % last_id, triples,
+                            content_type=NTRIPLES, extension='nt')
+
+
+def _molecule_ntriples(uri_base, mol):
+    mol = dict(mol, _id=str(mol['_id']))
+    cheminf_graph = cheminf.create_molecule_graph(uri_base, mol, format='nt')
+    if isinstance(cheminf_graph, str):
+        cheminf_graph = cheminf_graph.encode('utf-8')
+
+    return gainesville.create_molecule_ntriples(uri_base, mol) + cheminf_graph
+
+
+def serialize_batch(args):
+    """
+    Serialize a batch of molecules, run in the worker processes.
+
+    :returns: The triples and the number of molecules that could not be
+        serialized.
+    """
+    uri_base, mols = args
+    triples = []
+    skipped = 0
+    for mol in mols:
+        try:
+            triples.append(_molecule_ntriples(uri_base, mol))
+        except (KeyError, IndexError, TypeError):
+            # The molecule has no 3D structure or bonds
+            skipped += 1
+
+    return b''.join(triples), skipped
+
+
+def _batches(model, after_id, batch_size):
+    query = {
+        'cjson.atoms.coords.3d': {
+            '$exists': True
+        }
+    }
+    if after_id is not None:
+        query['_id'] = {'$gt': ObjectId(after_id)}
+
+    fields = ['_id', 'inchi', 'inchikey', 'name', 'cjson.atoms',
+              'cjson.bonds']
+    batch = []
+    for mol in model.find(query, fields=fields, sort=[('_id', 1)]):
+        batch.append(mol)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def export_molecules(model, uri_base, sink, after_id=None,
+                     batch_size=BATCH_SIZE, processes=None, progress=None):
+    """
+    Export the graphs of the molecules with an _id greater than after_id.
+
+    :param progress: Called after each batch with the number of molecules
+        exported so far and the _id of the last one, the checkpoint.
+    :returns: The number of molecules exported and skipped.
+    """
+    exported = 0
+    skipped = 0
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # Spawn rather than fork, the server is multithreaded
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes) as pool:
+        batches = _batches(model, after_id, batch_size)
+
+        def _work():
+            for batch in batches:
+                yield (uri_base, batch), batch[-1]['_id'], len(batch)
+
+        work = _work()
+        # Keep the workers busy while the results are written in order
+        pending = []
+        for _ in range(processes * 2):
+            try:
+                args, last_id, count = next(work)
+            except StopIteration:
+                break
+            pending.append((pool.apply_async(serialize_batch, (args,)),
+                            last_id, count))
+
+        while pending:
+            result, last_id, count = pending.pop(0)
+            triples, batch_skipped = result.get()
+            sink.write(triples, last_id)
+            exported += count - batch_skipped
+            skipped += batch_skipped
+            if progress is not None:
+                progress(exported + skipped, last_id)
+
+            try:
+                args, next_id, next_count = next(work)
+                pending.append((pool.apply_async(serialize_batch, (args,)),
+                                next_id, next_count))
+            except StopIteration:
+                pass
+
+    return exported, skipped
+
+
+def resume_after(job):
+    """
+    The _id after which an export continuing job starts, the checkpoint of
+    the job or, if it stopped before its first checkpoint, the _id it
+    started after itself.
+    """
+    checkpoint = job.get('checkpoint')
+    if checkpoint is not None:
+        return checkpoint
+
+    return job['kwargs'].get('afterId')
+
+
+def _sink(target, path, append):
+    if target == 'file':
+        return FileSink(path, append)
+    elif target == 'virtuoso':
+        return VirtuosoSink()
+
+    return JenaSink()
+
+
+def run(job):
+    """Run an export as a girder_jobs local job."""
+    from girder_jobs.constants import JobStatus
+    from girder_jobs.models.job import Job
+    from girder.utility.model_importer import ModelImporter
+
+    from molecules.settings import settings_snapshot
+
+    kwargs = job['kwargs']
+    after_id = kwargs.get('afterId')
+
+    uri_base = settings_snapshot().semantic_uri_base
+
+    model = ModelImporter.model('molecule', 'molecules')
+    total = model.collection.count_documents({
+        'cjson.atoms.coords.3d': {
+            '$exists': True
+        }
+    })
+    job = Job().updateJob(job, status=JobStatus.RUNNING, progressTotal=total,
+                          log='Exporting to %s, after %s\n' % (
+                              kwargs['target'], after_id))
+
+    def _progress(count, last_id):
+        Job().updateJob(job, progressCurrent=count, otherFields={
+            'checkpoint': str(last_id)
+        })
+
+    try:
+        sink = _sink(kwargs['target'], kwargs.get('path'),
+                     after_id is not None)
+        exported, skipped = export_molecules(
+            model, uri_base, sink, after_id, processes=kwargs.get('processes'),
+            progress=_progress)
+    except Exception as ex:
+        print(TerminalColor.error('ERROR: Semantic export failed: %s' % ex))
+        Job().updateJob(job, status=JobStatus.ERROR, log='%s\n' % ex)
+        raise
+
+    Job().updateJob(job, status=JobStatus.SUCCESS,
+                    log='Exported %d molecules, skipped %d\n' % (exported,
+                                                                  skipped))
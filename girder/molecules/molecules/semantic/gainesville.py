@@ -5,12 +5,108 @@ import requests
 import argparse
 import json
 from jsonpath_rw import parse
+import re
 from . import element
 
 gc = Namespace('http://purl.org/gc/#')
 pt = Namespace('http://www.daml.org/2003/01/periodictable/PeriodicTable#')
 
-def create_molecule_graph(uri_base, mol):
+_bond_types = {
+    1: 'Single',
+    2: 'Double',
+    3: 'Triple',
+    4: 'Quadruple'
+}
+
+
+def _literal(value):
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    value = value.replace('\n', '\\n').replace('\r', '\\r')
+
+    return '"%s"' % value
+
+
+def iter_molecule_ntriples(uri_base, mol):
+    """Generate the N-Triples lines of the molecule graph.
+
+    This produces the same graph as create_molecule_graph, straight from the
+    cjson arrays. Blank nodes are labelled with the molecule id, so the
+    output of several molecules can be concatenated.
+    """
+    id = str(mol['_id'])
+    cjson = mol['cjson']
+    atomic_numbers = cjson['atoms']['elements']['number']
+    coordinates_values = cjson['atoms']['coords']['3d']
+    bonds = cjson['bonds']
+    orders = bonds['order']
+    connections = bonds['connections']['index']
+
+    molecule_uri = '%s/api/v1/molecules/%s' % (uri_base, id)
+    molecule = '<%s>' % molecule_uri
+    bnode = '_:m%s' % re.sub(r'[^A-Za-z0-9]', '', id)
+    rdf_type = '<%s>' % RDF.type
+    gc_uri = str(gc)
+    pt_uri = str(pt)
+
+    yield '%s %s <%sMolecule> .\n' % (molecule, rdf_type, gc_uri)
+    yield '%s <%shasNumberOfAtoms> %s .\n' % (
+        molecule, gc_uri, _literal(str(len(atomic_numbers))))
+    yield '%s <%shasBondCount> %s .\n' % (
+        molecule, gc_uri, _literal(str(len(orders))))
+    yield '%s <%shasInchIKey> %s .\n' % (
+        molecule, gc_uri, _literal(mol['inchikey']))
+
+    atom_template = (
+        '{atom} {type} <{gc}Atom> .\n'
+        '{atom} <{gc}isElement> <{pt}{symbol}> .\n'
+        '{mass} {type} <{gc}FloatValue> .\n'
+        '{mass} <{gc}hasFloatValue> "{mass_value}" .\n'
+        '{mass} <{gc}hasUnit> <{gc}atomicUnit> .\n'
+        '{atom} <{gc}hasMass> {mass} .\n'
+        '{coords} {type} <{gc}VectorValue> .\n'
+        '{coords} <{gc}hasVectorValue> "{coords_value}" .\n'
+        '{coords} <{gc}hasUnit> <{gc}angstrom> .\n'
+        '{atom} <{gc}hasCoordinates> {coords} .\n'
+        '{molecule} <{gc}hasAtom> {atom} .\n'
+    )
+    for index, a in enumerate(atomic_numbers):
+        yield atom_template.format(
+            atom='<%s/atoms/%d>' % (molecule_uri, index),
+            type=rdf_type,
+            gc=gc_uri,
+            pt=pt_uri,
+            symbol=element.symbols[a],
+            mass='%sa%dm' % (bnode, index),
+            mass_value=str(element.masses[a]),
+            coords='%sa%dc' % (bnode, index),
+            # The same coordinates as create_molecule_graph
+            coords_value='%f %f %f' % (coordinates_values[index],
+                                       coordinates_values[index + 1],
+                                       coordinates_values[index + 2]),
+            molecule=molecule)
+
+    for b, order in enumerate(orders):
+        from_atom = connections[2 * b]
+        to_atom = connections[2 * b + 1]
+        bond = '<%s/bonds/a%d-a%d>' % (molecule_uri, from_atom, to_atom)
+        bond_type = _bond_types.get(order, 'Aromatic')
+
+        yield '%s %s <%s%s> .\n' % (bond, rdf_type, gc_uri, bond_type)
+        yield '<%s/atoms/%d> <%shasBond> %s .\n' % (molecule_uri, from_atom,
+                                                    gc_uri, bond)
+        yield '<%s/atoms/%d> <%shasBond> %s .\n' % (molecule_uri, to_atom,
+                                                    gc_uri, bond)
+
+
+def create_molecule_ntriples(uri_base, mol):
+    return ''.join(iter_molecule_ntriples(uri_base, mol)).encode('utf-8')
+
+
+def create_molecule_graph(uri_base, mol, format='xml'):
+    # N-Triples are written directly, without building an rdflib graph
+    if format == 'nt':
+        return create_molecule_ntriples(uri_base, mol)
+
     id = mol['_id']
     g = Graph()
 
@@ -86,6 +182,6 @@ def create_molecule_graph(uri_base, mol):
         g.add((atoms[from_atom], gc.hasBond, bond))
         g.add((atoms[to_atom], gc.hasBond, bond))
 
-    return g.serialize()
+    return g.serialize(format=format)
 
 
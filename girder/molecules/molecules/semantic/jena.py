@@ -1,25 +1,16 @@
-from girder.utility.model_importer import ModelImporter
 import requests
 
-from molecules.constants import PluginSettings
+from molecules.settings import settings_snapshot
 
-def upload_rdf(_, rdf):
-    settings = ModelImporter.model('setting')
+def upload_rdf(_, rdf, content_type='application/rdf+xml'):
+    settings = settings_snapshot()
 
-    base_url = settings.get(PluginSettings.JENA_BASE_URL)
-    if base_url is None:
-        base_url = 'http://jena-fuseki:3030'
-
-    user = settings.get(PluginSettings.JENA_USER)
-    password = settings.get(PluginSettings.JENA_PASSWORD)
-    dataset = settings.get(PluginSettings.JENA_DATASET)
-
-    base_url = base_url.rstrip('/')
-
-    url = '%s/%s/data' % (base_url, dataset)
+    url = '%s/%s/data' % (settings.jena_base_url, settings.jena_dataset)
     headers = {
-        'Content-Type': 'application/rdf+xml'
+        'Content-Type': content_type
     }
 
-    r = requests.post(url, headers=headers, data=rdf, auth=(user, password))
+    auth = (settings.jena_user, settings.jena_password)
+
+    r = requests.post(url, headers=headers, data=rdf, auth=auth)
     r.raise_for_status()
@@ -0,0 +1,183 @@
+import datetime
+import queue
+import threading
+import time
+
+from bson.objectid import ObjectId
+from girder.constants import TerminalColor
+
+from molecules.models.molecule import Molecule as MoleculeModel
+from molecules.settings import settings_snapshot
+
+from . import cheminf
+from . import gainesville
+from . import jena
+
+PENDING = 'pending'
+PUBLISHED = 'published'
+FAILED = 'failed'
+
+NTRIPLES = 'application/n-triples'
+
+
+class Publisher(object):
+    """
+    Publishes the semantic graphs of molecules in the background.
+
+    Molecules are queued, and the ones queued within BATCH_DELAY seconds of
+    each other (up to BATCH_SIZE) are published with a single N-Triples
+    upload. Failed uploads are retried with an exponential backoff. The
+    state of each molecule is recorded in its 'semantic' field, so the ones
+    that were never published can be found by backfill().
+    """
+
+    BATCH_SIZE = 100
+    BATCH_DELAY = 2.0
+    MAX_ATTEMPTS = 5
+    INITIAL_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, upload=None):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._upload = upload if upload is not None else jena.upload_rdf
+
+    def _set_state(self, ids, status, error=None):
+        state = {
+            'status': status,
+            'updated': datetime.datetime.utcnow()
+        }
+        if error is not None:
+            state['error'] = error
+
+        super(MoleculeModel, MoleculeModel()).update(
+            {'_id': {'$in': list(ids)}}, {'$set': {'semantic': state}})
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='semantic-publisher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def publish(self, mol):
+        """Queue a molecule to be published."""
+        self._set_state([mol['_id']], PENDING)
+        self._queue.put(mol['_id'])
+        self._start()
+
+    def backfill(self, pending=False):
+        """
+        Queue the molecules with 3D coordinates that have not been
+        published, returns their number.
+
+        :param pending: Only queue the molecules that were queued but not
+            published yet, their queue was lost with the previous run.
+        """
+        query = {
+            'semantic.status': {
+                '$ne': PUBLISHED
+            },
+            'cjson.atoms.coords.3d': {
+                '$exists': True
+            }
+        }
+        if pending:
+            query['semantic.status'] = PENDING
+        count = 0
+        for mol in MoleculeModel().find(query, fields=['_id']):
+            self._queue.put(mol['_id'])
+            count += 1
+
+        if count:
+            self._start()
+
+        return count
+
+    def _next_batch(self):
+        ids = [self._queue.get()]
+        deadline = time.time() + self.BATCH_DELAY
+        while len(ids) < self.BATCH_SIZE:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                ids.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return list(dict.fromkeys(ids))
+
+    def _run(self):
+        while True:
+            ids = self._next_batch()
+            try:
+                self.publish_batch(ids)
+            except Exception as ex:
+                print(TerminalColor.error(
+                    'ERROR: Unable to publish %d molecules: %s' %
+                    (len(ids), ex)))
+
+    def _graphs(self, mols):
+        uri_base = settings_snapshot().semantic_uri_base
+
+        published = []
+        invalid = []
+        triples = []
+        for mol in mols:
+            # The graphs build URIs from the id
+            mol = dict(mol, _id=str(mol['_id']))
+            try:
+                graphs = [
+                    gainesville.create_molecule_graph(uri_base, mol,
+                                                      format='nt'),
+                    cheminf.create_molecule_graph(uri_base, mol, format='nt')
+                ]
+            except (KeyError, IndexError, TypeError):
+                # The molecule has no 3D structure or bonds
+                invalid.append(ObjectId(mol['_id']))
+                continue
+
+            for graph in graphs:
+                if isinstance(graph, str):
+                    graph = graph.encode('utf-8')
+                triples.append(graph)
+            published.append(ObjectId(mol['_id']))
+
+        return published, invalid, b''.join(triples)
+
+    def publish_batch(self, ids):
+        """Publish the molecules in a single upload, retrying on failure."""
+        mols = MoleculeModel().find({'_id': {'$in': list(ids)}})
+        published, invalid, triples = self._graphs(mols)
+
+        if invalid:
+            self._set_state(invalid, FAILED, 'invalid structure')
+        if not published:
+            return
+
+        backoff = self.INITIAL_BACKOFF
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                self._upload(None, triples, content_type=NTRIPLES)
+                self._set_state(published, PUBLISHED)
+                return
+            except Exception as ex:
+                error = str(ex)
+                if attempt < self.MAX_ATTEMPTS:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+        print(TerminalColor.warning(
+            'WARNING: Unable to publish %d molecules: %s' %
+            (len(published), error)))
+        self._set_state(published, FAILED, error)
+
+
+_publisher = Publisher()
+
+
+def publisher():
+    return _publisher
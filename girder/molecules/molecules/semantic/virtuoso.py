@@ -1,28 +1,17 @@
-from girder.utility.model_importer import ModelImporter
 import requests
 
-from molecules.constants import PluginSettings
+from molecules.settings import settings_snapshot
 
-def upload_rdf(id, rdf):
-    settings = ModelImporter.model('setting')
+def upload_rdf(id, rdf, content_type='application/rdf+xml', extension='rdf'):
+    settings = settings_snapshot()
 
-    user = settings.get(PluginSettings.VIRTUOSO_USER)
-    password = settings.get(PluginSettings.VIRTUOSO_PASSWORD)
-    base_url = settings.get(PluginSettings.VIRTUOSO_BASE_URL)
-    if base_url is None:
-        base_url = 'http://localhost:8890'
-
-    upload_path = settings.get(PluginSettings.VIRTUOSO_RDF_UPLOAD_PATH)
-    if upload_path is None:
-        upload_path = 'DAV/home/mongochem/rdf_sink'
-
-    base_url = base_url.rstrip('/')
-    upload_path = upload_path.strip('/')
-
-    url = '%s/%s/%s.rdf' % (base_url, upload_path, id)
+    url = '%s/%s/%s.%s' % (settings.virtuoso_base_url,
+                           settings.virtuoso_rdf_upload_path, id, extension)
     headers = {
-        'content-type': 'application/rdf+xml'
+        'content-type': content_type
     }
 
-    r = requests.put(url, headers=headers, data=rdf, auth=(user, password))
+    auth = (settings.virtuoso_user, settings.virtuoso_password)
+
+    r = requests.put(url, headers=headers, data=rdf, auth=auth)
     r.raise_for_status()
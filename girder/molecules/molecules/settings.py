@@ -0,0 +1,119 @@
+import threading
+from collections import namedtuple
+
+from girder.models.setting import Setting
+
+from molecules.constants import PluginSettings
+
+# The settings of the plugin, with their defaults applied
+SettingsSnapshot = namedtuple('SettingsSnapshot', [
+    'openbabel_base_url',
+    'avogadro_base_url',
+    'semantic_uri_base',
+    'jena_base_url',
+    'jena_user',
+    'jena_password',
+    'jena_dataset',
+    'virtuoso_base_url',
+    'virtuoso_rdf_upload_path',
+    'virtuoso_user',
+    'virtuoso_password'
+])
+
+_KEYS = [
+    PluginSettings.OPENBABEL_BASE_URL,
+    PluginSettings.AVOGADRO_BASE_URL,
+    PluginSettings.SEMANTIC_URI_BASE,
+    PluginSettings.JENA_BASE_URL,
+    PluginSettings.JENA_USER,
+    PluginSettings.JENA_PASSWORD,
+    PluginSettings.JENA_DATASET,
+    PluginSettings.VIRTUOSO_BASE_URL,
+    PluginSettings.VIRTUOSO_RDF_UPLOAD_PATH,
+    PluginSettings.VIRTUOSO_USER,
+    PluginSettings.VIRTUOSO_PASSWORD
+]
+
+_snapshot = None
+# The stored values of the settings, the snapshot is built from them
+_values = {}
+_lock = threading.Lock()
+
+
+def _load():
+    # All the settings are read with a single query
+    return {
+        setting['key']: setting.get('value')
+        for setting in Setting().find({'key': {'$in': _KEYS}})
+    }
+
+
+def _build(values):
+    def _get(key, default=None):
+        value = values.get(key)
+        return default if value is None else value
+
+    return SettingsSnapshot(
+        openbabel_base_url=_get(PluginSettings.OPENBABEL_BASE_URL,
+                                'http://localhost:5000'),
+        avogadro_base_url=_get(PluginSettings.AVOGADRO_BASE_URL,
+                               'http://localhost:5001'),
+        semantic_uri_base=_get(PluginSettings.SEMANTIC_URI_BASE,
+                               'http://localhost:8888').rstrip('/'),
+        jena_base_url=_get(PluginSettings.JENA_BASE_URL,
+                           'http://jena-fuseki:3030').rstrip('/'),
+        jena_user=_get(PluginSettings.JENA_USER),
+        jena_password=_get(PluginSettings.JENA_PASSWORD),
+        jena_dataset=_get(PluginSettings.JENA_DATASET),
+        virtuoso_base_url=_get(PluginSettings.VIRTUOSO_BASE_URL,
+                               'http://localhost:8890').rstrip('/'),
+        virtuoso_rdf_upload_path=_get(
+            PluginSettings.VIRTUOSO_RDF_UPLOAD_PATH,
+            'DAV/home/mongochem/rdf_sink').strip('/'),
+        virtuoso_user=_get(PluginSettings.VIRTUOSO_USER),
+        virtuoso_password=_get(PluginSettings.VIRTUOSO_PASSWORD)
+    )
+
+
+def refresh():
+    global _snapshot, _values
+    with _lock:
+        _values = _load()
+        _snapshot = _build(_values)
+
+    return _snapshot
+
+
+def _update(key, value):
+    global _snapshot, _values
+    with _lock:
+        _values = dict(_values)
+        if value is None:
+            _values.pop(key, None)
+        else:
+            _values[key] = value
+        _snapshot = _build(_values)
+
+
+def settings_snapshot():
+    """
+    The settings of the plugin, read when it is loaded and again whenever
+    one of them changes.
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = refresh()
+
+    return snapshot
+
+
+def on_setting_saved(event):
+    if event.info.get('key') in _KEYS:
+        _update(event.info['key'], event.info.get('value'))
+
+
+def on_setting_removed(event):
+    # The event is triggered before the setting is deleted, so the default
+    # is applied without reading the settings back
+    if event.info.get('key') in _KEYS:
+        _update(event.info['key'], None)
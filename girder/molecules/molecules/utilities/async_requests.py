@@ -1,25 +1,54 @@
-import functools
 import json
 import requests
 import datetime
 
-from requests_futures.sessions import FuturesSession
-
 from girder.constants import TerminalColor
 from girder.models.notification import Notification
 from girder.models.model_base import ValidationException
 from girder.utility.model_importer import ModelImporter
 
+from .cube import cube_cjson
 from .whitelist_cjson import whitelist_cjson
+from . import tasks
 
 from molecules.avogadro import avogadro_base_url
+from molecules.constants import CubeEngine, CubeQuality
 from molecules.openbabel import openbabel_base_url
 
 from .. import avogadro
+from .. import chemspider
 from .. import semantic
 
 from ..models.molecule import Molecule as MoleculeModel
 
+# The event handled in the background to recover the interrupted work
+RECOVER_TASKS_EVENT = 'molecules.recover_tasks'
+
+# The timeout of the requests to the services, in seconds
+TIMEOUT = 300
+
+SVG_TASK = 'svg'
+GEN_3D_TASK = '3d_coords'
+ORBITAL_TASK = 'orbital'
+ORBITALS_TASK = 'orbitals'
+
+
+def _update_molecule(query, updates):
+    # Molecule overrides update() to save a document
+    return super(MoleculeModel, MoleculeModel()).update(query, updates)
+
+
+def _orbital_notification(id, orig_mo, quality, user, error=None):
+    data = {'id': id, 'mo': orig_mo, 'quality': quality}
+    if error is not None:
+        data['error'] = error
+
+    Notification().createNotification(
+        type='cube.status',
+        data=data,
+        user=user,
+        expires=datetime.datetime.utcnow() + datetime.timedelta(seconds=30))
+
 
 def schedule_svg_gen(mol, user):
     query = {
@@ -32,8 +61,15 @@ def schedule_svg_gen(mol, user):
         }
     }
 
-    super(MoleculeModel, MoleculeModel()).update(query, updates)
+    _update_molecule(query, updates)
 
+    tasks.enqueue(SVG_TASK, {
+        'moleculeId': mol['_id'],
+        'smiles': mol['smiles']
+    }, user=user, key='svg:%s' % mol['_id'])
+
+
+def _svg_gen(args, user):
     base_url = openbabel_base_url()
     path = 'convert'
     output_format = 'svg'
@@ -42,44 +78,44 @@ def schedule_svg_gen(mol, user):
 
     data = {
         'format': 'smi',
-        'data': mol['smiles']
+        'data': args['smiles']
     }
 
-    session = FuturesSession()
-    future = session.post(url, json=data)
-
-    inchikey = mol['inchikey']
-    future.add_done_callback(functools.partial(_finish_svg_gen,
-                                               inchikey, user))
-
-
-def _finish_svg_gen(inchikey, user, future):
-
-    resp = future.result()
+    resp = requests.post(url, json=data, timeout=TIMEOUT)
+    resp.raise_for_status()
 
     query = {
-        'inchikey': inchikey
+        '_id': args['moleculeId']
     }
 
-    updates = {}
-    updates.setdefault('$unset', {})['generating_svg'] = ''
-
-    if resp.status_code == 200:
-        updates.setdefault('$set', {})['svg'] = resp.text
-    else:
-        print('Generating SVG failed!')
-        print('Status code was:', resp.status_code)
-        print('Reason was:', resp.reason)
+    updates = {
+        '$set': {
+            'svg': resp.text
+        },
+        '$unset': {
+            'generating_svg': ''
+        }
+    }
 
-    update_result = super(MoleculeModel,
-                          MoleculeModel()).update(query, updates)
+    update_result = _update_molecule(query, updates)
 
     if update_result.matched_count == 0:
-        raise ValidationException('Invalid inchikey (%s)' % inchikey)
+        raise ValidationException('Invalid molecule (%s)' %
+                                  args['moleculeId'])
+
+
+def _svg_gen_failed(args, user, error):
+    print(TerminalColor.warning('WARNING: Generating SVG failed: %s' % error))
+    _update_molecule({'_id': args['moleculeId']},
+                     {'$unset': {'generating_svg': ''}})
 
 
-def schedule_3d_coords_gen(mol, user, on_complete=None,
+def schedule_3d_coords_gen(mol, user, publish=False,
                            gen3d_forcefield='mmff94', gen3d_steps=100):
+    """
+    Generate the 3D coordinates of the molecule in the background, if
+    publish is True the semantic graphs are published once they are set.
+    """
     query = {
         '_id': mol['_id']
     }
@@ -90,8 +126,18 @@ def schedule_3d_coords_gen(mol, user, on_complete=None,
         }
     }
 
-    super(MoleculeModel, MoleculeModel()).update(query, updates)
+    _update_molecule(query, updates)
 
+    tasks.enqueue(GEN_3D_TASK, {
+        'moleculeId': mol['_id'],
+        'smiles': mol['smiles'],
+        'forcefield': gen3d_forcefield,
+        'steps': gen3d_steps,
+        'publish': publish
+    }, user=user, key='3d_coords:%s' % mol['_id'])
+
+
+def _3d_coords_gen(args, user):
     base_url = openbabel_base_url()
     path = 'convert'
     output_format = 'sdf'
@@ -100,95 +146,212 @@ def schedule_3d_coords_gen(mol, user, on_complete=None,
 
     data = {
         'format': 'smi',
-        'data': mol['smiles'],
+        'data': args['smiles'],
         'gen3d': True,
-        'gen3dForcefield': gen3d_forcefield,
-        'gen3dSteps': gen3d_steps
+        'gen3dForcefield': args['forcefield'],
+        'gen3dSteps': args['steps']
     }
 
-    session = FuturesSession()
-    future = session.post(url, json=data)
+    resp = requests.post(url, json=data, timeout=TIMEOUT)
+    resp.raise_for_status()
 
-    inchikey = mol['inchikey']
-    future.add_done_callback(functools.partial(_finish_3d_coords_gen,
-                                               inchikey, user, on_complete))
+    sdf_data = resp.text
+    cjson = json.loads(avogadro.convert_str(sdf_data, 'sdf', 'cjson'))
+    cjson = whitelist_cjson(cjson)
+
+    query = {
+        '_id': args['moleculeId']
+    }
 
+    updates = {
+        '$set': {
+            'cjson': cjson
+        },
+        '$unset': {
+            'generating_3d_coords': ''
+        }
+    }
 
-def _finish_3d_coords_gen(inchikey, user, on_complete, future):
+    update_result = _update_molecule(query, updates)
 
-    resp = future.result()
+    if update_result.matched_count == 0:
+        raise ValidationException('Invalid molecule (%s)' %
+                                  args['moleculeId'])
 
-    query = {
-        'inchikey': inchikey
-    }
+    if args.get('publish'):
+        # Publish the molecule to Jena, in batches in the background
+        semantic.publish_molecule(MoleculeModel().findOne(query))
 
-    updates = {}
-    updates.setdefault('$unset', {})['generating_3d_coords'] = ''
 
-    if resp.status_code == 200:
-        sdf_data = resp.text
-        cjson = json.loads(avogadro.convert_str(sdf_data, 'sdf',
-                                                'cjson'))
-        cjson = whitelist_cjson(cjson)
-        updates.setdefault('$set', {})['cjson'] = cjson
-    else:
-        print('Generating SDF failed!')
-        print('Status code was:', resp.status_code)
-        print('Reason was:', resp.reason)
+def _3d_coords_gen_failed(args, user, error):
+    print(TerminalColor.warning(
+        'WARNING: Generating 3D coordinates failed: %s' % error))
+    _update_molecule({'_id': args['moleculeId']},
+                     {'$unset': {'generating_3d_coords': ''}})
 
-    update_result = super(MoleculeModel,
-                          MoleculeModel()).update(query, updates)
 
-    if update_result.matched_count == 0:
-        raise ValidationException('Invalid inchikey (%s)' % inchikey)
+def _calculation_cjson(id):
+    calc = ModelImporter.model('calculation', 'molecules').load(
+        id, fields=['cjson'], force=True)
+    if calc is None:
+        raise ValidationException('Invalid calculation (%s)' % id)
 
-    # Call the on_complete callback is we have one.
-    if on_complete is not None:
-        mol = MoleculeModel().findOne(query)
-        on_complete(mol)
+    return calc['cjson']
 
 
-def schedule_orbital_gen(cjson, mo, id, orig_mo, user):
+def schedule_orbital_gen(cjson, mo, id, orig_mo, user,
+                         quality=CubeQuality.MEDIUM):
+    """
+    Calculate the cube of a molecular orbital in the background, a
+    "cube.status" notification is sent once it is cached. The cube of an
+    orbital is only queued once.
+    """
     cjson['generating_orbital'] = True
 
+    tasks.enqueue(ORBITAL_TASK, {
+        'calculationId': str(id),
+        'mo': mo,
+        'origMo': orig_mo,
+        'quality': quality
+    }, user=user, key='orbital:%s:%s:%s' % (id, mo, quality))
+
+
+def _orbital_gen(args, user):
+    id = args['calculationId']
+    mo = args['mo']
+    quality = args['quality']
+
     base_url = avogadro_base_url()
     path = 'calculate-mo'
     url = '/'.join([base_url, path])
 
     data = {
-        'cjson': cjson,
+        'cjson': _calculation_cjson(id),
         'mo': mo,
+        'quality': quality,
+        'engine': CubeEngine.DEFAULT
     }
 
-    session = FuturesSession()
-    future = session.post(url, json=data)
+    resp = requests.post(url, json=data, timeout=TIMEOUT)
+    resp.raise_for_status()
 
-    future.add_done_callback(functools.partial(
-        _finish_orbital_gen, mo, id, user, orig_mo))
+    cjson = json.loads(resp.text)
+    cjson['generating_orbital'] = False
 
+    if 'vibrations' in cjson:
+        del cjson['vibrations']
 
-def _finish_orbital_gen(mo, id, user, orig_mo, future):
-    resp = future.result()
-    if resp.status_code == 200:
-        cjson = json.loads(resp.text)
-        cjson['generating_orbital'] = False
+    # Add cube to cache
+    ModelImporter.model('cubecache', 'molecules').create(id, mo, cjson,
+                                                         quality)
 
-        if 'vibrations' in cjson:
-            del cjson['vibrations']
+    # Create notification to indicate cube can be retrieved now
+    _orbital_notification(id, args['origMo'], quality, user)
 
-        # Add cube to cache
-        ModelImporter.model('cubecache', 'molecules').create(id, mo, cjson)
 
-        # Create notification to indicate cube can be retrieved now
-        data = {'id': id, 'mo': orig_mo}
-    else:
-        data = {
-            'id': id,
-            'mo': orig_mo,
-            'error': 'Status code ' + str(resp.status_code) + ': Orbital could not be calculated.'}
+def _orbital_gen_failed(args, user, error):
+    _orbital_notification(args['calculationId'], args['origMo'],
+                          args['quality'], user,
+                          error='%s: Orbital could not be calculated.' %
+                          error)
 
-    Notification().createNotification(
-        type='cube.status',
-        data=data,
-        user=user,
-        expires=datetime.datetime.utcnow() + datetime.timedelta(seconds=30))
+
+def schedule_orbitals_gen(cjson, mos, id, orig_mos, user,
+                          quality=CubeQuality.MEDIUM):
+    tasks.enqueue(ORBITALS_TASK, {
+        'calculationId': str(id),
+        'mos': mos,
+        'origMos': orig_mos,
+        'quality': quality
+    }, user=user, key='orbitals:%s:%s:%s' % (
+        id, quality, ','.join(str(mo) for mo in mos)))
+
+
+def _orbitals_gen(args, user):
+    id = args['calculationId']
+    quality = args['quality']
+    cjson = _calculation_cjson(id)
+
+    base_url = avogadro_base_url()
+    path = 'calculate-mos'
+    url = '/'.join([base_url, path])
+
+    data = {
+        'cjson': cjson,
+        'mos': args['mos'],
+        'quality': quality
+    }
+
+    resp = requests.post(url, json=data, timeout=TIMEOUT)
+    resp.raise_for_status()
+
+    results = resp.json()
+    for result in results['cubes']:
+        cube = cube_cjson(cjson, result['cube'])
+        cube['generating_orbital'] = False
+
+        # Add cube to cache
+        ModelImporter.model('cubecache', 'molecules').create(
+            id, result['mo'], cube, quality, engine=results['engine'])
+
+    # Create notifications to indicate cubes can be retrieved now
+    for orig_mo in args['origMos']:
+        _orbital_notification(id, orig_mo, quality, user)
+
+
+def _orbitals_gen_failed(args, user, error):
+    for orig_mo in args['origMos']:
+        _orbital_notification(args['calculationId'], orig_mo,
+                              args['quality'], user,
+                              error='%s: Orbital could not be calculated.' %
+                              error)
+
+
+tasks.register(SVG_TASK, _svg_gen, _svg_gen_failed)
+tasks.register(GEN_3D_TASK, _3d_coords_gen, _3d_coords_gen_failed)
+tasks.register(ORBITAL_TASK, _orbital_gen, _orbital_gen_failed)
+tasks.register(ORBITALS_TASK, _orbitals_gen, _orbitals_gen_failed)
+
+
+def recover_tasks(event=None):
+    """
+    Queue the generation of the molecules flagged as generating that have no
+    task, their work was lost with a server that predates the task queue or
+    was interrupted before it was queued, the resolution of the names left
+    pending and the publishing of the molecules left pending. Then start the
+    workers, which also pick up the tasks left
+    by a previous run.
+    """
+    task_model = ModelImporter.model('task', 'molecules')
+    fields = ['_id', 'smiles', 'generating_svg', 'generating_3d_coords']
+    query = {
+        '$or': [{
+            'generating_svg': True
+        }, {
+            'generating_3d_coords': True
+        }]
+    }
+
+    recovered = 0
+    for mol in MoleculeModel().find(query, fields=fields):
+        if mol.get('generating_svg') and \
+                not task_model.is_active('svg:%s' % mol['_id']):
+            schedule_svg_gen(mol, None)
+            recovered += 1
+        if mol.get('generating_3d_coords') and \
+                not task_model.is_active('3d_coords:%s' % mol['_id']):
+            schedule_3d_coords_gen(mol, None, publish=True)
+            recovered += 1
+
+    if recovered:
+        print(TerminalColor.info('Recovered %d interrupted tasks.' %
+                                 recovered))
+
+    chemspider.recover_pending_names()
+
+    published = semantic.recover_pending()
+    if published:
+        print(TerminalColor.info('Queued %d molecules left pending for '
+                                 'publishing.' % published))
+
+    tasks.runner().start()
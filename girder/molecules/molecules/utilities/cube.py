@@ -0,0 +1,11 @@
+def cube_cjson(cjson, cube):
+    """Build the cjson stored in the cube cache for a calculation cube."""
+    cjson = dict(cjson)
+
+    # Remove the vibrational mode data from the cube - big, not needed here.
+    if 'vibrations' in cjson:
+        del cjson['vibrations']
+
+    cjson['cube'] = cube
+
+    return cjson
@@ -1,15 +1,12 @@
 import json
-import requests
 
 from jsonpath_rw import parse
 
 from .. import avogadro
 from .. import openbabel
 from .. import chemspider
-from .. import semantic
 from .. import constants
 from molecules.models.molecule import Molecule as MoleculeModel
-from girder.constants import TerminalColor
 from girder.api.rest import RestException
 
 from .async_requests import schedule_3d_coords_gen, schedule_svg_gen
@@ -80,11 +77,14 @@ def create_molecule(data_str, input_format, user, public, gen3d=True,
             'provenance': provenance
         }
 
-        # Set a name if we find one or one is provided
+        # Set a name if one is provided or it has already been resolved,
+        # otherwise it is looked up in the background.
+        resolve_name = False
         if 'name' in parameters:
             name = parameters['name']
         else:
-            name = chemspider.find_common_name(inchikey)
+            resolved, name = chemspider.cached_common_name(inchikey)
+            resolve_name = not resolved
         if name is not None:
             mol_dict['name'] = name
 
@@ -98,15 +98,12 @@ def create_molecule(data_str, input_format, user, public, gen3d=True,
 
         mol = MoleculeModel().create(user, mol_dict, public)
 
+        if resolve_name:
+            chemspider.schedule_common_name(mol['_id'], inchikey)
+
         if using_2d_format and gen3d:
-            def _on_complete(mol):
-                # Upload the molecule to Jen
-                try:
-                    semantic.upload_molecule(mol)
-                except requests.ConnectionError:
-                    print(TerminalColor.warning('WARNING: Couldn\'t connect to Jena.'))
-
-            schedule_3d_coords_gen(mol_dict, user, on_complete=_on_complete,
+            # Publish the molecule to Jena once it has 3D coordinates
+            schedule_3d_coords_gen(mol_dict, user, publish=True,
                                    gen3d_forcefield=gen3d_forcefield,
                                    gen3d_steps=gen3d_steps)
 
@@ -0,0 +1,166 @@
+import datetime
+import threading
+import time
+
+from bson.binary import Binary
+import numpy as np
+
+from molecules.utilities import spectrum as spectrum_utils
+
+COSINE = 'cosine'
+CORRELATION = 'correlation'
+METRICS = [COSINE, CORRELATION]
+
+# All the spectra are compared on this grid (cm-1).
+MIN_FREQUENCY = 0.0
+MAX_FREQUENCY = 4000.0
+POINTS = 800
+
+# The lines of calculated spectra are broadened to this width (cm-1).
+DEFAULT_WIDTH = 20.0
+
+
+def _grid():
+    return np.linspace(MIN_FREQUENCY, MAX_FREQUENCY, POINTS)
+
+
+def _normalize(values):
+    norm = np.linalg.norm(values)
+    if norm == 0:
+        return values
+
+    return values / norm
+
+
+def fingerprint(frequencies, intensities):
+    """The measured spectrum resampled on the common grid, unit normalized."""
+    values = spectrum_utils.resample(_grid(), frequencies, intensities)
+
+    return _normalize(values)
+
+
+def calculated_fingerprint(frequencies, intensities, width=DEFAULT_WIDTH):
+    """The fingerprint of a broadened stick spectrum."""
+    _, values = spectrum_utils.broaden(
+        frequencies, intensities, spectrum_utils.GAUSSIAN, width,
+        MIN_FREQUENCY, MAX_FREQUENCY, POINTS)
+
+    return _normalize(values)
+
+
+def encode_fingerprint(values):
+    return Binary(np.asarray(values, dtype='<f4').tobytes())
+
+
+def decode_fingerprint(data):
+    return np.frombuffer(bytes(data), dtype='<f4').astype(float)
+
+
+def _centered(matrix):
+    centered = matrix - matrix.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+
+    return centered / norms
+
+
+class SpectrumIndex(object):
+    """
+    The fingerprints of the experimental spectra held as a matrix, so a
+    query is a single matrix vector product. New experiments are appended
+    by reading the documents created since the last refresh.
+
+    The creation dates are set by the processes inserting the experiments,
+    which may lag behind each other, so each refresh reads back OVERLAP
+    seconds further and skips the experiments already indexed. The whole
+    index is also reloaded every RELOAD_INTERVAL seconds, for the inserts
+    that took longer than that to land.
+    """
+
+    OVERLAP = 60
+    RELOAD_INTERVAL = 10 * 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._ids = []
+        self._indexed = set()
+        self._refreshed = None
+        self._loaded = None
+        self._cosine = np.empty((0, POINTS))
+        self._correlation = np.empty((0, POINTS))
+
+    def refresh(self, model):
+        with self._lock:
+            # Documents have been removed, or the index is due a reload,
+            # start over.
+            if model.collection.count_documents({}) < len(self._ids) or \
+                    (self._loaded is not None and
+                     time.time() - self._loaded > self.RELOAD_INTERVAL):
+                self._reset()
+
+            query = {}
+            if self._refreshed is not None:
+                query['created'] = {
+                    '$gte': self._refreshed - datetime.timedelta(
+                        seconds=self.OVERLAP)
+                }
+            else:
+                self._loaded = time.time()
+            self._refreshed = datetime.datetime.utcnow()
+
+            fields = ['_id', 'fingerprint']
+            ids = []
+            rows = []
+            for doc in model.find(query, fields=fields):
+                if doc['_id'] in self._indexed:
+                    continue
+                if 'fingerprint' in doc:
+                    row = decode_fingerprint(doc['fingerprint'])
+                else:
+                    row = model.fingerprint(model.findOne({'_id': doc['_id']}))
+                ids.append(doc['_id'])
+                rows.append(row)
+
+            if rows:
+                rows = np.array(rows)
+                self._ids.extend(ids)
+                self._indexed.update(ids)
+                self._cosine = np.vstack([self._cosine, rows])
+                self._correlation = np.vstack([self._correlation,
+                                               _centered(rows)])
+
+            return len(rows)
+
+    def search(self, values, metric=COSINE, limit=10):
+        """
+        :returns: The (id, score) of the limit most similar spectra, best
+            first.
+        """
+        values = np.asarray(values, dtype=float)
+        with self._lock:
+            if metric == CORRELATION:
+                matrix = self._correlation
+                values = _centered(values[None, :])[0]
+            else:
+                matrix = self._cosine
+            ids = self._ids
+
+            scores = matrix @ values
+
+        if len(scores) > limit:
+            best = np.argpartition(-scores, limit)[:limit]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+
+        return [(ids[i], float(scores[i])) for i in best]
+
+
+_index = SpectrumIndex()
+
+
+def experiment_index():
+    return _index
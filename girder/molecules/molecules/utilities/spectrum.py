@@ -0,0 +1,67 @@
+import numpy as np
+
+GAUSSIAN = 'gaussian'
+LORENTZIAN = 'lorentzian'
+LINE_SHAPES = [GAUSSIAN, LORENTZIAN]
+
+# The number of grid points broadened at once, bounds the temporary
+# (points x peaks) array.
+BLOCK_SIZE = 2048
+
+
+def _gaussian(delta, width):
+    # width is the full width at half maximum
+    sigma = width / (2 * np.sqrt(2 * np.log(2)))
+    return np.exp(-0.5 * (delta / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+
+
+def _lorentzian(delta, width):
+    gamma = width / 2
+    return gamma / (np.pi * (delta ** 2 + gamma ** 2))
+
+
+_shapes = {
+    GAUSSIAN: _gaussian,
+    LORENTZIAN: _lorentzian
+}
+
+
+def broaden(frequencies, intensities, line_shape=GAUSSIAN, width=10.0,
+            min_frequency=0.0, max_frequency=4000.0, points=1000):
+    """Broaden stick frequencies into a spectrum on a regular grid.
+
+    Each peak is replaced by a normalized line of the given full width at
+    half maximum, scaled by its intensity.
+
+    :returns: The grid frequencies and the spectrum intensities.
+    """
+    shape = _shapes[line_shape]
+    grid = np.linspace(min_frequency, max_frequency, points)
+    frequencies = np.asarray(frequencies, dtype=float)
+    intensities = np.asarray(intensities, dtype=float)
+
+    spectrum = np.zeros(points)
+    if frequencies.size == 0:
+        return grid, spectrum
+
+    for start in range(0, points, BLOCK_SIZE):
+        delta = grid[start:start + BLOCK_SIZE, None] - frequencies[None, :]
+        spectrum[start:start + BLOCK_SIZE] = shape(delta, width) @ intensities
+
+    return grid, spectrum
+
+
+def resample(grid, frequencies, intensities):
+    """Linearly interpolate a measured spectrum onto grid.
+
+    Points of the grid outside the measured range are zero.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    intensities = np.asarray(intensities, dtype=float)
+    if frequencies.size == 0:
+        return np.zeros(len(grid))
+
+    order = np.argsort(frequencies)
+
+    return np.interp(grid, frequencies[order], intensities[order],
+                     left=0.0, right=0.0)
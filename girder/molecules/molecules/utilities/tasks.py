@@ -0,0 +1,142 @@
+import os
+import socket
+import threading
+import traceback
+
+from girder.constants import TerminalColor
+from girder.models.user import User
+from girder.utility.model_importer import ModelImporter
+
+# The handlers of each type of task, see register()
+_handlers = {}
+
+
+def register(type, run, failed=None, done=None):
+    """
+    Register the handler of a type of task.
+
+    :param run: Called with the args of the task and the user that queued
+        it. An exception fails the attempt, the task is retried until it
+        runs out of attempts.
+    :param failed: Called with the args, the user and the error once the
+        task has run out of attempts, to clean up after it.
+    :param done: Called with the args and the user once the task has
+        completed and its key is free again, to queue it again if more work
+        came in while it was running.
+    """
+    _handlers[type] = (run, failed, done)
+
+
+class TaskRunner(object):
+    """
+    A bounded pool of threads running the queued tasks.
+
+    The workers are woken when a task is queued by this process, and
+    otherwise poll for tasks queued by other processes, retries that are due
+    and tasks whose lease has expired.
+    """
+
+    WORKERS = 4
+    POLL_INTERVAL = 5.0
+
+    def __init__(self, workers=WORKERS):
+        self._workers = workers
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._prefix = '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self._workers):
+                thread = threading.Thread(
+                    target=self._run, args=('%s:%d' % (self._prefix, i),),
+                    name='molecules-task-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _run(self, worker):
+        model = ModelImporter.model('task', 'molecules')
+        while True:
+            try:
+                # Tasks that keep killing their worker are not run again
+                task = model.expire()
+                if task is not None:
+                    self._failed(task, self._user(task), task['error'])
+                    continue
+
+                task = model.claim(worker)
+            except Exception as ex:
+                print(TerminalColor.error(
+                    'ERROR: Unable to claim a task: %s' % ex))
+                task = None
+
+            if task is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.POLL_INTERVAL)
+                continue
+
+            self.run_task(task)
+
+    def _user(self, task):
+        if task.get('userId') is None:
+            return None
+
+        return User().load(task['userId'], force=True)
+
+    def _failed(self, task, user, error):
+        print(TerminalColor.error(
+            'ERROR: Task %s (%s) failed: %s' % (task['_id'], task['type'],
+                                                error)))
+        _, failed, _ = _handlers.get(task['type'], (None, None, None))
+        if failed is not None:
+            failed(task['args'], user, error)
+
+    def run_task(self, task):
+        model = ModelImporter.model('task', 'molecules')
+        run, _, done = _handlers.get(task['type'], (None, None, None))
+        user = self._user(task)
+
+        try:
+            if run is None:
+                raise ValueError('Unknown task type: %s' % task['type'])
+            run(task['args'], user)
+        except Exception as ex:
+            error = '%s: %s' % (type(ex).__name__, ex)
+            if model.fail(task, error):
+                return
+
+            traceback.print_exc()
+            self._failed(task, user, error)
+            return
+
+        if model.complete(task) and done is not None:
+            try:
+                done(task['args'], user)
+            except Exception as ex:
+                print(TerminalColor.error(
+                    'ERROR: Task %s (%s) done handler failed: %s' % (
+                        task['_id'], task['type'], ex)))
+
+
+_runner = TaskRunner()
+
+
+def runner():
+    return _runner
+
+
+def enqueue(type, args, user=None, key=None):
+    """Queue a task and wake a worker, returns the task."""
+    task = ModelImporter.model('task', 'molecules').enqueue(
+        type, args, user=user, key=key)
+    _runner.start()
+    _runner.notify()
+
+    return task
@@ -354,3 +354,329 @@ def test_get_cube(server, molecule, calculation, user):
     calc_dims_prod = calc_dims[0] * calc_dims[1] * calc_dims[2]
     calc_scalars_len = len(cjson['cube']['scalars'])
     assert calc_dims_prod == calc_scalars_len
+
+@pytest.mark.plugin('molecules')
+def test_get_cubes(server, molecule, calculation, user):
+    molecule = molecule(user, 'water')
+    calculation_water = calculation(user, molecule, 'water')
+    calc_id = str(calculation_water['_id'])
+
+    params = {'mos': 'homo,lumo,homo'}
+    r = server.request('/calculations/%s/cubes' % calc_id, method='GET',
+                       params=params, user=user)
+    assertStatusOk(r)
+
+    cubes = r.json
+
+    # One cube per requested orbital, in the requested order
+    assert len(cubes) == 3
+    for cjson in cubes:
+        assert 'cube' in cjson
+        dims = cjson['cube']['dimensions']
+        assert dims[0] * dims[1] * dims[2] == len(cjson['cube']['scalars'])
+
+    assert cubes[0]['cube']['scalars'] == cubes[2]['cube']['scalars']
+    assert cubes[0]['cube']['scalars'] != cubes[1]['cube']['scalars']
+
+    # The homo should now be cached, the single cube endpoint computes its
+    # own with the Avogadro engine, which matches it
+    r = server.request('/calculations/%s/cube/homo' % calc_id, method='GET',
+                       user=user)
+    assertStatusOk(r)
+    scale = max(abs(x) for x in cubes[0]['cube']['scalars'])
+    assert r.json['cube']['scalars'] == pytest.approx(
+        cubes[0]['cube']['scalars'], abs=1e-4 * scale)
+
+@pytest.mark.plugin('molecules')
+def test_get_cube_quality(server, molecule, calculation, user):
+    molecule = molecule(user, 'water')
+    calculation_water = calculation(user, molecule, 'water')
+    calc_id = str(calculation_water['_id'])
+
+    sizes = {}
+    for quality in ['low', 'medium']:
+        params = {'quality': quality}
+        r = server.request('/calculations/%s/cube/homo' % calc_id,
+                           method='GET', params=params, user=user)
+        assertStatusOk(r)
+        sizes[quality] = len(r.json['cube']['scalars'])
+
+    # The coarse cube is cached separately and uses a coarser grid
+    assert sizes['low'] < sizes['medium']
+
+    params = {'quality': 'ultra'}
+    r = server.request('/calculations/%s/cube/homo' % calc_id, method='GET',
+                       params=params, user=user)
+    assertStatus(r, 400)
+
+
+@pytest.mark.plugin('molecules')
+def test_cube_engine(server, molecule, calculation, user):
+    from molecules.models.cubecache import Cubecache
+
+    molecule = molecule(user, 'water')
+    calculation_water = calculation(user, molecule, 'water')
+    calc_id = str(calculation_water['_id'])
+
+    # A cube cached before engines were recorded, by the Avogadro engine
+    legacy = Cubecache().create(calc_id, 0, {'cube': {'scalars': [1.0]}})
+    Cubecache().update({'_id': legacy['_id']}, {'$unset': {'engine': ''}})
+    assert Cubecache().find_mo(calc_id, 0, engine='avogadro') is not None
+
+    # The single and progressive paths serve Avogadro cubes, the batches
+    # take the cached cubes of either engine and compute the others with
+    # the numpy engine
+    for path, params in [('cube/0', {}), ('cubes', {'mos': '0,1'}),
+                         ('cube/2', {'progressive': True})]:
+        r = server.request('/calculations/%s/%s' % (calc_id, path),
+                           method='GET', params=params, user=user)
+        assertStatusOk(r)
+
+    for mo, quality, engine in [(0, 'medium', 'avogadro'),
+                                (1, 'medium', 'numpy'),
+                                (2, 'low', 'avogadro')]:
+        cached = Cubecache().find_mo(calc_id, mo, quality, engine=None)
+        assert cached.get('engine', 'avogadro') == engine
+
+    # The legacy cube is still served
+    r = server.request('/calculations/%s/cube/0' % calc_id, method='GET',
+                       user=user)
+    assertStatusOk(r)
+    assert r.json['cube']['scalars'] == [1.0]
+
+
+@pytest.mark.plugin('molecules')
+def test_cube_engines_agree(server):
+    import requests
+    from molecules import avogadro
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(dir_path, 'data', 'water.cjson')) as f:
+        cjson = json.load(f)
+
+    # The numpy engine reproduces the cubes of the Avogadro engine
+    for mo in [0, 4, 5]:
+        cubes = [avogadro.calculate_mo(cjson, mo, quality='low',
+                                       engine=engine)['cube']
+                 for engine in ['avogadro', 'numpy']]
+        assert cubes[0]['dimensions'] == cubes[1]['dimensions']
+        assert cubes[0]['origin'] == pytest.approx(cubes[1]['origin'])
+        assert cubes[0]['spacing'] == pytest.approx(cubes[1]['spacing'])
+
+        scale = max(abs(x) for x in cubes[0]['scalars'])
+        assert cubes[1]['scalars'] == pytest.approx(cubes[0]['scalars'],
+                                                    abs=1e-4 * scale)
+
+    # Orbitals out of range are rejected rather than wrapped around
+    for mo in [-1, 13]:
+        with pytest.raises(requests.HTTPError) as error:
+            avogadro.calculate_mo(cjson, mo, engine='numpy')
+        assert error.value.response.status_code == 400
+
+
+@pytest.mark.plugin('molecules')
+def test_get_density_and_esp(server, molecule, calculation, user):
+    from molecules.models.cubecache import Cubecache
+
+    molecule = molecule(user, 'water')
+    calculation_water = calculation(user, molecule, 'water')
+    calc_id = str(calculation_water['_id'])
+
+    for grid_type in ['density', 'esp']:
+        r = server.request('/calculations/%s/cube/%s' % (calc_id, grid_type),
+                           method='GET', user=user)
+        assertStatusOk(r)
+        cube = r.json['cube']
+        dims = cube['dimensions']
+        assert len(cube['scalars']) == dims[0] * dims[1] * dims[2]
+
+        cached = Cubecache().find_mo(calc_id, grid_type, engine='numpy')
+        assert cached is not None
+
+    r = server.request('/calculations/%s/cube/density' % calc_id,
+                       method='GET', params={'quality': 'ultra'}, user=user)
+    assertStatus(r, 400)
+
+
+@pytest.mark.plugin('molecules')
+def test_cube_access(server, molecule, calculation, user):
+    from girder.models.user import User
+
+    molecule = molecule(user, 'water')
+    calculation_water = calculation(user, molecule, 'water')
+    calc_id = str(calculation_water['_id'])
+    other = User().createUser('other', 'password', 'Other', 'User',
+                              'other@girder.test')
+
+    paths = [('cubes', {'mos': '0', 'quality': 'low'}),
+             ('cube/density', {'quality': 'low'}),
+             ('cube/esp', {'quality': 'low'}),
+             ('cube/0/isosurface', {'isovalue': 0.05, 'quality': 'low'})]
+    for path, params in paths:
+        r = server.request('/calculations/%s/%s' % (calc_id, path),
+                           method='GET', params=params, user=user)
+        assertStatusOk(r)
+
+    # The cubes of a private calculation, cached or not, are only served to
+    # the users who can read it
+    for path, params in paths + [('cubes', {'mos': '1', 'quality': 'low'})]:
+        r = server.request('/calculations/%s/%s' % (calc_id, path),
+                           method='GET', params=params, user=other)
+        assertStatus(r, 403)
+
+    User().remove(other)
+
+
+@pytest.mark.plugin('molecules')
+def test_get_isosurface(server, molecule, calculation, user):
+    import base64
+    import struct
+    from molecules.models.cubecache import Cubecache
+    from molecules.models.isosurfacecache import Isosurfacecache
+
+    molecule = molecule(user, 'water')
+    calculation_water = calculation(user, molecule, 'water')
+    calc_id = str(calculation_water['_id'])
+
+    params = {'isovalue': 0.05}
+    r = server.request('/calculations/%s/cube/homo/isosurface' % calc_id,
+                       method='GET', params=params, user=user)
+    assertStatusOk(r)
+
+    # The positive and negative lobes
+    surfaces = r.json['isosurfaces']
+    assert [s['isovalue'] for s in surfaces] == [0.05, -0.05]
+    for surface in surfaces:
+        vertices = base64.b64decode(surface['vertices'])
+        indices = base64.b64decode(surface['indices'])
+        assert len(vertices) == surface['vertexCount'] * 3 * 4
+        assert len(indices) == surface['triangleCount'] * 3 * 4
+        assert len(base64.b64decode(surface['normals'])) == len(vertices)
+        assert max(struct.unpack('<%dI' % (len(indices) // 4), indices),
+                   default=-1) < surface['vertexCount']
+
+    # The meshes are cached separately from the cube
+    cached = Cubecache().find_mo(calc_id, r.json['mo'])
+    assert 'isosurfaces' not in cached
+    assert Isosurfacecache().find_isosurfaces(cached['_id'], 0.05) == surfaces
+
+    # Requesting the same isovalue again doesn't add another mesh
+    r = server.request('/calculations/%s/cube/homo/isosurface' % calc_id,
+                       method='GET', params={'isovalue': 0.05}, user=user)
+    assertStatusOk(r)
+    assert r.json['isosurfaces'] == surfaces
+    assert Isosurfacecache().collection.count_documents(
+        {'cubeId': cached['_id']}) == 1
+
+    params = {'isovalue': 'abc'}
+    r = server.request('/calculations/%s/cube/homo/isosurface' % calc_id,
+                       method='GET', params=params, user=user)
+    assertStatus(r, 400)
+
+
+@pytest.mark.plugin('molecules')
+def test_get_vibrational_mode(server, molecule, user):
+    from molecules.models.calculation import Calculation
+    from molecules.models.vibrationalmode import VibrationalMode
+
+    molecule = molecule(user)
+    vibrations = {
+        'modes': [1, 2, 3],
+        'frequencies': [100.0, 200.0, 300.0],
+        'intensities': [1.0, 2.0, 3.0],
+        'eigenVectors': [[0.1] * 24, [0.2] * 24, [0.3] * 24]
+    }
+    calc = Calculation().create_cjson(user, {'vibrations': vibrations}, {},
+                                      molecule['_id'], public=False)
+    calc_id = str(calc['_id'])
+
+    r = server.request('/calculations/%s/vibrationalmodes/2' % calc_id,
+                       method='GET', user=user)
+    assertStatusOk(r)
+    assert r.json == {
+        'modes': [2],
+        'frequencies': [200.0],
+        'intensities': [2.0],
+        'eigenVectors': [[0.2] * 24]
+    }
+
+    # The listing never includes the eigenvectors
+    expected = {
+        'modes': [1, 2, 3],
+        'frequencies': [100.0, 200.0, 300.0],
+        'intensities': [1.0, 2.0, 3.0]
+    }
+    r = server.request('/calculations/%s/vibrationalmodes' % calc_id,
+                       method='GET', user=user)
+    assertStatusOk(r)
+    assert r.json == expected
+
+    # Modes are split out lazily for existing calculations
+    VibrationalMode().remove_modes(calc['_id'])
+    r = server.request('/calculations/%s/vibrationalmodes' % calc_id,
+                       method='GET', user=user)
+    assertStatusOk(r)
+    assert r.json == expected
+
+    VibrationalMode().remove_modes(calc['_id'])
+    r = server.request('/calculations/%s/vibrationalmodes/3' % calc_id,
+                       method='GET', user=user)
+    assertStatusOk(r)
+    assert r.json['frequencies'] == [300.0]
+
+    r = server.request('/calculations/%s/vibrationalmodes/7' % calc_id,
+                       method='GET', user=user)
+    assertStatus(r, 400)
+
+    Calculation().remove(calc)
+    assert not VibrationalMode().has_modes(calc['_id'])
+
+
+@pytest.mark.plugin('molecules')
+def test_get_spectrum(server, molecule, user):
+    from molecules.models.calculation import Calculation
+    from molecules.models.spectrumcache import Spectrumcache
+
+    molecule = molecule(user)
+    vibrations = {
+        'modes': [1, 2],
+        'frequencies': [1000.0, 3000.0],
+        'intensities': [1.0, 2.0],
+    }
+    calc = Calculation().create_cjson(user, {'vibrations': vibrations}, {},
+                                      molecule['_id'], public=False)
+    calc_id = str(calc['_id'])
+
+    params = {
+        'lineShape': 'lorentzian',
+        'width': 20,
+        'minFrequency': 0,
+        'maxFrequency': 4000,
+        'points': 401
+    }
+    r = server.request('/calculations/%s/spectrum' % calc_id, method='GET',
+                       params=params, user=user)
+    assertStatusOk(r)
+    assert len(r.json['frequencies']) == 401
+    assert len(r.json['intensities']) == 401
+
+    # The strongest peak is the most intense mode
+    intensities = r.json['intensities']
+    peak = intensities.index(max(intensities))
+    assert r.json['frequencies'][peak] == pytest.approx(3000.0)
+
+    assert Spectrumcache().findOne({'calculationId': calc['_id']}) is not None
+
+    # Raman intensities are not available
+    params['spectrumType'] = 'raman'
+    r = server.request('/calculations/%s/spectrum' % calc_id, method='GET',
+                       params=params, user=user)
+    assertStatus(r, 400)
+
+    params = {'width': -1}
+    r = server.request('/calculations/%s/spectrum' % calc_id, method='GET',
+                       params=params, user=user)
+    assertStatus(r, 400)
+
+    Calculation().remove(calc)
+    assert Spectrumcache().findOne({'calculationId': calc['_id']}) is None
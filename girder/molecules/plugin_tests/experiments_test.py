@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2018 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the 'License' );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an 'AS IS' BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import json
+import math
+import pytest
+
+from pytest_girder.assertions import assertStatusOk, assertStatus
+
+
+def _measured_spectrum(center):
+    frequencies = [float(x) for x in range(400, 4000, 10)]
+    intensities = [math.exp(-((x - center) / 30.0) ** 2) for x in frequencies]
+
+    return {
+        'frequencies': {
+            'units': 'cm-1',
+            'values': frequencies
+        },
+        'intensities': {
+            'units': 'arbitrary units',
+            'values': intensities
+        }
+    }
+
+
+@pytest.mark.plugin('molecules')
+def test_find_similar(server, user):
+    from molecules.models.experimental import Experimental
+
+    ids = {}
+    for center in [1000, 2000, 3000]:
+        experiment = Experimental().create(
+            'facility', 'Infrared', 'IRMPD', 'exp-%d' % center, 'C2H6',
+            _measured_spectrum(center))
+        ids[center] = str(experiment['_id'])
+
+    body = _measured_spectrum(2010)
+    body = {
+        'frequencies': body['frequencies']['values'],
+        'intensities': body['intensities']['values']
+    }
+
+    for metric in ['cosine', 'correlation']:
+        r = server.request('/experiments/similar', method='POST',
+                           params={'metric': metric, 'limit': 2},
+                           body=json.dumps(body), type='application/json',
+                           user=user)
+        assertStatusOk(r)
+        assert len(r.json) == 2
+        assert r.json[0]['_id'] == ids[2000]
+        assert r.json[0]['similarity'] > r.json[1]['similarity']
+        assert 'fingerprint' not in r.json[0]
+
+    # The best match can't be read, the next ones are returned instead
+    best = Experimental().load(ids[2000], force=True)
+    Experimental().setPublic(best, False, save=True)
+    r = server.request('/experiments/similar', method='POST',
+                       params={'limit': 2}, body=json.dumps(body),
+                       type='application/json', user=user)
+    assertStatusOk(r)
+    assert sorted(e['_id'] for e in r.json) == sorted([ids[1000],
+                                                       ids[3000]])
+
+    body['intensities'] = body['intensities'][1:]
+    r = server.request('/experiments/similar', method='POST',
+                       body=json.dumps(body), type='application/json',
+                       user=user)
+    assertStatus(r, 400)
+
+
+@pytest.mark.plugin('molecules')
+def test_index_refresh(server):
+    import datetime
+    from bson.objectid import ObjectId
+    from molecules.models.experimental import Experimental
+    from molecules.utilities import similarity
+
+    index = similarity.SpectrumIndex()
+    Experimental().create('facility', 'Infrared', 'IRMPD', 'exp-1000',
+                          'C2H6', _measured_spectrum(1000))
+    assert index.refresh(Experimental()) == 1
+    assert index.refresh(Experimental()) == 0
+
+    # An experiment inserted by another process, with an older _id
+    experiment = Experimental()._pack_experiment(Experimental()._experiment(
+        'facility', 'Infrared', 'IRMPD', 'exp-2000', 'C2H6',
+        _measured_spectrum(2000)))
+    experiment['_id'] = ObjectId.from_datetime(
+        datetime.datetime.utcnow() - datetime.timedelta(hours=1))
+    Experimental().collection.insert_one(experiment)
+    assert index.refresh(Experimental()) == 1
+
+    matches = index.search(similarity.fingerprint(
+        *Experimental().spectrum_values(experiment)), limit=1)
+    assert matches[0][0] == experiment['_id']
+
+
+@pytest.mark.plugin('molecules')
+def test_find_experiment(server, user):
+    from girder.models.model_base import ValidationException
+    from molecules.models.experimental import Experimental
+
+    experiments = []
+    for center in [1000, 2000]:
+        experiments.append({
+            'facility_used': 'facility',
+            'spectrum_type': 'Infrared',
+            'experimental_technique': 'IRMPD',
+            'id': 'exp-%d' % center,
+            'molecular_formula': 'C2H6',
+            'measured_spectrum': _measured_spectrum(center)
+        })
+    docs = Experimental().create_many(experiments)
+    assert len(docs) == 2
+
+    # The values are stored packed, with their summaries
+    doc = Experimental().findOne({'_id': docs[0]['_id']})
+    frequencies = doc['measuredSpectrum']['frequencies']
+    assert frequencies['count'] == 360
+    assert frequencies['min'] == 400.0
+    assert frequencies['max'] == 3990.0
+
+    r = server.request('/experiments', method='GET', user=user)
+    assertStatusOk(r)
+    assert len(r.json) == 2
+    expected = _measured_spectrum(1000)
+    spectrum = r.json[0]['measuredSpectrum']
+    assert spectrum['frequencies']['values'] == \
+        expected['frequencies']['values']
+    assert spectrum['intensities']['values'] == pytest.approx(
+        expected['intensities']['values'])
+
+    params = {'includeSpectrum': False, 'minFrequency': 500,
+              'maxFrequency': 600}
+    r = server.request('/experiments', method='GET', params=params, user=user)
+    assertStatusOk(r)
+    assert len(r.json) == 2
+    assert 'values' not in r.json[0]['measuredSpectrum']['frequencies']
+
+    params = {'minFrequency': 4500}
+    r = server.request('/experiments', method='GET', params=params, user=user)
+    assertStatusOk(r)
+    assert len(r.json) == 0
+
+    # Mismatched arrays are rejected before anything is inserted
+    experiments[0]['measured_spectrum']['intensities']['values'].pop()
+    with pytest.raises(ValidationException):
+        Experimental().create_many(experiments)
+
+
+@pytest.mark.plugin('molecules')
+def test_migrate_unpacked(server, user):
+    from molecules.models.experimental import Experimental
+
+    # An experiment stored before the spectra were packed
+    experiment = {
+        'facilityUsed': 'facility',
+        'spectrumType': 'Infrared',
+        'experimentalTechnique': 'IRMPD',
+        'id': 'exp-legacy',
+        'molecularFormula': 'C2H6',
+        'measuredSpectrum': _measured_spectrum(1000),
+        'name': 'IRMPD (Infrared)'
+    }
+    Experimental().setPublic(experiment, True)
+    id = Experimental().collection.insert_one(experiment).inserted_id
+
+    assert Experimental().migrate_unpacked() == 1
+    assert Experimental().migrate_unpacked() == 0
+
+    frequencies = Experimental().findOne(
+        {'_id': id})['measuredSpectrum']['frequencies']
+    assert frequencies['count'] == 360
+    assert frequencies['min'] == 400.0
+    assert frequencies['max'] == 3990.0
+
+    # It is selected by range like the packed experiments
+    params = {'includeSpectrum': False, 'minFrequency': 500,
+              'maxFrequency': 600}
+    r = server.request('/experiments', method='GET', params=params, user=user)
+    assertStatusOk(r)
+    assert [e['id'] for e in r.json] == ['exp-legacy']
+
+    Experimental().remove({'_id': id})
+
+
+JDX = '''##TITLE=test
+##JCAMP-DX=4.24
+##DATA TYPE=INFRARED SPECTRUM
+##XUNITS=1/CM
+##YUNITS=TRANSMITTANCE
+##XFACTOR=1
+##YFACTOR=1
+##$NIST SOURCE=MSDC
+##$NIST IMAGE=cgi/cbook.cgi?ID=C7732185
+##FIRSTX=400
+##LASTX=430
+##NPOINTS=4
+##XYDATA=(X++(Y..Y))
+400 1 2 3 4
+##END=
+'''
+
+
+@pytest.mark.plugin('molecules')
+def test_find_nist_spectrum(server, user, tmpdir):
+    from molecules import nist
+    from molecules.models.nistcache import Nistcache
+
+    inchi = 'InChI=1S/H2O/h1H2'
+    tmpdir.join('index.json').write(json.dumps({inchi: 'C7732185'}))
+    tmpdir.join('C7732185_IR.jdx').write(JDX)
+
+    class CountingFetcher(nist.LocalFetcher):
+        calls = 0
+
+        def search_inchi(self, inchi, stype='IR'):
+            CountingFetcher.calls += 1
+            return super(CountingFetcher, self).search_inchi(inchi, stype)
+
+    previous = nist.set_fetcher(CountingFetcher(str(tmpdir)))
+    try:
+        params = {'source': 'nist', 'inchi': inchi}
+        for _ in range(2):
+            r = server.request('/experiments', method='GET', params=params,
+                               user=user)
+            assertStatusOk(r)
+            assert r.json['x'] == [400.0, 410.0, 420.0, 430.0]
+            # Headers starting with $ survive the cache
+            assert r.json['$nist source'] == 'MSDC'
+            assert r.json['$nist image'] == 'cgi/cbook.cgi?ID=C7732185'
+
+        # The second lookup is served from the cache
+        assert CountingFetcher.calls == 1
+        cached = Nistcache().lookup(Nistcache.SPECTRUM, 'C7732185_IR')
+        assert not any(key.startswith('$') or '.' in key
+                       for key in cached['value'])
+
+        # Misses are cached too
+        params['inchi'] = 'InChI=1S/unknown'
+        for _ in range(2):
+            r = server.request('/experiments', method='GET', params=params,
+                               user=user)
+            assertStatus(r, 404)
+        assert CountingFetcher.calls == 2
+        cached = Nistcache().lookup(Nistcache.ID, params['inchi'])
+        assert not cached['found']
+    finally:
+        nist.set_fetcher(previous)
@@ -438,3 +438,117 @@ def test_search_molecule_formula(server, molecule, user):
     assert mol.get('smiles') == smiles
     assert mol.get('name') == name
     assert mol.get('properties').get('formula') == ethane_formula
+
+
+class _FailingProvider(object):
+    def find_names(self, inchikeys):
+        raise IOError('ChemSpider is down')
+
+
+@pytest.mark.plugin('molecules')
+def test_resolve_common_names(server, user, tmpdir):
+    from molecules import chemspider
+    from molecules.models.molecule import Molecule
+    from molecules.models.namecache import Namecache
+
+    inchikey = 'XLYOFNOQVPJJNP-UHFFFAOYSA-N'
+    names = tmpdir.join('names.json')
+    names.write(json.dumps({inchikey: 'water'}))
+
+    previous = chemspider.set_provider(chemspider.LocalFileProvider(str(names)))
+    try:
+        assert chemspider.cached_common_name(inchikey) == (False, None)
+
+        mol = Molecule().create(user, {
+            'inchikey': inchikey,
+            'properties': {}
+        }, public=False)
+
+        # A failed batch leaves the molecule flagged for the retry
+        chemspider.set_provider(_FailingProvider())
+        super(Molecule, Molecule()).update({'_id': mol['_id']}, {
+            '$set': {
+                'resolving_name': True
+            }
+        })
+        with pytest.raises(IOError):
+            chemspider.resolve_pending_names()
+        mol = Molecule().load(mol['_id'], force=True)
+        assert mol['resolving_name']
+        assert 'name' not in mol
+
+        # Resolve the pending names as the background task would
+        chemspider.set_provider(chemspider.LocalFileProvider(str(names)))
+        chemspider.resolve_pending_names()
+
+        mol = Molecule().load(mol['_id'], force=True)
+        assert mol['name'] == 'water'
+        assert 'resolving_name' not in mol
+        assert chemspider.cached_common_name(inchikey) == (True, 'water')
+
+        # Unknown compounds are cached as misses
+        missing = 'AAAAAAAAAAAAAA-UHFFFAOYSA-N'
+        assert chemspider.find_common_name(missing) is None
+        assert not Namecache().lookup([missing])[missing]['found']
+
+        Molecule().remove(mol)
+    finally:
+        chemspider.set_provider(previous)
+
+
+@pytest.mark.plugin('molecules')
+def test_semantic_publisher(server, user):
+    from molecules.models.molecule import Molecule
+    from molecules.semantic import publisher
+
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(dir_path, 'data', 'ethane.cjson')) as f:
+        cjson = json.load(f)
+
+    mols = [Molecule().create(user, {
+        'inchi': cjson['inchi'],
+        'inchikey': 'OTMSDBZUPAUEDD-UHFFFAOYSA-N',
+        'properties': {},
+        'cjson': cjson
+    }, public=False) for _ in range(2)]
+    ids = [mol['_id'] for mol in mols]
+
+    uploads = []
+
+    def _upload(_, rdf, content_type):
+        uploads.append((rdf, content_type))
+
+    class Publisher(publisher.Publisher):
+        INITIAL_BACKOFF = 0
+
+    # Both molecules are published with a single upload
+    Publisher(upload=_upload).publish_batch(ids)
+    assert len(uploads) == 1
+    rdf, content_type = uploads[0]
+    assert content_type == publisher.NTRIPLES
+    for id in ids:
+        assert ('/molecules/%s>' % id).encode() in rdf
+    for id in ids:
+        mol = Molecule().load(id, force=True)
+        assert mol['semantic']['status'] == publisher.PUBLISHED
+
+    def _fail(_, rdf, content_type):
+        uploads.append((rdf, content_type))
+        raise IOError('Jena is down')
+
+    uploads = []
+    Publisher(upload=_fail).publish_batch(ids[:1])
+    assert len(uploads) == Publisher.MAX_ATTEMPTS
+    mol = Molecule().load(ids[0], force=True)
+    assert mol['semantic']['status'] == publisher.FAILED
+
+    # The failed molecule is picked up by the backfill
+    assert Publisher(upload=_upload).backfill() == 1
+
+    # Only the molecules left pending are queued again when the server
+    # starts
+    Publisher(upload=_upload)._set_state(ids[1:], publisher.PENDING)
+    assert Publisher(upload=_upload).backfill(pending=True) == 1
+
+    for mol in mols:
+        Molecule().remove(mol)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2018 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the 'License' );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an 'AS IS' BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import gzip
+import json
+import os
+
+import pytest
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+
+def _ethane():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(dir_path, 'data', 'ethane.cjson')) as f:
+        cjson = json.load(f)
+
+    return {
+        '_id': '5c3f6e2b4b5e0a0001a2b3c4',
+        'inchikey': 'OTMSDBZUPAUEDD-UHFFFAOYSA-N',
+        'inchi': cjson['inchi'],
+        'cjson': cjson
+    }
+
+
+def test_gainesville_ntriples_isomorphic():
+    from molecules.semantic import gainesville
+
+    mol = _ethane()
+    uri_base = 'http://localhost:8888'
+
+    rdf_xml = gainesville.create_molecule_graph(uri_base, mol)
+    ntriples = gainesville.create_molecule_graph(uri_base, mol, format='nt')
+
+    expected = Graph().parse(data=rdf_xml, format='xml')
+    graph = Graph().parse(data=ntriples.decode('utf-8'), format='nt')
+
+    assert len(graph) == len(expected)
+    assert isomorphic(graph, expected)
+
+
+def test_gainesville_ntriples_concatenate():
+    from molecules.semantic import gainesville
+
+    first = _ethane()
+    second = dict(first, _id='5c3f6e2b4b5e0a0001a2b3c5')
+    uri_base = 'http://localhost:8888'
+
+    # The blank nodes of different molecules must not be merged
+    single = Graph().parse(data=gainesville.create_molecule_ntriples(
+        uri_base, first).decode('utf-8'), format='nt')
+    both = Graph().parse(data=b''.join(
+        gainesville.create_molecule_ntriples(uri_base, mol)
+        for mol in [first, second]).decode('utf-8'), format='nt')
+
+    assert len(both) == 2 * len(single)
+
+
+@pytest.mark.plugin('molecules')
+def test_export_file(server, molecule, user, tmpdir):
+    from molecules.models.molecule import Molecule
+    from molecules.semantic import export
+
+    from bson.objectid import ObjectId
+
+    # The fixture molecule has no 3D structure
+    mol = molecule(user)
+    super(Molecule, Molecule()).update({'_id': ObjectId(mol['_id'])}, {
+        '$set': {
+            'cjson': _ethane()['cjson']
+        }
+    })
+    uri_base = 'http://localhost:8888'
+    path = str(tmpdir.join('export.nt.gz'))
+
+    checkpoints = []
+    exported, skipped = export.export_molecules(
+        Molecule(), uri_base, export.FileSink(path), processes=1,
+        progress=lambda count, last_id: checkpoints.append(str(last_id)))
+    assert exported == 1
+    assert skipped == 0
+    assert checkpoints == [mol['_id']]
+
+    with gzip.open(path) as f:
+        graph = Graph().parse(data=f.read().decode('utf-8'), format='nt')
+    assert len(graph) > 0
+
+    # Nothing is left to export after the checkpoint
+    exported, skipped = export.export_molecules(
+        Molecule(), uri_base, export.FileSink(path, append=True),
+        after_id=checkpoints[-1], processes=1)
+    assert exported == 0
+
+    with gzip.open(path) as f:
+        resumed = Graph().parse(data=f.read().decode('utf-8'), format='nt')
+    assert len(resumed) == len(graph)
+
+
+@pytest.mark.plugin('molecules')
+def test_settings_snapshot(server):
+    from girder.models.setting import Setting
+    from molecules.constants import PluginSettings
+    from molecules.settings import settings_snapshot
+
+    assert settings_snapshot().semantic_uri_base == 'http://localhost:8888'
+
+    # The snapshot follows the changes to the settings
+    Setting().set(PluginSettings.SEMANTIC_URI_BASE, 'http://example.com/')
+    assert settings_snapshot().semantic_uri_base == 'http://example.com'
+
+    Setting().unset(PluginSettings.SEMANTIC_URI_BASE)
+    assert settings_snapshot().semantic_uri_base == 'http://localhost:8888'
+
+
+@pytest.mark.plugin('molecules')
+def test_export_virtuoso_names(server, monkeypatch):
+    from molecules.semantic import export
+
+    uploads = []
+    monkeypatch.setattr(export.virtuoso, 'upload_rdf',
+                        lambda id, rdf, **kwargs: uploads.append(id))
+
+    # A resumed export names its batches after their own checkpoints
+    for last_id in ['5c3f6e2b4b5e0a0001a2b3c4', '5c3f6e2b4b5e0a0001a2b3c5']:
+        export.VirtuosoSink().write(b'', last_id)
+
+    assert uploads == ['export_5c3f6e2b4b5e0a0001a2b3c4',
+                       'export_5c3f6e2b4b5e0a0001a2b3c5']
+
+
+@pytest.mark.plugin('molecules')
+def test_export_resume_after(server):
+    from molecules.semantic import export
+
+    started = '5c3f6e2b4b5e0a0001a2b3c4'
+    checkpoint = '5c3f6e2b4b5e0a0001a2b3c5'
+    assert export.resume_after({
+        'kwargs': {'afterId': started},
+        'checkpoint': checkpoint
+    }) == checkpoint
+
+    # A job that failed before its first checkpoint starts where it did
+    assert export.resume_after({'kwargs': {'afterId': started}}) == started
+    assert export.resume_after({'kwargs': {'afterId': None}}) is None
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2018 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the 'License' );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an 'AS IS' BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import datetime
+import pytest
+
+from pytest_girder.assertions import assertStatusOk, assertStatus
+
+
+def _running_task(user, attempts=1):
+    from molecules.constants import TaskStatus
+    from molecules.models.task import Task
+
+    task = Task().enqueue('test', {'value': 1}, user=user,
+                          key='test:%s' % datetime.datetime.utcnow())
+
+    # Take the lease directly, so the workers of the server can't claim it
+    task.update({
+        'status': TaskStatus.RUNNING,
+        'worker': 'test',
+        'attempts': attempts,
+        'leaseExpires': datetime.datetime.utcnow() +
+        datetime.timedelta(seconds=Task.VISIBILITY_TIMEOUT)
+    })
+
+    return Task().save(task)
+
+
+@pytest.mark.plugin('molecules')
+def test_enqueue_once(server, user):
+    from molecules.models.task import Task
+
+    task = Task().enqueue('test', {'value': 1}, user=user, key='test:once')
+    duplicate = Task().enqueue('test', {'value': 2}, user=user,
+                               key='test:once')
+    assert duplicate['_id'] == task['_id']
+    assert Task().is_active('test:once')
+
+    Task().remove(task)
+
+
+@pytest.mark.plugin('molecules')
+def test_retry_and_fail(server, user):
+    from molecules.constants import TaskStatus
+    from molecules.models.task import Task
+
+    # The failed attempt is retried after a backoff
+    task = _running_task(user)
+    assert Task().fail(task, 'error')
+    retried = Task().load(task['_id'], force=True)
+    assert retried['status'] == TaskStatus.QUEUED
+    assert retried['runAfter'] > datetime.datetime.utcnow()
+    assert retried['error'] == 'error'
+    assert Task().is_active(task['key'])
+    Task().remove(task)
+
+    # Until the task runs out of attempts
+    task = _running_task(user, attempts=Task.MAX_ATTEMPTS)
+    assert not Task().fail(task, 'error')
+    failed = Task().load(task['_id'], force=True)
+    assert failed['status'] == TaskStatus.ERROR
+    assert not Task().is_active(task['key'])
+    Task().remove(task)
+
+
+@pytest.mark.plugin('molecules')
+def test_expired_last_attempt(server, user):
+    from molecules.constants import TaskStatus
+    from molecules.models.task import Task
+
+    task = _running_task(user, attempts=Task.MAX_ATTEMPTS)
+    Task().update({'_id': task['_id']}, {
+        '$set': {
+            'leaseExpires': datetime.datetime.utcnow() -
+            datetime.timedelta(seconds=1)
+        }
+    })
+
+    # The task is failed rather than claimed again, here or by a worker
+    Task().expire()
+    failed = Task().load(task['_id'], force=True)
+    assert failed['status'] == TaskStatus.ERROR
+    assert failed['attempts'] == Task.MAX_ATTEMPTS
+    assert not Task().is_active(task['key'])
+    Task().remove(task)
+
+
+@pytest.mark.plugin('molecules')
+def test_run_task(server, user, admin):
+    from molecules.constants import TaskStatus
+    from molecules.models.task import Task
+    from molecules.utilities import tasks
+
+    calls = []
+    tasks.register('test',
+                   lambda args, user: calls.append((args, user['_id'])))
+
+    task = _running_task(user)
+    tasks.runner().run_task(task)
+    assert calls == [({'value': 1}, user['_id'])]
+
+    done = Task().load(task['_id'], force=True)
+    assert done['status'] == TaskStatus.SUCCESS
+    assert not Task().is_active(task['key'])
+
+    # Only the owner and administrators can get the task
+    r = server.request('/molecules/tasks/%s' % task['_id'], user=user)
+    assertStatusOk(r)
+    assert r.json['status'] == TaskStatus.SUCCESS
+
+    r = server.request('/molecules/tasks', user=admin,
+                       params={'status': TaskStatus.SUCCESS})
+    assertStatusOk(r)
+    assert str(task['_id']) in [t['_id'] for t in r.json['results']]
+
+    r = server.request('/molecules/tasks', user=user)
+    assertStatus(r, 403)
+
+    Task().remove(task)
+
+
+@pytest.mark.plugin('molecules')
+def test_run_task_done(server, user):
+    from molecules.models.task import Task
+    from molecules.utilities import tasks
+
+    task = _running_task(user)
+    calls = []
+
+    def _run(args, user):
+        # Work queued while the task runs finds it still active
+        duplicate = Task().enqueue('test', {'value': 2}, user=user,
+                                   key=task['key'])
+        calls.append(duplicate['_id'])
+
+    # The done handler runs once the key is free, so it can queue the task
+    # again
+    tasks.register('test', _run,
+                   done=lambda args, user: calls.append(
+                       Task().is_active(task['key'])))
+    tasks.runner().run_task(task)
+    assert calls == [task['_id'], False]
+
+    Task().remove(task)
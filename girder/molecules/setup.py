@@ -16,8 +16,8 @@ setup(
       'openchemistry',
       'beautifulsoup4',
       'jcamp',
-      'requests',
-      'requests-futures'
+      'numpy',
+      'requests'
     ],
     entry_points={
       'girder.plugin': [
@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import nbformat
+from nbconvert import HTMLExporter
+
+from girder.models.file import File
+
+TEMPLATES = ['full', 'basic']
+
+# The most rendered HTML kept in memory, in bytes
+MAX_SIZE = 64 * 1024 * 1024
+
+
+class HtmlCache(object):
+    """
+    A least recently used cache of the HTML rendering of notebooks, keyed by
+    the file, the version of its content and the exporter template. The
+    exporters are created once for each thread and template.
+    """
+
+    def __init__(self, max_size=MAX_SIZE):
+        self._max_size = max_size
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Only one thread renders a given key at a time
+        self._rendering = {}
+        self._local = threading.local()
+
+    def _exporter(self, template):
+        exporters = getattr(self._local, 'exporters', None)
+        if exporters is None:
+            exporters = self._local.exporters = {}
+
+        if template not in exporters:
+            exporters[template] = HTMLExporter(template_file=template)
+
+        return exporters[template]
+
+    @staticmethod
+    def key(file, template):
+        # Files are normally hashed on upload, otherwise their content is
+        # identified by its size and its creation or update time
+        version = file.get('sha512')
+        if version is None:
+            version = '%s:%s' % (file.get('updated', file.get('created')),
+                                 file.get('size'))
+
+        return (str(file['_id']), version, template)
+
+    @staticmethod
+    def etag(key):
+        return '"%s"' % hashlib.sha1(':'.join(key).encode()).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+
+            return body
+
+    def _put(self, key, body):
+        size = len(body)
+        if size > self._max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+
+            self._entries[key] = body
+            self._size += size
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _render(self, file, template):
+        with File().open(file) as fp:
+            notebook = nbformat.reads(fp.read().decode(), as_version=4)
+
+        (body, resources) = self._exporter(template).from_notebook_node(
+            notebook)
+
+        return body.encode('utf-8')
+
+    def html(self, file, template='full'):
+        """:returns: The rendered HTML, as bytes."""
+        key = self.key(file, template)
+        body = self._get(key)
+        if body is not None:
+            return body
+
+        with self._lock:
+            lock = self._rendering.setdefault(key, threading.Lock())
+
+        with lock:
+            try:
+                body = self._get(key)
+                if body is None:
+                    body = self._render(file, template)
+                    self._put(key, body)
+            finally:
+                with self._lock:
+                    self._rendering.pop(key, None)
+
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_cache = HtmlCache()
+
+
+def html_cache():
+    return _cache
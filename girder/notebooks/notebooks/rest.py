@@ -1,12 +1,14 @@
-import nbformat
-from nbconvert import HTMLExporter
 import cherrypy
 
 from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
-from girder.api.rest import Resource, RestException
+from girder.api.rest import Resource, RestException, setResponseHeader
 from girder.constants import AccessType, TokenScope
 from girder.models.file import File
+from girder.models.folder import Folder
+
+from .html_cache import html_cache, HtmlCache, TEMPLATES
+from .samples import provision
 
 class Notebook(Resource):
 
@@ -14,25 +16,51 @@ class Notebook(Resource):
         self.resourceName = 'notebooks'
         super(Notebook, self).__init__()
         self.route('GET', (':fileId','html'), self.as_html)
+        self.route('PUT', ('samples',), self.provision_samples)
 
     @access.public(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
         Description('Get a notebook as HTML ( uses nbconvert to perform the convertion ).')
+        .notes('The rendered HTML is cached, a request with the ETag of the current '
+               'rendering in If-None-Match gets a 304 response.')
         .modelParam('fileId', 'The file id for the notebook', model=File,
                paramType='path',  force=True)
+        .param('template', 'The nbconvert template', required=False,
+               enum=TEMPLATES, default='full')
         .errorResponse('ID was invalid.')
     )
-    def as_html(self, file):
-        with File().open(file) as fp:
-            notebook = nbformat.reads(fp.read().decode(), as_version=4)
-
-        exporter = HTMLExporter()
-        #exporter.template_file = 'basic'
+    def as_html(self, file, template):
+        etag = HtmlCache.etag(HtmlCache.key(file, template))
+        not_modified = etag in [
+            tag.strip() for tag in
+            cherrypy.request.headers.get('If-None-Match', '').split(',')
+        ]
 
-        (body, resources) = exporter.from_notebook_node(notebook)
+        setResponseHeader('ETag', etag)
+        setResponseHeader('Cache-Control', 'no-cache')
+        if not_modified:
+            cherrypy.response.status = 304
+            body = b''
+        else:
+            body = html_cache().html(file, template)
+            setResponseHeader('Content-Type', 'text/html')
 
         def stream():
-            cherrypy.response.headers['Content-Type'] = 'text/html'
             yield body
 
         return stream
+
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Copy the sample notebooks the current user is missing to their '
+                    'oc/notebooks folder.')
+        .notes('New users get the samples in the background, this provisions them '
+               'straight away.')
+    )
+    def provision_samples(self):
+        user = self.getCurrentUser()
+        folder = provision(user)
+        if folder is None:
+            raise RestException('No current asset store.')
+
+        return Folder().filter(folder, user)
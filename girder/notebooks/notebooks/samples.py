@@ -0,0 +1,135 @@
+import glob
+import hashlib
+import os
+import threading
+
+from girder import events
+from girder.constants import TerminalColor
+from girder.exceptions import GirderException
+from girder.models.assetstore import Assetstore
+from girder.models.collection import Collection
+from girder.models.file import File
+from girder.models.folder import Folder
+from girder.models.item import Item
+from girder.models.upload import Upload
+from girder.models.user import User
+from girder.utility.path import lookUpPath
+
+# The event handled in the background to give a new user the samples
+PROVISION_EVENT = 'notebooks.provision'
+
+SAMPLES_COLLECTION = 'Open Chemistry Samples'
+
+NOTEBOOKS_DIR = os.path.join(os.path.dirname(__file__), 'notebooks')
+
+_samples_folder = None
+_samples_lock = threading.Lock()
+
+
+def _sha512(path):
+    sha = hashlib.sha512()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def _sync_samples(user):
+    # Upload the bundled notebooks that are missing or have changed to the
+    # shared samples folder
+    collection = Collection().createCollection(
+        SAMPLES_COLLECTION, creator=user, public=True, reuseExisting=True)
+    folder = Folder().createFolder(collection, 'notebooks',
+                                   parentType='collection', creator=user,
+                                   public=True, reuseExisting=True)
+
+    items = {item['name']: item for item in Folder().childItems(folder)}
+    for path in glob.glob('%s/*.ipynb' % NOTEBOOKS_DIR):
+        name = os.path.basename(path)
+        item = items.get(name)
+        if item is not None:
+            files = list(Item().childFiles(item, limit=1))
+            if files and files[0].get('sha512') == _sha512(path):
+                continue
+            Item().remove(item)
+
+        with open(path, 'rb') as fp:
+            Upload().uploadFromFile(
+                fp, size=os.path.getsize(path), name=name,
+                parentType='folder', parent=folder, user=user,
+                mimeType='application/x-ipynb+json')
+
+    return folder
+
+
+def samples_folder(user):
+    """
+    The folder holding the single stored copy of the sample notebooks, it is
+    brought up to date with the bundled notebooks once per process.
+    """
+    global _samples_folder
+    with _samples_lock:
+        if _samples_folder is None:
+            # The samples belong to an administrator if there is one
+            owner = User().findOne({'admin': True}) or user
+            _samples_folder = _sync_samples(owner)
+
+        return _samples_folder
+
+
+def provision(user):
+    """
+    Give the user a copy of each sample notebook they don't have. The copies
+    reference the stored data of the samples rather than duplicating it.
+    """
+    # If there is no current asset store, just return
+    try:
+        Assetstore().getCurrent()
+    except GirderException:
+        print(TerminalColor.warning('WARNING: no current asset store. '
+                                    'Notebook will not be created.'))
+        return
+
+    folder_model = Folder()
+
+    result = lookUpPath('user/%s/Private' % user['login'], force=True)
+    private_folder = result['document']
+
+    oc_folder = folder_model.createFolder(private_folder, 'oc',
+                                          parentType='folder',
+                                          creator=user,
+                                          public=True,
+                                          reuseExisting=True)
+
+    notebook_folder = folder_model.createFolder(oc_folder, 'notebooks',
+                                                parentType='folder',
+                                                creator=user,
+                                                public=True,
+                                                reuseExisting=True)
+
+    existing = set(item['name']
+                   for item in folder_model.childItems(notebook_folder))
+    for sample in folder_model.childItems(samples_folder(user)):
+        if sample['name'] not in existing:
+            Item().copyItem(sample, creator=user, folder=notebook_folder)
+
+    return notebook_folder
+
+
+def schedule_provision(event):
+    """Provision a new user in the background, so registration doesn't wait."""
+    events.daemon.trigger(PROVISION_EVENT, info=event.info)
+
+
+def provision_user(event):
+    user = User().load(event.info['_id'], force=True)
+    if user is None:
+        return
+
+    try:
+        provision(user)
+    except Exception as ex:
+        print(TerminalColor.error(
+            'ERROR: Unable to create the notebooks of %s: %s' %
+            (user['login'], ex)))
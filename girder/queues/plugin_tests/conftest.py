@@ -0,0 +1,41 @@
+import pytest
+
+
+@pytest.fixture
+def queue():
+    """Our method for creating a queue within girder."""
+    from queues.models.queue import Queue
+    from queues.models.queuetask import QueueType
+    from queues.models.policy import PolicyType
+
+    queues = []
+    def _queue(user, name='test', type_=QueueType.FIFO, max_running=0,
+               policy=PolicyType.PRIORITY, max_running_per_user=0):
+        queue = Queue().create(name, type_, max_running, user=user,
+                               policy=policy,
+                               max_running_per_user=max_running_per_user)
+        queues.append(queue)
+
+        return queue
+
+    yield _queue
+
+    # Delete the queues, along with their tasks and history
+    for queue in queues:
+        Queue().remove(queue)
+
+@pytest.fixture
+def started(monkeypatch):
+    """
+    The ids of the taskflows started by the pops, the taskflows are not
+    actually started.
+    """
+    from queues.models.queue import Queue
+
+    taskflow_ids = []
+    def _start_taskflow(self, queue_id, taskflow_id, params, user):
+        taskflow_ids.append(taskflow_id)
+
+    monkeypatch.setattr(Queue, '_start_taskflow', _start_taskflow)
+
+    yield taskflow_ids
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2018 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the 'License' );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an 'AS IS' BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import sys
+import pytest
+
+from bson.objectid import ObjectId
+
+from pytest_girder.assertions import assertStatusOk
+from pytest_girder.utils import getResponseBody
+
+
+def _add(queue, user, count=1, priority=0):
+    from queues.models.queue import Queue
+
+    taskflow_ids = [ObjectId() for _ in range(count)]
+    for taskflow_id in taskflow_ids:
+        Queue().add(queue, {'_id': taskflow_id}, None, user,
+                    priority=priority)
+
+    return taskflow_ids
+
+
+def _pop_each(queue, user):
+    from queues.models.queue import Queue
+
+    # One task at a time, so the taskflows are started in order
+    while Queue().pop(queue, 1, user)['nPending'] > 0:
+        pass
+
+
+def _assert_counters(queue, pending, running):
+    from queues.models.queue import Queue
+    from queues.models.queuetask import QueueTask, TaskStatus
+
+    current = Queue().load(queue['_id'], force=True)
+    assert current['nPending'] == pending
+    assert current['nRunning'] == running
+
+    # The counters match the tasks of the queue
+    for state, count in [(TaskStatus.PENDING, pending),
+                         (TaskStatus.RUNNING, running)]:
+        assert QueueTask().collection.count_documents({
+            'queueId': queue['_id'],
+            'state': state
+        }) == count
+
+
+@pytest.mark.plugin('queues')
+def test_counters(server, user, queue, started):
+    from cumulus.taskflow import TaskFlowState
+    from queues.models.queue import Queue, cleanup_failed_taskflows
+    from queues.models.queuehistory import QueueTaskHistory
+
+    q = queue(user, max_running=2)
+    taskflow_ids = _add(q, user, 4)
+    _assert_counters(q, pending=4, running=0)
+
+    # A taskflow is only queued once
+    Queue().add(q, {'_id': taskflow_ids[0]}, None, user)
+    _assert_counters(q, pending=4, running=0)
+
+    # The pop is limited by the run slots
+    Queue().pop(q, sys.maxsize, user)
+    assert sorted(started) == sorted(taskflow_ids[:2])
+    _assert_counters(q, pending=2, running=2)
+
+    Queue().finish(q, {
+        '_id': taskflow_ids[0],
+        'status': TaskFlowState.COMPLETE
+    }, user)
+    _assert_counters(q, pending=2, running=1)
+
+    # A pending taskflow that has just been created stays in the queue, one
+    # that ended before it was started is removed
+    Queue().finish(q, {
+        '_id': taskflow_ids[2],
+        'status': TaskFlowState.CREATED
+    }, user)
+    _assert_counters(q, pending=2, running=1)
+
+    Queue().finish(q, {
+        '_id': taskflow_ids[3],
+        'status': TaskFlowState.TERMINATED
+    }, user)
+    _assert_counters(q, pending=1, running=1)
+
+    # The running taskflow doesn't exist, the cleanup removes it and fills
+    # its slot
+    cleanup_failed_taskflows(heartbeat=None)
+    assert started[2:] == [taskflow_ids[2]]
+    _assert_counters(q, pending=0, running=1)
+
+    assert QueueTaskHistory().collection.count_documents({
+        'queueId': q['_id']
+    }) == 2
+
+
+@pytest.mark.plugin('queues')
+def test_fifo_lifo(server, user, queue, started):
+    from queues.models.queuetask import QueueType
+
+    fifo = queue(user, name='fifo')
+    taskflow_ids = _add(fifo, user, 3)
+    _pop_each(fifo, user)
+    assert started == taskflow_ids
+    _assert_counters(fifo, pending=0, running=3)
+
+    del started[:]
+    lifo = queue(user, name='lifo', type_=QueueType.LIFO)
+    taskflow_ids = _add(lifo, user, 3)
+    _pop_each(lifo, user)
+    assert started == taskflow_ids[::-1]
+
+
+@pytest.mark.plugin('queues')
+def test_priority(server, user, queue, started):
+    from queues.models.queuetask import QueueType
+
+    fifo = queue(user, name='fifo')
+    low = _add(fifo, user, 2)
+    high = _add(fifo, user, 2, priority=5)
+    _pop_each(fifo, user)
+    assert started == high + low
+
+    del started[:]
+    lifo = queue(user, name='lifo', type_=QueueType.LIFO)
+    low = _add(lifo, user, 2)
+    high = _add(lifo, user, 2, priority=5)
+    _pop_each(lifo, user)
+    assert started == high[::-1] + low[::-1]
+
+
+@pytest.mark.plugin('queues')
+def test_fairshare(server, user, admin, queue, started):
+    from queues.models.queue import Queue
+    from queues.models.policy import PolicyType
+
+    # The user with the fewest running tasks goes first
+    q = queue(user, policy=PolicyType.FAIR_SHARE)
+    user_ids = _add(q, user, 3)
+    admin_ids = _add(q, admin, 1)
+    _pop_each(q, user)
+    assert started == [user_ids[0], admin_ids[0], user_ids[1], user_ids[2]]
+
+    # The running tasks of each user are capped, the slots that were
+    # reserved for the other tasks are released
+    del started[:]
+    capped = queue(user, name='capped', policy=PolicyType.FAIR_SHARE,
+                   max_running_per_user=1)
+    user_ids = _add(capped, user, 2)
+    admin_ids = _add(capped, admin, 2)
+    Queue().pop(capped, sys.maxsize, user)
+    assert sorted(started) == sorted([user_ids[0], admin_ids[0]])
+    _assert_counters(capped, pending=2, running=2)
+
+
+@pytest.mark.plugin('queues')
+def test_migrate_embedded_tasks(server, user, queue):
+    from queues.models.queue import Queue, migrate_embedded_tasks
+    from queues.models.queuetask import QueueTask, QueueType, TaskStatus
+
+    q = queue(user, type_=QueueType.LIFO)
+    pending = [ObjectId(), ObjectId()]
+    running = ObjectId()
+
+    # A queue that embeds its tasks
+    Queue().collection.update_one({
+        '_id': q['_id']
+    }, {
+        '$set': {
+            'pending': [{
+                'taskflowId': str(pending[0]),
+                'startParams': {
+                    'value': 1
+                }
+            }, {
+                'taskflowId': str(pending[1])
+            }],
+            'taskflows': {
+                str(pending[0]): TaskStatus.PENDING,
+                str(pending[1]): TaskStatus.PENDING,
+                str(running): TaskStatus.RUNNING
+            }
+        },
+        '$unset': {
+            'nPending': '',
+            'nRunning': '',
+            'seq': ''
+        }
+    })
+
+    migrate_embedded_tasks()
+    # A queue that has been migrated is left alone
+    migrate_embedded_tasks()
+
+    migrated = Queue().load(q['_id'], force=True)
+    assert 'pending' not in migrated
+    assert 'taskflows' not in migrated
+    assert migrated['seq'] == 2
+    _assert_counters(q, pending=2, running=1)
+
+    # The head of the list is still taken first
+    tasks = list(QueueTask().find_tasks(migrated, state=TaskStatus.PENDING))
+    assert [task['taskflowId'] for task in tasks] == pending
+    assert tasks[0]['startParams'] == {'value': 1}
+
+    tasks = list(QueueTask().find_tasks(migrated, state=TaskStatus.RUNNING))
+    assert [task['taskflowId'] for task in tasks] == [running]
+
+
+@pytest.mark.plugin('queues')
+def test_stats_prometheus(server, user, queue, started):
+    from cumulus.taskflow import TaskFlowState
+    from queues.models.queue import Queue
+
+    q = queue(user, name='the "stats" queue')
+    taskflow_ids = _add(q, user, 2)
+    Queue().pop(q, 1, user)
+    Queue().finish(q, {
+        '_id': taskflow_ids[0],
+        'status': TaskFlowState.COMPLETE
+    }, user)
+
+    r = server.request('/queues/%s/stats' % q['_id'], user=user)
+    assertStatusOk(r)
+    assert r.json['depth'] == 1
+    assert r.json['running'] == 0
+    assert [w['finished'] for w in r.json['windows']] == [1, 1, 1]
+
+    r = server.request('/queues/%s/stats' % q['_id'], user=user,
+                       params={'format': 'prometheus'}, isJson=False)
+    assertStatusOk(r)
+    assert r.headers['Content-Type'].startswith('text/plain')
+
+    lines = getResponseBody(r).splitlines()
+    labels = 'queue="%s",name="the \\"stats\\" queue"' % q['_id']
+    assert 'queue_depth{%s} 1' % labels in lines
+    assert 'queue_running{%s} 0' % labels in lines
+    for window in [300, 3600, 86400]:
+        assert 'queue_finished{%s,window="%ds"} 1' % (labels, window) in lines
+
+    # Each metric is typed once, the quantiles are labels of the metric
+    assert lines.count('# TYPE queue_wait_seconds gauge') == 1
+    prefix = 'queue_run_seconds{%s,window="300s",quantile="%s"} '
+    for quantile in ['0.5', '0.95']:
+        assert any(line.startswith(prefix % (labels, quantile))
+                   for line in lines)
@@ -1,5 +1,9 @@
 from .queue import Queue
 from .models.queue import on_taskflow_status_update, cleanup_failed_taskflows
+from .models.queue import migrate_embedded_tasks, CLEANUP_INTERVAL
+
+import cherrypy
+from cherrypy.process.plugins import Monitor
 
 from girder import events
 from girder.plugin import getPlugin, GirderPlugin
@@ -14,9 +18,13 @@ class QueuePlugin(GirderPlugin):
 
         info['apiRoot'].queues = Queue()
 
-        # Remove taskflows that are not running anymore from the list of running
-        # taskflows stored in the Queue model
-        cleanup_failed_taskflows()
+        # Move the tasks of the queues that embed them to queue_tasks
+        migrate_embedded_tasks()
+
+        # Periodically remove the taskflows that are not running anymore from
+        # the running tasks of the queues
+        Monitor(cherrypy.engine, cleanup_failed_taskflows,
+                frequency=CLEANUP_INTERVAL, name='queues.cleanup').subscribe()
 
         # Listen to changes in the status of the taskflows, and update the Queues
         # if needed
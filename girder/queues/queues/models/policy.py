@@ -0,0 +1,157 @@
+import pymongo
+
+from queues.models.queuetask import QueueTask as QueueTaskModel
+from queues.models.queuetask import QueueType, TaskStatus
+
+
+class SchedulingPolicy(object):
+    """
+    Chooses which pending tasks of a queue are started next.
+
+    The policy of a queue is named by its 'policy' field, new policies are
+    added with register_policy().
+    """
+
+    def order(self, queue):
+        """The sort of the pending tasks of a single user."""
+        seq_dir = pymongo.ASCENDING
+        if queue['type'] == QueueType.LIFO:
+            seq_dir = pymongo.DESCENDING
+
+        return [('priority', pymongo.DESCENDING), ('seq', seq_dir)]
+
+    def select(self, queue, count):
+        """:returns: The ids of up to count pending tasks to start."""
+        raise NotImplementedError()
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """
+    The tasks with the highest priority are started first, in FIFO or LIFO
+    order within a priority.
+    """
+
+    def select(self, queue, count):
+        tasks = QueueTaskModel().find({
+            'queueId': queue['_id'],
+            'state': TaskStatus.PENDING
+        }, fields=['_id'], limit=count, sort=self.order(queue))
+
+        return [task['_id'] for task in tasks]
+
+
+class FairSharePolicy(SchedulingPolicy):
+    """
+    The next task is taken from the user with the fewest running tasks, so a
+    user with many pending tasks doesn't hold up everybody else. Each user's
+    tasks are taken by priority, and the queue's maxRunningPerUser, if set,
+    caps the running tasks of each user.
+    """
+
+    def _running(self, queue):
+        pipeline = [{
+            '$match': {
+                'queueId': queue['_id'],
+                'state': TaskStatus.RUNNING
+            }
+        }, {
+            '$group': {
+                '_id': '$userId',
+                'count': {
+                    '$sum': 1
+                }
+            }
+        }]
+
+        return {
+            r['_id']: r['count']
+            for r in QueueTaskModel().collection.aggregate(pipeline)
+        }
+
+    def select(self, queue, count):
+        model = QueueTaskModel()
+        query = {
+            'queueId': queue['_id'],
+            'state': TaskStatus.PENDING
+        }
+        running = self._running(queue)
+        max_per_user = queue.get('maxRunningPerUser') or 0
+
+        # The next tasks of each user with pending tasks
+        heads = {}
+        for user_id in model.collection.distinct('userId', query):
+            limit = count
+            if max_per_user:
+                limit = min(count, max_per_user - running.get(user_id, 0))
+            if limit <= 0:
+                continue
+
+            heads[user_id] = list(model.find(
+                dict(query, userId=user_id), fields=['_id', 'priority', 'seq'],
+                limit=limit, sort=self.order(queue)))
+
+        seq_sign = -1 if queue['type'] == QueueType.LIFO else 1
+
+        def _key(user_id):
+            head = heads[user_id][0]
+            return (running.get(user_id, 0), -head['priority'],
+                    seq_sign * head['seq'])
+
+        selected = []
+        while len(selected) < count:
+            candidates = [user_id for user_id in heads if heads[user_id]]
+            if not candidates:
+                break
+
+            user_id = min(candidates, key=_key)
+            selected.append(heads[user_id].pop(0)['_id'])
+            running[user_id] = running.get(user_id, 0) + 1
+
+        return selected
+
+
+class PolicyType(object):
+    PRIORITY = 'priority'
+    FAIR_SHARE = 'fairshare'
+
+
+_policies = {
+    PolicyType.PRIORITY: PriorityPolicy(),
+    PolicyType.FAIR_SHARE: FairSharePolicy()
+}
+
+
+def register_policy(name, policy):
+    _policies[name] = policy
+
+
+def policy_names():
+    return list(_policies.keys())
+
+
+def get_policy(queue):
+    return _policies.get(queue.get('policy', PolicyType.PRIORITY),
+                         _policies[PolicyType.PRIORITY])
+
+
+def weighted_shares(queues, count):
+    """
+    Split count between the queues in proportion to their weight, with the
+    largest remainder method.
+
+    :returns: The share of each queue, in the same order.
+    """
+    weights = [max(queue.get('weight', 1), 0) for queue in queues]
+    total = sum(weights)
+    if total == 0:
+        weights = [1] * len(queues)
+        total = len(queues)
+
+    exact = [count * weight / float(total) for weight in weights]
+    shares = [int(x) for x in exact]
+    by_remainder = sorted(range(len(queues)),
+                          key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in by_remainder[:count - sum(shares)]:
+        shares[i] += 1
+
+    return shares
@@ -1,5 +1,9 @@
 import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from bson.objectid import ObjectId, InvalidId
+from pymongo import ReturnDocument
 from girder import logger
 from girder.constants import AccessType
 from girder.models.model_base import AccessControlledModel
@@ -11,6 +15,12 @@ import cumulus
 from cumulus.taskflow import load_class, TaskFlowState
 from taskflow.models.taskflow import Taskflow as TaskflowModel
 
+from queues.models.queuetask import QueueTask as QueueTaskModel
+from queues.models.queuetask import QueueType, TaskStatus
+from queues.models.policy import PolicyType, weighted_shares
+from queues.models.queuehistory import QueueTaskHistory as QueueTaskHistoryModel
+from queues.models.queuehistory import percentile
+
 TASKFLOW_NON_RUNNING_STATES = [
     TaskFlowState.CREATED,
     TaskFlowState.COMPLETE,
@@ -20,21 +30,26 @@ TASKFLOW_NON_RUNNING_STATES = [
     TaskFlowState.DELETED
 ]
 
-class QueueType(object):
-    FIFO = 'fifo'
-    LIFO = 'lifo'
-    TYPES = [FIFO, LIFO]
+# The number of taskflows started at the same time by a pop
+START_WORKERS = 8
+
+# How often the running taskflows are checked, in seconds. Their status
+# updates normally finish them, this catches the updates that were missed.
+CLEANUP_INTERVAL = 5 * 60
+HEARTBEAT_THRESHOLD = 10 * 60
+CLEANUP_BATCH_SIZE = 1000
 
-class TaskStatus(object):
-    PENDING = 'pending'
-    RUNNING = 'running'
+# The start time and duration of the last pops of each queue, in this process
+POP_LATENCY_SAMPLES = 1000
+_pop_latencies = defaultdict(lambda: deque(maxlen=POP_LATENCY_SAMPLES))
 
 class Queue(AccessControlledModel):
 
     def initialize(self):
         self.name = 'queues'
         self.ensureIndices(['name'])
-        self.mutable_props = ['maxRunning']
+        self.mutable_props = ['maxRunning', 'maxRunningPerUser', 'policy',
+                              'weight']
 
     def validate(self, queue):
         name = queue['name']
@@ -71,15 +86,19 @@ class Queue(AccessControlledModel):
             for r  in cursor:
                 yield r
 
-    def create(self, name, type_, max_running, user=None):
+    def create(self, name, type_, max_running, user=None,
+               policy=PolicyType.PRIORITY, max_running_per_user=0, weight=1):
 
         queue = {
             'name': name,
             'type': type_,
+            'policy': policy,
+            'weight': weight,
             'nRunning': 0,
             'maxRunning': max_running,
-            'pending': [],
-            'taskflows': {}
+            'maxRunningPerUser': max_running_per_user,
+            'nPending': 0,
+            'seq': 0
         }
 
         userId = None
@@ -92,6 +111,12 @@ class Queue(AccessControlledModel):
 
         return self.save(queue)
 
+    def remove(self, queue, **kwargs):
+        QueueTaskModel().remove_queue(queue['_id'])
+        QueueTaskHistoryModel().remove_queue(queue['_id'])
+
+        return super(Queue, self).remove(queue, **kwargs)
+
     def apply_updates(self, queue, model_updates, user):
         query = {
             '_id': queue['_id']
@@ -109,130 +134,195 @@ class Queue(AccessControlledModel):
 
         return queue
 
-    def add(self, queue, taskflow, params, user):
-        query = {
-            '_id': queue['_id'],
-            'taskflows.%s' % taskflow['_id']: {
-                '$exists': False
+    def add(self, queue, taskflow, params, user, priority=0):
+        # Take the next sequence number, the task is counted as pending
+        # before it is inserted so a pop never misses it
+        current = self.collection.find_one_and_update({
+            '_id': queue['_id']
+        }, {
+            '$inc': {
+                'seq': 1,
+                'nPending': 1
             }
-        }
-
-        payload = {
-            'taskflowId': taskflow['_id'],
-            'startParams': params
-        }
+        }, return_document=ReturnDocument.AFTER)
 
-        if queue['type'] == QueueType.FIFO:
-            push = {
-                'pending': payload
-            }
-        else:
-            push = {
-                'pending': {
-                    '$each': [ payload ],
-                    '$position': 0
-                }
-            }
+        task = QueueTaskModel().create(queue['_id'], taskflow['_id'], params,
+                                       current['seq'], priority=priority,
+                                       user_id=user['_id'])
+        if task is None:
+            # The taskflow is already in the queue
+            self.update({'_id': queue['_id']}, {'$inc': {'nPending': -1}})
 
-        updates = {
-            '$push': push,
-            '$set': {
-                'taskflows.%s' % taskflow['_id']: TaskStatus.PENDING
-            }
-        }
-        self.update(query, updates)
         queue = self.load(queue['_id'], user=user, level=AccessType.READ)
         return queue
 
     def pop(self, queue, limit, user):
+        queue, _ = self._pop(queue, limit, user)
+
+        return queue
+
+    def pop_weighted(self, queues, limit, user):
+        """
+        Pop up to limit tasks from several queues, shared between them in
+        proportion to their weight. The share a queue can't use is handed to
+        the others.
+
+        :returns: The number of tasks popped.
+        """
+        if limit >= sys.maxsize:
+            return sum(self._pop(queue, limit, user)[1] for queue in queues)
+
+        total = 0
+        queues = list(queues)
+        while limit > total and queues:
+            remaining = limit - total
+            shares = weighted_shares(queues, remaining)
+            full = []
+            for queue, share in zip(queues, shares):
+                if share == 0:
+                    full.append(queue)
+                    continue
+
+                _, popped = self._pop(queue, share, user)
+                total += popped
+                if popped == share:
+                    full.append(queue)
+
+            # Every round either pops tasks or drops a queue
+            if limit - total == remaining and len(full) == len(queues):
+                break
+            queues = full
+
+        return total
+
+    def _pop(self, queue, limit, user):
+        start = time.time()
         queue, popped = self._pop_many(queue, limit, user)
+        _pop_latencies[queue['_id']].append((start, time.time() - start))
 
-        for task in popped:
+        if len(popped) == 1:
+            task = popped[0]
             self._start_taskflow(queue['_id'], task['taskflowId'], task['start_params'], user)
+        elif popped:
+            # Start the taskflows concurrently, the first error is raised
+            # once they have all been started
+            workers = min(len(popped), START_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self._start_taskflow, queue['_id'],
+                                    task['taskflowId'], task['start_params'],
+                                    user)
+                    for task in popped
+                ]
+            for future in futures:
+                future.result()
+
+        return queue, len(popped)
+
+    def stats(self, queue, windows=QueueTaskHistoryModel.WINDOWS):
+        """
+        The depth of the queue, its running tasks and, over sliding windows,
+        its throughput, the wait and run time percentiles of its tasks and
+        the latency of its pops in this process.
+        """
+        current = self.collection.find_one(
+            {'_id': queue['_id']}, projection=['nRunning', 'nPending'])
+        stats = {
+            'depth': current['nPending'],
+            'running': current['nRunning'],
+            'maxRunning': queue['maxRunning'],
+            'windows': QueueTaskHistoryModel().stats(queue['_id'], windows)
+        }
 
-        return queue
+        now = time.time()
+        latencies = list(_pop_latencies[queue['_id']])
+        for window in stats['windows']:
+            durations = sorted(duration for start, duration in latencies
+                               if start >= now - window['window'])
+            window['popLatency'] = {
+                'p50': percentile(durations, 0.5),
+                'p95': percentile(durations, 0.95)
+            }
+
+        return stats
 
     def finish(self, queue, taskflow, user):
         query = {
-            '_id': queue['_id'],
-            'taskflows.%s' % taskflow['_id']: TaskStatus.RUNNING
+            '_id': queue['_id']
         }
 
-        updates = {
-            '$inc': {
-                'nRunning': -1
-            },
-            '$unset': {
-                'taskflows.%s' % taskflow['_id']: ""
-            }
-        }
+        if QueueTaskModel().finish(queue['_id'], taskflow['_id']):
+            self.update(query, {'$inc': {'nRunning': -1}})
+        elif taskflow.get('status') != TaskFlowState.CREATED and \
+                QueueTaskModel().remove_pending(queue['_id'], taskflow['_id']):
+            # The taskflow ended, or was deleted, before it was started
+            self.update(query, {'$inc': {'nPending': -1}})
 
-        self.update(query, updates)
         queue = self.load(queue['_id'], user=user, level=AccessType.READ)
         return queue
 
-    def _pop_one(self, queue, user):
+    def _pop_many(self, queue, limit, user):
+        """
+        Reserve up to limit run slots for the pending tasks with a single
+        update of the counters of the queue, then claim that many tasks.
+        """
         max_running = queue['maxRunning']
 
         if max_running == 0:
             max_running = sys.maxsize
 
-        query = {
-            '_id': queue['_id'],
-            'nRunning': {
-                '$lt': max_running
-            },
-            '$where': 'this.pending.length > 0'
-        }
-
-        updates = {
-            '$inc': {
-                'nRunning': 1
-            },
-            '$pop': {
-                'pending': -1
+        count = 0
+        while True:
+            current = self.collection.find_one(
+                {'_id': queue['_id']}, projection=['nRunning', 'nPending'])
+            if current is None:
+                return queue, []
+
+            count = min(limit, max_running - current['nRunning'],
+                        current['nPending'])
+            if count <= 0:
+                count = 0
+                break
+
+            query = {
+                '_id': queue['_id'],
+                'nRunning': {
+                    '$lte': max_running - count
+                },
+                'nPending': {
+                    '$gte': count
+                }
             }
-        }
-
-        # queue is the document BEFORE the updates
-        queue = self.collection.find_one_and_update(query, updates)
-        taskflow_id = None
-        start_params = None
 
-        if queue is None:
-            return queue, taskflow_id, start_params
-
-        n_running = queue['nRunning']
-        pending = queue['pending']
-        if (n_running >= max_running or len(pending) == 0):
-            return queue, taskflow_id, start_params
-
-        task = pending.pop(0)
-        taskflow_id = task['taskflowId']
-        start_params = task['startParams']
-
-        query = {
-            '_id': queue['_id']
-        }
-
-        updates = {
-            '$set': {
-                'taskflows.%s' % taskflow_id: TaskStatus.RUNNING
+            updates = {
+                '$inc': {
+                    'nRunning': count,
+                    'nPending': -count
+                }
             }
-        }
-
-        self.update(query, updates)
-        queue = self.load(queue['_id'], user=user, level=AccessType.READ)
 
-        return queue, taskflow_id, start_params
+            if self.collection.update_one(query, updates).modified_count == 1:
+                break
 
-    def _pop_many(self, queue, limit, user):
         popped = []
-        queue_, taskflow_id, start_params = self._pop_one(queue, user)
-        while taskflow_id is not None and len(popped) < limit:
-            queue = queue_
-            popped.append({'taskflowId': taskflow_id, 'start_params': start_params})
-            queue_, taskflow_id, start_params = self._pop_one(queue, user)
+        if count > 0:
+            tasks = QueueTaskModel().claim(queue, count)
+            if len(tasks) < count:
+                # Release the slots of the tasks that were not found
+                missing = count - len(tasks)
+                self.update({'_id': queue['_id']}, {
+                    '$inc': {
+                        'nRunning': -missing,
+                        'nPending': missing
+                    }
+                })
+
+            popped = [{
+                'taskflowId': task['taskflowId'],
+                'start_params': task['startParams']
+            } for task in tasks]
+
+        queue = self.load(queue['_id'], user=user, level=AccessType.READ)
 
         return queue, popped
 
@@ -257,19 +347,121 @@ class Queue(AccessControlledModel):
 
         return workflow
 
-def cleanup_failed_taskflows():
-    queues = list(Queue().find(limit=sys.maxsize, force=True))
-    for queue in queues:
-        user = UserModel().load(queue['userId'], force=True)
-        if user is None:
+def migrate_embedded_tasks():
+    # Queues created before their tasks were moved to the queue_tasks
+    # collection embed them in the pending list and the taskflows dict.
+    query = {
+        'taskflows': {
+            '$exists': True
+        }
+    }
+    for queue in Queue().collection.find(query):
+        pending = queue.get('pending', [])
+        taskflows = queue['taskflows']
+        tasks = []
+
+        # The head of the list is taken first
+        for i, payload in enumerate(pending):
+            if queue['type'] == QueueType.LIFO:
+                seq = len(pending) - i
+            else:
+                seq = i + 1
+
+            tasks.append({
+                'queueId': queue['_id'],
+                'taskflowId': ObjectId(payload['taskflowId']),
+                'userId': queue['userId'],
+                'state': TaskStatus.PENDING,
+                'priority': 0,
+                'seq': seq,
+                'startParams': payload.get('startParams')
+            })
+
+        for taskflow_id, status in taskflows.items():
+            if status == TaskStatus.RUNNING:
+                tasks.append({
+                    'queueId': queue['_id'],
+                    'taskflowId': ObjectId(taskflow_id),
+                    'userId': queue['userId'],
+                    'state': TaskStatus.RUNNING,
+                    'priority': 0,
+                    'seq': 0,
+                    'startParams': None
+                })
+
+        QueueTaskModel().create_many(tasks)
+
+        n_running = sum(1 for status in taskflows.values()
+                        if status == TaskStatus.RUNNING)
+        Queue().collection.update_one({
+            '_id': queue['_id']
+        }, {
+            '$set': {
+                'nPending': len(pending),
+                'nRunning': n_running,
+                'seq': len(pending)
+            },
+            '$unset': {
+                'pending': '',
+                'taskflows': ''
+            }
+        })
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _check_running_tasks(tasks):
+    # Group the tasks whose taskflow is not running anymore by queue
+    stale = {}
+    ids = [task['taskflowId'] for task in tasks]
+    taskflows = {
+        taskflow['_id']: taskflow['status']
+        for taskflow in TaskflowModel().find({'_id': {'$in': ids}},
+                                             fields=['status'])
+    }
+
+    checked = []
+    for task in tasks:
+        status = taskflows.get(task['taskflowId'])
+        if status is None or status in TASKFLOW_NON_RUNNING_STATES:
+            logger.warning("Removing non-running taskflow {} from the queue {}".format(task['taskflowId'], task["queueId"]))
+            stale.setdefault(task['queueId'], []).append(task['_id'])
+        else:
+            checked.append(task['_id'])
+
+    QueueTaskModel().set_checked(checked)
+
+    return stale
+
+def cleanup_failed_taskflows(heartbeat=HEARTBEAT_THRESHOLD):
+    """
+    Remove the running tasks whose taskflow is not running anymore, their
+    status update was missed, and fill the slots they held. Only the tasks
+    that have not been checked for heartbeat seconds are inspected, all of
+    them if heartbeat is None.
+    """
+    tasks = list(QueueTaskModel().find_unchecked(heartbeat))
+
+    stale = {}
+    for chunk in _chunks(tasks, CLEANUP_BATCH_SIZE):
+        for queue_id, ids in _check_running_tasks(chunk).items():
+            stale.setdefault(queue_id, []).extend(ids)
+
+    for queue_id, ids in stale.items():
+        removed = QueueTaskModel().finish_many(queue_id, ids)
+        if removed == 0:
             continue
 
-        for taskflow_id, status in queue['taskflows'].items():
-            if status == TaskStatus.RUNNING:
-                taskflow = TaskflowModel().load(taskflow_id, force=True)
-                if taskflow['status'] in TASKFLOW_NON_RUNNING_STATES:
-                    logger.warning("Removing non-running taskflow {} from the queue {}".format(taskflow_id, queue["_id"]))
-                    Queue().finish(queue, taskflow, user)
+        Queue().update({'_id': queue_id}, {'$inc': {'nRunning': -removed}})
+
+        queue = Queue().load(queue_id, force=True)
+        if queue is None:
+            continue
+
+        user = UserModel().load(queue['userId'], force=True)
+        if user is not None:
+            Queue().pop(queue, sys.maxsize, user)
 
 def on_taskflow_status_update(event):
     taskflow = event.info['taskflow']
@@ -279,6 +471,10 @@ def on_taskflow_status_update(event):
 
     if taskflow['status'] in TASKFLOW_NON_RUNNING_STATES:
         queue = Queue().load(queue_id, force=True)
+        if queue is None:
+            # The queue has been deleted along with its tasks
+            return
+
         user = UserModel().load(queue['userId'], force=True)
         Queue().finish(queue, taskflow, user)
         Queue().pop(queue, sys.maxsize, user)
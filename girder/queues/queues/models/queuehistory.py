@@ -0,0 +1,120 @@
+import datetime
+import pymongo
+
+from girder.models.model_base import Model
+
+
+def percentile(values, q):
+    # Nearest rank percentile of sorted values
+    if not values:
+        return None
+
+    rank = int(round(q * (len(values) - 1)))
+    return values[rank]
+
+
+class QueueTaskHistory(Model):
+    """
+    The timings of the finished tasks of the queues, kept for HISTORY_TTL
+    seconds.
+
+    {
+        'queueId': ObjectId,
+        'taskflowId': ObjectId,
+        'userId': ObjectId,
+        'created': datetime,
+        'started': datetime,
+        'finished': datetime,
+        'waitTime': <seconds between created and started>,
+        'runTime': <seconds between started and finished>
+    }
+    """
+
+    HISTORY_TTL = 7 * 24 * 60 * 60
+
+    # The sliding windows of the statistics, in seconds
+    WINDOWS = [5 * 60, 60 * 60, 24 * 60 * 60]
+
+    def initialize(self):
+        self.name = 'queue_task_history'
+        self.ensureIndices([
+            ([('queueId', pymongo.ASCENDING), ('finished', pymongo.ASCENDING)],
+             {}),
+            ('finished', {'expireAfterSeconds': self.HISTORY_TTL})
+        ])
+
+    def validate(self, doc):
+        return doc
+
+    def _entry(self, task, finished):
+        created = task.get('created')
+        started = task.get('started')
+
+        def _seconds(start, end):
+            if start is None or end is None:
+                return None
+            return (end - start).total_seconds()
+
+        return {
+            'queueId': task['queueId'],
+            'taskflowId': task['taskflowId'],
+            'userId': task.get('userId'),
+            'created': created,
+            'started': started,
+            'finished': finished,
+            'waitTime': _seconds(created, started),
+            'runTime': _seconds(started, finished)
+        }
+
+    def record(self, task):
+        """Record the timings of a task that has just finished."""
+        return self.save(self._entry(task, datetime.datetime.utcnow()))
+
+    def record_many(self, tasks):
+        """Record the timings of several tasks with a single insert."""
+        finished = datetime.datetime.utcnow()
+        entries = [self._entry(task, finished) for task in tasks]
+        if entries:
+            self.collection.insert_many(entries)
+
+    def remove_queue(self, queue_id):
+        self.removeWithQuery({'queueId': queue_id})
+
+    def stats(self, queue_id, windows=WINDOWS):
+        """
+        The throughput and the wait and run time percentiles of the tasks
+        that finished within each window.
+        """
+        now = datetime.datetime.utcnow()
+        oldest = now - datetime.timedelta(seconds=max(windows))
+        history = list(self.collection.find({
+            'queueId': queue_id,
+            'finished': {
+                '$gte': oldest
+            }
+        }, projection=['finished', 'waitTime', 'runTime']))
+
+        results = []
+        for window in sorted(windows):
+            start = now - datetime.timedelta(seconds=window)
+            tasks = [task for task in history if task['finished'] >= start]
+            wait_times = sorted(task['waitTime'] for task in tasks
+                                if task.get('waitTime') is not None)
+            run_times = sorted(task['runTime'] for task in tasks
+                               if task.get('runTime') is not None)
+
+            results.append({
+                'window': window,
+                'finished': len(tasks),
+                'throughput': len(tasks) * 60.0 / window,
+                'waitTime': {
+                    'p50': percentile(wait_times, 0.5),
+                    'p95': percentile(wait_times, 0.95)
+                },
+                'runTime': {
+                    'p50': percentile(run_times, 0.5),
+                    'p95': percentile(run_times, 0.95)
+                }
+            })
+
+        return results
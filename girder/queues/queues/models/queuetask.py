@@ -0,0 +1,222 @@
+import datetime
+import pymongo
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from girder.models.model_base import Model
+
+from queues.models.queuehistory import QueueTaskHistory as QueueTaskHistoryModel
+
+
+class QueueType(object):
+    FIFO = 'fifo'
+    LIFO = 'lifo'
+    TYPES = [FIFO, LIFO]
+
+class TaskStatus(object):
+    PENDING = 'pending'
+    RUNNING = 'running'
+
+
+class QueueTask(Model):
+    """
+    The taskflows of the queues, one document per taskflow while it is
+    pending or running.
+
+    The scheduling policy of the queue chooses the tasks that are taken. seq
+    increases as tasks are added to the queue, a FIFO queue takes the lowest
+    seq first and a LIFO queue the highest.
+    """
+
+    def initialize(self):
+        self.name = 'queue_tasks'
+        self.ensureIndices([
+            ([('queueId', pymongo.ASCENDING), ('state', pymongo.ASCENDING),
+              ('priority', pymongo.DESCENDING), ('seq', pymongo.ASCENDING)],
+             {}),
+            ([('queueId', pymongo.ASCENDING),
+              ('taskflowId', pymongo.ASCENDING)], {'unique': True}),
+            ([('queueId', pymongo.ASCENDING), ('state', pymongo.ASCENDING),
+              ('userId', pymongo.ASCENDING), ('priority', pymongo.DESCENDING),
+              ('seq', pymongo.ASCENDING)], {}),
+            ([('state', pymongo.ASCENDING), ('taskflowId', pymongo.ASCENDING)],
+             {}),
+            ('claim', {'sparse': True}),
+            ([('state', pymongo.ASCENDING), ('checked', pymongo.ASCENDING)],
+             {})
+        ])
+
+    def validate(self, task):
+        return task
+
+    def create(self, queue_id, taskflow_id, params, seq, priority=0,
+               user_id=None):
+        """
+        Add a pending task, returns None if the taskflow is already in the
+        queue.
+        """
+        task = {
+            'queueId': queue_id,
+            'taskflowId': ObjectId(taskflow_id),
+            'userId': user_id,
+            'state': TaskStatus.PENDING,
+            'priority': priority,
+            'seq': seq,
+            'startParams': params,
+            'created': datetime.datetime.utcnow()
+        }
+
+        try:
+            return self.save(task)
+        except DuplicateKeyError:
+            return None
+
+    def create_many(self, tasks):
+        """Insert tasks, the ones already in their queue are skipped."""
+        if not tasks:
+            return
+
+        try:
+            self.collection.insert_many(tasks, ordered=False)
+        except BulkWriteError:
+            pass
+
+    def _order(self, queue):
+        from queues.models.policy import get_policy
+
+        return get_policy(queue).order(queue)
+
+    def find_tasks(self, queue, state=None, offset=0, limit=0):
+        """The tasks of the queue in the order they are taken."""
+        query = {
+            'queueId': queue['_id']
+        }
+        if state is not None:
+            query['state'] = state
+
+        return self.find(query, offset=offset, limit=limit,
+                         sort=self._order(queue))
+
+    def claim(self, queue, count):
+        """
+        Mark the next count pending tasks of the queue, as chosen by its
+        scheduling policy, as running.
+
+        :returns: The claimed tasks, fewer than count if there are not enough
+            pending tasks.
+        """
+        from queues.models.policy import get_policy
+
+        policy = get_policy(queue)
+        token = ObjectId()
+        claimed = []
+        while len(claimed) < count:
+            ids = policy.select(queue, count - len(claimed))
+            if not ids:
+                break
+
+            now = datetime.datetime.utcnow()
+
+            # Concurrent pops may take some of these tasks first, the claim
+            # token identifies the ones taken by this pop
+            self.collection.update_many({
+                '_id': {
+                    '$in': ids
+                },
+                'state': TaskStatus.PENDING
+            }, {
+                '$set': {
+                    'state': TaskStatus.RUNNING,
+                    'claim': token,
+                    'started': now,
+                    'checked': now
+                }
+            })
+            claimed = list(self.find({'claim': token},
+                                     sort=self._order(queue)))
+
+        return claimed
+
+    def find_unchecked(self, threshold=None):
+        """
+        The running tasks that have not been checked for threshold seconds,
+        or all the running tasks if threshold is None.
+        """
+        query = {
+            'state': TaskStatus.RUNNING
+        }
+        if threshold is not None:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=threshold)
+            # Tasks that were never checked have no date
+            query['checked'] = {
+                '$not': {
+                    '$gte': cutoff
+                }
+            }
+
+        return self.find(query, fields=['_id', 'queueId', 'taskflowId'])
+
+    def set_checked(self, ids):
+        self.collection.update_many({
+            '_id': {
+                '$in': ids
+            }
+        }, {
+            '$set': {
+                'checked': datetime.datetime.utcnow()
+            }
+        })
+
+    def _finish(self, query):
+        query['state'] = TaskStatus.RUNNING
+        task = self.collection.find_one_and_delete(query)
+        if task is None:
+            return False
+
+        QueueTaskHistoryModel().record(task)
+
+        return True
+
+    def finish_many(self, queue_id, ids):
+        """
+        Remove running tasks with a single delete, returns the number
+        removed.
+        """
+        query = {
+            '_id': {
+                '$in': ids
+            },
+            'queueId': queue_id,
+            'state': TaskStatus.RUNNING
+        }
+        tasks = list(self.collection.find(query, projection=[
+            'queueId', 'taskflowId', 'userId', 'created', 'started']))
+        if not tasks:
+            return 0
+
+        query['_id'] = {
+            '$in': [task['_id'] for task in tasks]
+        }
+        removed = self.collection.delete_many(query).deleted_count
+        QueueTaskHistoryModel().record_many(tasks)
+
+        return removed
+
+    def finish(self, queue_id, taskflow_id):
+        """Remove a running task, returns True if it was removed."""
+        return self._finish({
+            'queueId': queue_id,
+            'taskflowId': ObjectId(taskflow_id)
+        })
+
+    def remove_pending(self, queue_id, taskflow_id):
+        """Remove a pending task, returns True if it was removed."""
+        return self.collection.delete_one({
+            'queueId': queue_id,
+            'taskflowId': ObjectId(taskflow_id),
+            'state': TaskStatus.PENDING
+        }).deleted_count == 1
+
+    def remove_queue(self, queue_id):
+        self.removeWithQuery({'queueId': queue_id})
@@ -5,12 +5,15 @@ from girder.api import access
 from girder.api.describe import Description, autoDescribeRoute
 from girder.api.rest import Resource
 from girder.api.rest import RestException, loadmodel, getCurrentUser
+from girder.api.rest import setResponseHeader, setRawResponse
 from girder.constants import AccessType, TokenScope
 from girder.constants import TerminalColor
 from girder.models.file import File
 
 from queues.models.queue import Queue as QueueModel
 from queues.models.queue import QueueType, TaskStatus
+from queues.models.queuetask import QueueTask as QueueTaskModel
+from queues.models.policy import PolicyType, policy_names
 from taskflow.models.taskflow import Taskflow as TaskflowModel
 
 from cumulus.taskflow import load_class
@@ -28,7 +31,9 @@ class Queue(Resource):
         self.route('PUT', (':id', ), self.set_max_running)
         self.route('PUT', (':id', 'add', ':taskflowId'), self.add_task)
         self.route('PUT', (':id', 'pop'), self.pop_task)
+        self.route('PUT', ('pop',), self.pop_tasks)
         self.route('GET', (':id', 'taskflows'), self.get_tasks)
+        self.route('GET', (':id', 'stats'), self.get_stats)
 
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -45,15 +50,25 @@ class Queue(Resource):
         .param('name', 'The queue name')
         .param('type', 'The queue type', required=False)
         .param('maxRunning', 'The max number of taskflows that can be running at the same time', required=False, dataType='integer', default=0)
+        .param('policy', 'The scheduling policy', required=False, enum=policy_names(), default=PolicyType.PRIORITY)
+        .param('maxRunningPerUser', 'The max number of taskflows of a user that can be running at the same time, with the fairshare policy', required=False, dataType='integer', default=0)
+        .param('weight', 'The share of the queue when popping several queues', required=False, dataType='integer', default=1)
     )
-    def create(self, name, type, maxRunning):
+    def create(self, name, type, maxRunning, policy, maxRunningPerUser, weight):
         if type is None or type.lower() not in QueueType.TYPES:
             type = QueueType.FIFO
 
         if maxRunning < 0:
             raise RestException('Invalid maxRunning parameter. maxRunning must be >= 0')
 
-        queue = QueueModel().create(name, type_=type, max_running=maxRunning, user=self.getCurrentUser())
+        if maxRunningPerUser < 0:
+            raise RestException('Invalid maxRunningPerUser parameter. maxRunningPerUser must be >= 0')
+
+        if weight < 0:
+            raise RestException('Invalid weight parameter. weight must be >= 0')
+
+        queue = QueueModel().create(name, type_=type, max_running=maxRunning, user=self.getCurrentUser(),
+                                    policy=policy, max_running_per_user=maxRunningPerUser, weight=weight)
         cherrypy.response.status = 201
         return queue
 
@@ -81,19 +96,28 @@ class Queue(Resource):
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
-        Description('Change the maximum number of running jobs in the queue')
+        Description('Change the maximum number of running jobs or the scheduling of the queue')
         .modelParam('id', 'The queue id',
                     model=QueueModel, destName='queue',
                     level=AccessType.WRITE, paramType='path')
-        .param('maxRunning', 'The max number of taskflows that can be running at the same time', required=True, dataType='integer')
+        .param('maxRunning', 'The max number of taskflows that can be running at the same time', required=False, dataType='integer')
+        .param('policy', 'The scheduling policy', required=False, enum=policy_names())
+        .param('maxRunningPerUser', 'The max number of taskflows of a user that can be running at the same time, with the fairshare policy', required=False, dataType='integer')
+        .param('weight', 'The share of the queue when popping several queues', required=False, dataType='integer')
     )
-    def set_max_running(self, queue, maxRunning):
-        if maxRunning < 0:
-            raise RestException('Invalid maxRunning parameter. maxRunning must be >= 0')
+    def set_max_running(self, queue, maxRunning, policy, maxRunningPerUser, weight):
+        updates = {}
+        for name, value in [('maxRunning', maxRunning),
+                            ('maxRunningPerUser', maxRunningPerUser),
+                            ('weight', weight)]:
+            if value is None:
+                continue
+            if value < 0:
+                raise RestException('Invalid %s parameter. %s must be >= 0' % (name, name))
+            updates[name] = value
 
-        updates = {
-            'maxRunning': maxRunning
-        }
+        if policy is not None:
+            updates['policy'] = policy
 
         queue = QueueModel().apply_updates(queue, updates, self.getCurrentUser())
         return queue
@@ -108,9 +132,10 @@ class Queue(Resource):
                     model=TaskflowModel, destName='taskflow',
                     level=AccessType.WRITE, paramType='path')
         .jsonParam('body', 'The taskflow start parameters', required=False, paramType='body')
+        .param('priority', 'The priority of the taskflow, higher priorities are started first', required=False, dataType='integer', default=0)
     )
-    def add_task(self, queue, taskflow, body):
-        queue = QueueModel().add(queue, taskflow, body, self.getCurrentUser())
+    def add_task(self, queue, taskflow, body, priority):
+        queue = QueueModel().add(queue, taskflow, body, self.getCurrentUser(), priority=priority)
         return queue
 
     @access.user(scope=TokenScope.DATA_WRITE)
@@ -131,22 +156,73 @@ class Queue(Resource):
 
         return queue
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Pop tasks from all the queues of the user, shared in proportion to their weight')
+        .param('limit', 'The max number of tasks to pop', dataType='integer', required=False)
+    )
+    def pop_tasks(self, limit):
+        if limit is None:
+            limit = sys.maxsize
+        elif limit < 0:
+            raise RestException('Invalid limit parameter. limit must be >= 0')
+
+        user = self.getCurrentUser()
+        queues = QueueModel().find(owner=user['_id'], user=user)
+        popped = QueueModel().pop_weighted(queues, limit, user)
+
+        return {
+            'popped': popped
+        }
+
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
-        Description('Fetch the pending TaskFlows.')
+        Description('Fetch the statistics of a queue.')
+        .notes('The throughput (tasks per minute), the wait and run time percentiles '
+               '(seconds) and the pop latency percentiles are computed over sliding '
+               'windows of 5 minutes, 1 hour and 1 day.')
         .modelParam('id', 'The queue id',
                     model=QueueModel, destName='queue',
                     level=AccessType.READ, paramType='path')
+        .param('format', 'The format of the statistics', required=False,
+               enum=['json', 'prometheus'], default='json')
     )
-    def get_tasks(self, queue):
-        ids = queue['pending']
+    def get_stats(self, queue, format):
+        stats = QueueModel().stats(queue)
+        if format == 'prometheus':
+            setResponseHeader('Content-Type', 'text/plain; version=0.0.4')
+            setRawResponse()
+            return _prometheus(queue, stats)
+
+        return stats
+
+    def _taskflows(self, tasks):
+        # The taskflows of the tasks, in the same order
+        ids = [task['taskflowId'] for task in tasks]
         query = {
             '_id': {
                 '$in': ids
             }
         }
-        taskflows = TaskflowModel().find(query)
-        return taskflows
+        taskflows = {
+            taskflow['_id']: taskflow
+            for taskflow in TaskflowModel().find(query)
+        }
+
+        return [taskflows[id] for id in ids if id in taskflows]
+
+    @access.user(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Fetch the pending TaskFlows.')
+        .modelParam('id', 'The queue id',
+                    model=QueueModel, destName='queue',
+                    level=AccessType.READ, paramType='path')
+        .pagingParams(defaultSort=None)
+    )
+    def get_tasks(self, queue, limit, offset, sort):
+        tasks = QueueTaskModel().find_tasks(queue, state=TaskStatus.PENDING,
+                                            offset=offset, limit=limit)
+        return self._taskflows(tasks)
 
     @access.user(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -156,27 +232,53 @@ class Queue(Resource):
                     level=AccessType.READ, paramType='path')
         .param('status', 'Filter taskflows by status (%s|%s)' % (TaskStatus.RUNNING, TaskStatus.PENDING),
                required=False, default='')
+        .pagingParams(defaultSort=None)
     )
-    def running_tasks(self, queue, status):
-        if status not in [TaskStatus.RUNNING, TaskStatus.PENDING, '']:
-            status = ''
+    def running_tasks(self, queue, status, limit, offset, sort):
+        if status not in [TaskStatus.RUNNING, TaskStatus.PENDING]:
+            status = None
 
-        pending_ids = []
-        running_ids = []
+        tasks = QueueTaskModel().find_tasks(queue, state=status,
+                                            offset=offset, limit=limit)
+        return self._taskflows(tasks)
 
-        include_pending = status in [TaskStatus.PENDING, '']
-        include_running = status in [TaskStatus.RUNNING, '']
+QUANTILES = {
+    'p50': '0.5',
+    'p95': '0.95'
+}
 
-        for taskflow_id, taskflow_status in queue['taskflows'].items():
-            if taskflow_status == TaskStatus.PENDING and include_pending:
-                pending_ids.append(taskflow_id)
-            elif taskflow_status == TaskStatus.RUNNING and include_running:
-                running_ids.append(taskflow_id)
+def _prometheus(queue, stats):
+    labels = 'queue="%s",name="%s"' % (queue['_id'], queue['name'].replace('"', '\\"'))
+    lines = [
+        '# TYPE queue_depth gauge',
+        'queue_depth{%s} %d' % (labels, stats['depth']),
+        '# TYPE queue_running gauge',
+        'queue_running{%s} %d' % (labels, stats['running'])
+    ]
 
-        query = {
-            '_id': {
-                '$in': running_ids + pending_ids
-            }
-        }
-        taskflows = TaskflowModel().find(query)
-        return taskflows
+    metrics = [
+        ('queue_finished', 'finished', None),
+        ('queue_throughput_per_minute', 'throughput', None),
+        ('queue_wait_seconds', 'waitTime', 'p50'),
+        ('queue_wait_seconds', 'waitTime', 'p95'),
+        ('queue_run_seconds', 'runTime', 'p50'),
+        ('queue_run_seconds', 'runTime', 'p95'),
+        ('queue_pop_latency_seconds', 'popLatency', 'p50'),
+        ('queue_pop_latency_seconds', 'popLatency', 'p95')
+    ]
+    for name, key, quantile in metrics:
+        type_line = '# TYPE %s gauge' % name
+        if type_line not in lines:
+            lines.append(type_line)
+
+        for window in stats['windows']:
+            value = window[key]
+            window_labels = '%s,window="%ds"' % (labels, window['window'])
+            if quantile is not None:
+                value = value[quantile]
+                window_labels += ',quantile="%s"' % QUANTILES[quantile]
+            if value is None:
+                continue
+            lines.append('%s{%s} %s' % (name, window_labels, value))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,76 @@
+import sys
+import time
+import argparse
+from girder_client import GirderClient, HttpError
+
+# The girder_jobs statuses
+SUCCESS = 3
+ERROR = 4
+CANCELED = 5
+
+
+def export_semantic(config):
+    try:
+        target_port = None
+        if config.port:
+            target_port = config.port
+        target_scheme = None
+        if config.scheme:
+            target_scheme = config.scheme
+        target_apiroot = None
+        if config.apiroot:
+            target_apiroot = config.apiroot
+
+        client = GirderClient(host=config.host, port=target_port,
+                              scheme=target_scheme, apiRoot=target_apiroot)
+        client.authenticate(apiKey=config.apiKey)
+
+        params = {
+            'target': config.target
+        }
+        if config.path:
+            params['path'] = config.path
+        if config.resume:
+            params['resume'] = config.resume
+        if config.processes:
+            params['processes'] = config.processes
+
+        job = client.post('molecules/semantic/export', parameters=params)
+        print('Job ID: ' + job['_id'])
+
+        while job['status'] not in (SUCCESS, ERROR, CANCELED):
+            time.sleep(config.interval)
+            job = client.get('job/%s' % job['_id'])
+            progress = job.get('progress') or {}
+            if progress.get('total'):
+                print('Exported %d/%d molecules' % (progress['current'],
+                                                    progress['total']))
+
+        for line in job.get('log', []):
+            print(line, end='')
+
+        if job['status'] != SUCCESS:
+            print('Export failed, resume it with --resume ' + job['_id'],
+                  file=sys.stderr)
+            sys.exit(1)
+
+    except HttpError as error:
+        print(error.responseText, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ ==  '__main__':
+    parser = argparse.ArgumentParser(description='Command to export the semantic graphs of all molecules')
+
+    parser.add_argument('--host', help='Girder host', required=True)
+    parser.add_argument('--port', help='Girder port', required=False)
+    parser.add_argument('--scheme', help='Transport, http or https', required=False)
+    parser.add_argument('--apiroot', help='API root for target', required=False)
+    parser.add_argument('--apiKey', help='Girder API key', required=True)
+    parser.add_argument('--target', help='Where to export the graphs', choices=['file', 'jena', 'virtuoso'], default='file')
+    parser.add_argument('--path', help='Path of the gzipped N-Triples file on the server', required=False)
+    parser.add_argument('--resume', help='The id of an interrupted export job to continue', required=False)
+    parser.add_argument('--processes', help='The number of worker processes', type=int, required=False)
+    parser.add_argument('--interval', help='Seconds between progress checks', type=float, default=5)
+
+    config = parser.parse_args()
+    export_semantic(config)